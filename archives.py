@@ -0,0 +1,310 @@
+import fnmatch
+import os
+import queue
+import shutil
+import tarfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from utils import COPY_BUFFER_SIZE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXTRACT_WORKERS = 4
+
+ARCHIVE_SUFFIXES = [
+    (".tar.gz", "tar"),
+    (".tgz", "tar"),
+    (".tar.xz", "tar"),
+    (".txz", "tar"),
+    (".tar.bz2", "tar"),
+    (".tar.zst", "tar.zst"),
+    (".tzst", "tar.zst"),
+    (".tar", "tar"),
+    (".zip", "zip")
+]
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_format(filename: str):
+    """
+    Guess the archive format from a file name. Returns "zip", "tar" (with any
+    compression tarfile handles itself), "tar.zst" or None.
+    """
+    name = filename.lower()
+
+    for suffix, fmt in ARCHIVE_SUFFIXES:
+        if name.endswith(suffix):
+            return fmt
+
+    return None
+
+
+def detect_format(f):
+    """
+    Sniff the format of the seekable archive file f.
+    """
+    if zipfile.is_zipfile(f):
+        return "zip"
+
+    f.seek(0)
+
+    if f.read(4) == b"\x28\xb5\x2f\xfd":
+        return "tar.zst"
+
+    f.seek(0)
+
+    if tarfile.is_tarfile(f):
+        return "tar"
+
+    return None
+
+
+def is_streamable(fmt):
+    """
+    Zip files keep their index at the end, so only tars can be extracted while
+    they are still downloading.
+    """
+    if fmt == "tar":
+        return True
+
+    return fmt == "tar.zst" and zstandard is not None
+
+
+def require_zstandard():
+    if zstandard is None:
+        raise ArchiveError("Extracting .tar.zst archives requires the zstandard module.")
+
+
+def matches(name: str, include):
+    if not include:
+        return True
+
+    base = name.rsplit("/")[-1]
+
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(base, p) for p in include)
+
+
+def safe_destination(dest: str, name: str):
+    """
+    Where name should be extracted to, or None if it would escape dest.
+    """
+    name = name.replace("\\", "/").lstrip("/")
+    parts = [p for p in name.split("/") if p not in ("", ".")]
+
+    if len(parts) == 0 or ".." in parts:
+        return None
+
+    return os.path.join(dest, *parts)
+
+
+def write_member(source, target: str, mode=None):
+    Path(os.path.dirname(target)).mkdir(parents=True, exist_ok=True)
+
+    with open(target, "wb") as out:
+        shutil.copyfileobj(source, out, COPY_BUFFER_SIZE)
+
+    if mode:
+        os.chmod(target, mode & 0o777)
+
+
+def extract_tar_stream(fileobj, dest: str, include=None):
+    count = 0
+
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile() or not matches(member.name, include):
+                continue
+
+            target = safe_destination(dest, member.name)
+
+            if target is None:
+                continue
+
+            write_member(tar.extractfile(member), target, member.mode)
+            count += 1
+
+    return count
+
+
+def extract_zip(path, dest: str, include=None, workers=EXTRACT_WORKERS):
+    """
+    path may also be a function returning a new seekable file object for
+    the archive each time it is called.
+    """
+    opener = path if callable(path) else None
+
+    with zipfile.ZipFile(opener() if opener else path) as archive:
+        members = [m for m in archive.infolist()
+                   if not m.is_dir() and matches(m.filename, include)]
+
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def extract(member):
+        target = safe_destination(dest, member.filename)
+
+        if target is None:
+            return 0
+
+        # ZipFile objects can't be shared between threads, give each its own.
+        if not hasattr(local, "archive"):
+            local.archive = zipfile.ZipFile(opener() if opener else path)
+
+            with handles_lock:
+                handles.append(local.archive)
+
+        with local.archive.open(member) as source:
+            write_member(source, target, member.external_attr >> 16)
+
+        return 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(members)))) as pool:
+            return sum(pool.map(extract, members))
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def extract_file(path, dest: str, include=None, fmt=None, name=None):
+    """
+    Extract the archive at path into dest. Returns the number of files
+    extracted. path may also be a function returning a new seekable file
+    object for the archive, name is then used in errors.
+    """
+    opener = path if callable(path) else lambda: open(path, "rb")
+    name = name if name is not None else str(path)
+
+    if fmt is None:
+        with opener() as f:
+            fmt = detect_format(f)
+
+    if fmt == "zip":
+        return extract_zip(path, dest, include)
+
+    if fmt == "tar.zst":
+        require_zstandard()
+
+        with opener() as f:
+            return extract_tar_stream(zstandard.ZstdDecompressor().stream_reader(f), dest, include)
+
+    if fmt == "tar":
+        with opener() as f:
+            return extract_tar_stream(f, dest, include)
+
+    raise ArchiveError(name + " isn't a supported archive.")
+
+
+class StreamPipe:
+    """
+    A file-like object fed with chunks from another thread.
+    """
+
+    def __init__(self, max_chunks=64):
+        self.chunks = queue.Queue(max_chunks)
+        self.buffer = b""
+        self.pos = 0
+        self.eof = False
+        self.aborted = threading.Event()
+
+    def put(self, data):
+        while not self.aborted.is_set():
+            try:
+                self.chunks.put(data, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+        raise ArchiveError("The archive extractor stopped early.")
+
+    def __next_chunk(self):
+        while True:
+            try:
+                return self.chunks.get(timeout=0.1)
+            except queue.Empty:
+                if self.aborted.is_set():
+                    raise ArchiveError("The download was aborted.")
+
+    def read(self, n=-1):
+        while not self.eof and (n < 0 or len(self.buffer) - self.pos < n):
+            data = self.__next_chunk()
+
+            if data is None:
+                self.eof = True
+            else:
+                self.buffer = self.buffer[self.pos:] + data
+                self.pos = 0
+
+        if n < 0:
+            n = len(self.buffer) - self.pos
+
+        data = self.buffer[self.pos:self.pos + n]
+        self.pos += len(data)
+
+        return data
+
+
+class StreamExtractor:
+    """
+    Extracts a tar archive on a background thread while its bytes are still
+    arriving through write().
+    """
+
+    def __init__(self, dest: str, include=None, fmt="tar"):
+        self.pipe = StreamPipe()
+        self.count = 0
+        self.error = None
+
+        if fmt == "tar.zst":
+            require_zstandard()
+            fileobj = zstandard.ZstdDecompressor().stream_reader(self.pipe)
+        else:
+            fileobj = self.pipe
+
+        def run():
+            try:
+                self.count = extract_tar_stream(fileobj, dest, include)
+
+                # Drain anything after the end of the archive.
+                while self.pipe.read(COPY_BUFFER_SIZE):
+                    pass
+            except BaseException as e:
+                self.error = e
+                self.pipe.aborted.set()
+
+        self.thread = threading.Thread(target=run, name="extract", daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        self.pipe.put(data)
+
+    def finish(self):
+        try:
+            self.pipe.put(None)
+        except ArchiveError:
+            # The extractor already failed, report why below.
+            pass
+
+        self.thread.join()
+
+        if self.error is not None:
+            raise ArchiveError("Failed to extract the archive: " + str(self.error))
+
+        return self.count
+
+    def abort(self):
+        self.pipe.aborted.set()
+
+        try:
+            self.pipe.chunks.put_nowait(None)
+        except queue.Full:
+            pass
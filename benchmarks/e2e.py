@@ -0,0 +1,374 @@
+#!/usr/bin/python3
+"""
+End to end benchmark for install.py, entirely offline.
+
+Generates synthetic manifests with configs, downloads and repos, serves the
+downloads from a local http.server, clones the repos from local bare
+repositories and puts fake package managers and a git shim with a
+configurable latency first on PATH. Each mode is then run against a fresh
+HOME, once cold and once more as a rerun of the same HOME.
+
+Every run records its wall time, peak RSS and the rusage counters of the
+install.py process, and the counts, time and bytes per category from its
+--profile trace. The results are written as JSON, give an earlier results
+file with --compare to see what changed.
+
+Usage: benchmarks/e2e.py [--sizes n,n,...] [--modes mode,mode,...]
+                         [--manager-latency s] [--git-latency s] [--jobs n]
+                         [--output file] [--compare file] [--keep dir]
+"""
+
+import functools
+import http.server
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import KIND_REPO, KIND_URL, package_kind, write_manifest  # noqa: E402
+
+DEFAULT_SIZES = [10, 1000, 10000]
+# Keeps the number of packages a run installs around a thousand.
+ENABLED_EVERY = {10: 1, 1000: 1, 10000: 10}
+
+MODES = {
+    "install": ["install"],
+    "install_packages": ["install_packages"],
+    "install_configs": ["install_configs"],
+    "dry-run": ["install", "--dry-run"]
+}
+
+MANAGER = "apt"
+
+GIT_SHIM = """#!/bin/bash
+if [ -n "$FAKE_GIT_LATENCY" ]; then
+    sleep "$FAKE_GIT_LATENCY"
+fi
+
+exec {git} "$@"
+"""
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory: str):
+    """
+    Serve directory on a free local port, returns the server and its URL.
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return (server, "http://127.0.0.1:" + str(server.server_address[1]) + "/")
+
+
+def make_artifact(path: str, name: str):
+    data = ("#!/bin/sh\necho " + name + "\n").encode()
+
+    with tarfile.open(path, "w:gz") as tar:
+        info = tarfile.TarInfo("bin/" + name)
+        info.size = len(data)
+        info.mode = 0o755
+        tar.addfile(info, io.BytesIO(data))
+
+
+def make_template_repo(path: str, git: str):
+    work = path + ".work"
+    env = dict(os.environ, GIT_AUTHOR_NAME="bench", GIT_AUTHOR_EMAIL="bench@localhost",
+               GIT_COMMITTER_NAME="bench", GIT_COMMITTER_EMAIL="bench@localhost")
+
+    os.makedirs(work)
+
+    with open(os.path.join(work, "README"), "w") as f:
+        f.write("benchmark repository\n")
+
+    for cmd in (["init", "--quiet"], ["add", "README"], ["commit", "--quiet", "-m", "init"]):
+        subprocess.run([git, "-C", work] + cmd, check=True, env=env)
+
+    subprocess.run([git, "clone", "--quiet", "--bare", work, path], check=True)
+    shutil.rmtree(work)
+
+
+def make_workspace(directory: str, count: int, base_url: str, repo_dir: str, www: str, template: str):
+    """
+    Write a manifest of count packages and everything it refers to into
+    directory.
+    """
+    # Every manifest names its packages the same, keep their artifacts apart.
+    www = os.path.join(www, str(count))
+    repo_dir = os.path.join(repo_dir, str(count))
+    base_url += str(count) + "/"
+
+    for d in (directory, www, repo_dir):
+        os.makedirs(d)
+
+    manifest = write_manifest(os.path.join(directory, "packages_list.json"), count,
+                              enabled_every=ENABLED_EVERY.get(count, max(1, count // 1000)),
+                              base_url=base_url, repo_base="file://" + repo_dir + "/")
+    answers = {"detected": "install", "packages": {}}
+
+    for i, package in enumerate(manifest["packages"]):
+        name = package["name"]
+        kind = package_kind(i)
+
+        if kind == KIND_URL:
+            make_artifact(os.path.join(www, name + ".tar.gz"), name)
+            answers["packages"][name] = "url"
+        elif kind == KIND_REPO:
+            shutil.copytree(template, os.path.join(repo_dir, name + ".git"))
+            answers["packages"][name] = "url"
+        elif MANAGER not in package["supported-package-managers"]:
+            answers["packages"][name] = "skip"
+
+        for config in package.get("configs", []):
+            source = os.path.join(directory, config["source"])
+            os.makedirs(os.path.dirname(source), exist_ok=True)
+
+            with open(source, "w") as f:
+                f.write("# config for " + name + "\n" + "setting = value\n" * 64)
+
+    with open(os.path.join(directory, "answers.json"), "w") as f:
+        json.dump(answers, f)
+
+    return sum(1 for p in manifest["packages"] if not p.get("disabled", False))
+
+
+def profile_counters(path: str):
+    try:
+        with open(path, "r") as f:
+            events = json.load(f)["traceEvents"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+    counters = {}
+
+    for event in events:
+        if event.get("ph") != "X" or event["cat"] == "run":
+            continue
+
+        c = counters.setdefault(event["cat"], {"count": 0, "seconds": 0.0, "bytes": 0})
+        c["count"] += 1
+        c["seconds"] += event["dur"] / 1_000_000
+        c["bytes"] += event["args"].get("bytes", 0)
+
+    for c in counters.values():
+        c["seconds"] = round(c["seconds"], 4)
+
+    return counters
+
+
+def run_once(args, cwd: str, env, log: str, profile: str):
+    start = time.perf_counter()
+
+    with open(log, "ab") as out:
+        proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "install.py")] + args + ["--profile", profile],
+                                cwd=cwd, env=env, stdin=subprocess.DEVNULL, stdout=out, stderr=out)
+        _, status, usage = os.wait4(proc.pid, 0)
+
+    wall = time.perf_counter() - start
+
+    return {
+        "exit_code": os.waitstatus_to_exitcode(status),
+        "wall_s": round(wall, 4),
+        "user_s": round(usage.ru_utime, 4),
+        "sys_s": round(usage.ru_stime, 4),
+        # Kilobytes on Linux, bytes on macOS.
+        "peak_rss": usage.ru_maxrss,
+        "minor_faults": usage.ru_minflt,
+        "major_faults": usage.ru_majflt,
+        "block_in": usage.ru_inblock,
+        "block_out": usage.ru_oublock,
+        "voluntary_switches": usage.ru_nvcsw,
+        "involuntary_switches": usage.ru_nivcsw,
+        "profile": profile_counters(profile)
+    }
+
+
+def run_mode(mode: str, workspace: str, bin_dir: str, options, scratch: str):
+    """
+    Run mode against a fresh HOME, then again against the same one.
+    """
+    home = tempfile.mkdtemp(prefix="home-", dir=scratch)
+    # Checkouts and downloads land in the working directory.
+    cwd = os.path.join(home, "work")
+    os.makedirs(cwd)
+
+    for name in ("packages_list.json", "config"):
+        if os.path.exists(os.path.join(workspace, name)):
+            os.symlink(os.path.join(workspace, name), os.path.join(cwd, name))
+
+    env = dict(os.environ)
+    env.update({
+        "HOME": home,
+        "XDG_STATE_HOME": os.path.join(home, ".local", "state"),
+        "XDG_CACHE_HOME": os.path.join(home, ".cache"),
+        "FAKE_MANAGER_STATE": os.path.join(home, "installed"),
+        "FAKE_MANAGER_LATENCY": str(options["manager_latency"]),
+        "FAKE_GIT_LATENCY": str(options["git_latency"]),
+        "PATH": bin_dir + os.pathsep + env.get("PATH", "")
+    })
+
+    args = MODES[mode] + ["--manager", MANAGER, "--no-prompt", "--answers", os.path.join(workspace, "answers.json"),
+                          "--jobs", str(options["jobs"])]
+    log = os.path.join(home, "install.log")
+    results = []
+
+    for phase in ("cold", "rerun"):
+        result = run_once(args, cwd, env, log, os.path.join(home, "profile-" + phase + ".json"))
+        result["phase"] = phase
+
+        if result["exit_code"] != 0:
+            with open(log, "rb") as f:
+                result["log_tail"] = f.read()[-2000:].decode(errors="replace")
+
+        results.append(result)
+
+    return results
+
+
+def print_header():
+    print("{:>8} {:<17} {:<6} {:>5} {:>9} {:>10} {:>9}".format(
+        "packages", "mode", "phase", "exit", "wall s", "peak rss", "change"))
+
+
+def print_results(results, previous=None):
+    before = {}
+
+    if previous is not None:
+        for r in previous.get("results", []):
+            before[(r["packages"], r["mode"], r["phase"])] = r
+
+    for r in results:
+        line = "{:>8} {:<17} {:<6} {:>5} {:>9.3f} {:>10}".format(
+            r["packages"], r["mode"], r["phase"], r["exit_code"], r["wall_s"], r["peak_rss"])
+        old = before.get((r["packages"], r["mode"], r["phase"]))
+
+        if old is not None and old["wall_s"] > 0:
+            line += " {:>+8.1f}%".format((r["wall_s"] / old["wall_s"] - 1) * 100)
+
+        print(line)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "-C", ROOT, "rev-parse", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    sizes = DEFAULT_SIZES
+    modes = list(MODES)
+    options = {"manager_latency": 0, "git_latency": 0, "jobs": 4}
+    output = None
+    compare = None
+    keep = None
+
+    args = sys.argv[1:]
+    i = 0
+
+    while i < len(args):
+        if args[i] == "--sizes":
+            sizes = [int(s) for s in args[i + 1].split(",")]
+        elif args[i] == "--modes":
+            modes = args[i + 1].split(",")
+
+            if any(m not in MODES for m in modes):
+                print("Modes are " + ", ".join(MODES))
+                exit(1)
+        elif args[i] == "--manager-latency":
+            options["manager_latency"] = float(args[i + 1])
+        elif args[i] == "--git-latency":
+            options["git_latency"] = float(args[i + 1])
+        elif args[i] == "--jobs":
+            options["jobs"] = int(args[i + 1])
+        elif args[i] == "--output":
+            output = args[i + 1]
+        elif args[i] == "--compare":
+            compare = args[i + 1]
+        elif args[i] == "--keep":
+            keep = args[i + 1]
+        else:
+            print(__doc__.strip())
+            exit(1)
+
+        i += 2
+
+    git = shutil.which("git")
+
+    if git is None:
+        print("git is needed to make the benchmark repositories.")
+        exit(1)
+
+    scratch = tempfile.mkdtemp(prefix="e2e-") if keep is None else os.path.abspath(keep)
+    os.makedirs(scratch, exist_ok=True)
+    www = os.path.join(scratch, "www")
+    repo_dir = os.path.join(scratch, "git")
+    bin_dir = os.path.join(scratch, "bin")
+    template = os.path.join(scratch, "template.git")
+
+    subprocess.run(["bash", os.path.join(ROOT, "scripts", "fake_managers", "setup.sh"), bin_dir, "apt", "pacman", "brew"],
+                   check=True, stdout=subprocess.DEVNULL)
+
+    with open(os.path.join(bin_dir, "git"), "w") as f:
+        f.write(GIT_SHIM.format(git=git))
+
+    os.chmod(os.path.join(bin_dir, "git"), 0o755)
+    make_template_repo(template, git)
+    server, base_url = serve(www)
+    results = []
+    print_header()
+
+    try:
+        for count in sizes:
+            workspace = os.path.join(scratch, "manifest-" + str(count))
+            enabled = make_workspace(workspace, count, base_url, repo_dir, www, template)
+
+            for mode in modes:
+                for result in run_mode(mode, workspace, bin_dir, options, scratch):
+                    result.update({"packages": count, "enabled": enabled, "mode": mode})
+                    results.append(result)
+                    print_results([result])
+    finally:
+        server.shutdown()
+
+        if keep is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": options,
+        "results": results
+    }
+
+    if compare is not None:
+        with open(compare, "r") as f:
+            print_header()
+            print_results(results, json.load(f))
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    exit(0 if all(r["exit_code"] == 0 for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
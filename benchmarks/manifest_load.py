@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+"""
+Benchmark for loading packages_list.json.
+
+Times loading synthetic manifests with the compiled cache disabled, cold
+and warm, and building Packages for every entry against only the enabled
+ones.
+
+Usage: benchmarks/manifest_load.py [--sizes n,n,...] [--runs n] [--output file]
+"""
+
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import install  # noqa: E402
+import manifest  # noqa: E402
+from synthetic import write_manifest  # noqa: E402
+
+
+def timed(fn, runs: int, setup=None):
+    samples = []
+
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    return round(statistics.median(samples), 2)
+
+
+def bench(count: int, runs: int, directory: str):
+    path = os.path.join(directory, "packages_list-" + str(count) + ".json")
+    cache_dir = os.path.join(directory, "cache")
+    write_manifest(path, count)
+
+    def load():
+        return manifest.load_manifest(path, install.check_dependencies)
+
+    def clear_cache():
+        manifest.configure(cache_dir=cache_dir)
+
+        if os.path.exists(manifest.cache_path(path)):
+            os.remove(manifest.cache_path(path))
+
+    options = install.Options([])
+
+    def build_all():
+        return [install.Package(r) for r in load()]
+
+    def build_enabled():
+        with contextlib.redirect_stderr(io.StringIO()):
+            return options.enabled_packages(load())
+
+    results = {"packages": count}
+
+    manifest.configure(use_cache=False)
+    results["uncached_ms"] = timed(load, runs)
+    results["uncached_build_all_ms"] = timed(build_all, runs)
+    results["cold_ms"] = timed(load, runs, setup=clear_cache)
+
+    manifest.configure(cache_dir=cache_dir)
+    load()
+    results["warm_ms"] = timed(load, runs)
+    results["warm_build_all_ms"] = timed(build_all, runs)
+    results["warm_build_enabled_ms"] = timed(build_enabled, runs)
+    results["cache_bytes"] = os.path.getsize(manifest.cache_path(path))
+    results["manifest_bytes"] = os.path.getsize(path)
+
+    return results
+
+
+def main():
+    sizes = [10_000, 50_000]
+    runs = 5
+    output = None
+
+    args = sys.argv[1:]
+    i = 0
+
+    while i < len(args):
+        if args[i] == "--sizes":
+            sizes = [int(s) for s in args[i + 1].split(",")]
+            i += 2
+        elif args[i] == "--runs":
+            runs = int(args[i + 1])
+            i += 2
+        elif args[i] == "--output":
+            output = args[i + 1]
+            i += 2
+        else:
+            print(__doc__.strip())
+            exit(1)
+
+    with tempfile.TemporaryDirectory(prefix="manifest-") as directory:
+        results = [bench(count, runs, directory) for count in sizes]
+
+    columns = ["packages", "uncached_ms", "uncached_build_all_ms", "cold_ms", "warm_ms",
+               "warm_build_all_ms", "warm_build_enabled_ms"]
+
+    print(" ".join("{:>22}".format(c) for c in columns))
+
+    for result in results:
+        print(" ".join("{:>22}".format(result[c]) for c in columns))
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+"""
+Startup benchmark for install.py.
+
+Runs install.py in each mode under -X importtime and records the median
+wall time and import time. The results are compared with the last recorded
+baseline and the run fails if a mode got slower than the tolerance allows,
+or if a mode which shouldn't need them imports the network stack or the
+command runner.
+
+Timings depend on the machine, so the baseline isn't checked in. Record one
+with --update-baseline first, without one the run fails.
+
+Usage: benchmarks/startup.py [--runs n] [--tolerance fraction]
+                             [--baseline file] [--update-baseline]
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "startup_baseline.json")
+
+MODES = {
+    "version": ["--version"],
+    "help": ["--help"],
+    "install_configs": ["install_configs", "--enable-all", "--manager", "apt", "--no-prompt"],
+    "status": ["status"]
+}
+
+# Modules each mode has no business loading.
+NETWORK = ["requests", "urllib3", "asyncio", "tarfile", "zipfile"]
+FORBIDDEN = {
+    "version": NETWORK + ["sqlite3"],
+    "help": NETWORK + ["sqlite3"],
+    # Deploying configs records them in the journal, but downloads nothing.
+    "install_configs": NETWORK
+}
+
+# Differences smaller than this are noise whatever the tolerance.
+SLACK_MS = 5
+
+
+def parse_importtime(stderr: str):
+    """
+    Returns the total import time in ms and the names of every module
+    imported.
+    """
+    total = 0
+    modules = set()
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+
+        # Only top level imports, the nested ones are in their cumulative.
+        if not name.startswith("  "):
+            total += int(cumulative)
+
+    return (total / 1000, modules)
+
+
+def run_mode(args, env):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime"] + args,
+                            cwd=ROOT, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True)
+    wall = (time.perf_counter() - start) * 1000
+
+    if result.returncode != 0:
+        raise RuntimeError(" ".join(args) + " failed:\n" + result.stderr[-2000:])
+
+    imports, modules = parse_importtime(result.stderr)
+
+    return (wall, imports, modules)
+
+
+def make_env(home: str):
+    bin_dir = os.path.join(home, "bin")
+    subprocess.run(["bash", os.path.join(ROOT, "scripts", "fake_managers", "setup.sh"), bin_dir, "apt"],
+                   check=True, stdout=subprocess.DEVNULL)
+
+    env = dict(os.environ)
+    env["HOME"] = home
+    env["XDG_STATE_HOME"] = os.path.join(home, "state")
+    env["XDG_CACHE_HOME"] = os.path.join(home, "cache")
+    env["FAKE_MANAGER_STATE"] = os.path.join(home, "installed")
+    env["PATH"] = bin_dir + os.pathsep + env.get("PATH", "")
+
+    return env
+
+
+def main():
+    runs = 10
+    tolerance = 0.25
+    baseline_path = DEFAULT_BASELINE
+    update = False
+
+    args = sys.argv[1:]
+    i = 0
+
+    while i < len(args):
+        if args[i] == "--runs":
+            runs = int(args[i + 1])
+            i += 2
+        elif args[i] == "--tolerance":
+            tolerance = float(args[i + 1])
+            i += 2
+        elif args[i] == "--baseline":
+            baseline_path = args[i + 1]
+            i += 2
+        elif args[i] == "--update-baseline":
+            update = True
+            i += 1
+        else:
+            print(__doc__.strip())
+            exit(1)
+
+    results = {}
+    failed = False
+
+    with tempfile.TemporaryDirectory(prefix="startup-") as home:
+        env = make_env(home)
+        # Whatever the interpreter loads on its own (site, .pth files) isn't
+        # install.py's doing.
+        _, _, interpreter = run_mode(["-c", "pass"], env)
+
+        for mode, mode_args in MODES.items():
+            mode_args = [os.path.join(ROOT, "install.py")] + mode_args
+            # The first run writes bytecode caches and deploys the configs.
+            run_mode(mode_args, env)
+            samples = [run_mode(mode_args, env) for _ in range(runs)]
+            modules = samples[0][2] - interpreter
+
+            results[mode] = {
+                "wall_ms": round(statistics.median(s[0] for s in samples), 2),
+                "import_ms": round(statistics.median(s[1] for s in samples), 2)
+            }
+
+            if mode in FORBIDDEN:
+                loaded = [m for m in FORBIDDEN[mode] if m in modules]
+
+                if len(loaded) > 0:
+                    print(mode + " imports " + ", ".join(loaded))
+                    failed = True
+
+    try:
+        with open(baseline_path, "r") as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = None
+
+    print("{:<16} {:>10} {:>10} {:>10}".format("mode", "wall ms", "import ms", "baseline"))
+
+    for mode, result in results.items():
+        previous = baseline.get(mode) if baseline is not None else None
+        line = "{:<16} {:>10.1f} {:>10.1f}".format(mode, result["wall_ms"], result["import_ms"])
+
+        if previous is not None:
+            line += " {:>10.1f}".format(previous["wall_ms"])
+
+            if result["wall_ms"] > previous["wall_ms"] * (1 + tolerance) + SLACK_MS:
+                line += "  REGRESSED"
+                failed = True
+
+        print(line)
+
+    if update:
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=4)
+
+        print("Recorded the baseline in " + baseline_path)
+    elif baseline is None:
+        print("No baseline in " + baseline_path + ", nothing was checked for regressions. "
+              "Record one with --update-baseline.", file=sys.stderr)
+        failed = True
+
+    exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Synthetic packages_list.json manifests for the benchmarks.
+"""
+
+import json
+import random
+
+MANAGERS = ["brew", "apt", "yay", "pacman"]
+
+# Every tenth package is downloaded, every twentieth cloned instead.
+KIND_MANAGER = "manager"
+KIND_URL = "url"
+KIND_REPO = "repo"
+
+
+def package_kind(i: int):
+    if i % 10 != 1:
+        return KIND_MANAGER
+
+    return KIND_REPO if i % 20 == 1 else KIND_URL
+
+
+def is_enabled(i: int, enabled_every: int):
+    # Packages are enabled in blocks of ten so every kind gets enabled.
+    return (i // 10) % enabled_every == 0
+
+
+def synthetic_package(i: int, rng, enabled_every=100, base_url=None, repo_base=None):
+    name = "pkg" + str(i)
+    package = {
+        "name": name,
+        "supported-package-managers": rng.sample(MANAGERS, rng.randint(1, len(MANAGERS)))
+    }
+
+    if not is_enabled(i, enabled_every):
+        package["disabled"] = True
+
+    if i % 3 == 0:
+        package["name_apt"] = name + "-bin"
+
+    if i % 4 == 0:
+        package["configs"] = [{
+            "source": "config/" + name,
+            "dest": "%(HOME)/.config/" + name
+        }]
+
+    kind = package_kind(i)
+
+    if kind == KIND_REPO:
+        package["supported-package-managers"] = None
+        package["repo"] = (repo_base if repo_base is not None else "https://example.com/git/") + name + ".git"
+        package["install-cmds"] = ["mkdir -p %(LOCAL_BIN_DIR)"]
+    elif kind == KIND_URL:
+        package["supported-package-managers"] = None
+        package["url"] = (base_url if base_url is not None else "https://example.com/") + name + ".tar.gz"
+        package["extract"] = {"dest": "%(LOCAL_BIN_DIR)/" + name, "include": ["bin/*"]}
+
+    if i % 7 == 0:
+        package["post-install-cmds"] = ["echo %(HOME) " + name]
+
+    if i > 0 and i % 5 == 0:
+        package["depends-on"] = ["pkg" + str(rng.randrange(0, i))]
+
+    return package
+
+
+def synthetic_manifest(count: int, seed=0, **kwargs):
+    """
+    count packages, one block of ten in every enabled_every enabled.
+    Dependencies only point at earlier packages so there are no cycles.
+    """
+    rng = random.Random(seed)
+
+    return {"packages": [synthetic_package(i, rng, **kwargs) for i in range(count)]}
+
+
+def write_manifest(path: str, count: int, **kwargs):
+    manifest = synthetic_manifest(count, **kwargs)
+
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    return manifest
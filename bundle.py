@@ -0,0 +1,240 @@
+import hashlib
+import io
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from utils import COPY_BUFFER_SIZE, hash_file
+
+MAGIC = b"DOTBNDL1"
+HEADER = struct.Struct("<8sQ")
+# Artifacts start on page boundaries so each one maps cleanly.
+ALIGNMENT = 4096
+
+KIND_FILE = "file"
+KIND_REPO = "repo"
+
+_bundle = None
+_bundle_path = None
+_bundle_lock = threading.Lock()
+
+
+class BundleError(Exception):
+    pass
+
+
+def align(n: int):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class BundleWriter:
+    """
+    Collects artifacts and writes them into one bundle file: a header, a JSON
+    index of every artifact's offset, size and SHA-256, then the artifacts.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.members = []
+        self.lock = threading.Lock()
+
+    def add(self, kind: str, key: str, path: str, filename=None):
+        member = {
+            "kind": kind,
+            "key": key,
+            "filename": filename if filename is not None else os.path.basename(path),
+            "size": os.path.getsize(path),
+            "sha256": hash_file(path),
+            "path": path
+        }
+
+        with self.lock:
+            self.members.append(member)
+
+    def write(self):
+        """
+        Write the bundle and return its size.
+        """
+        index = {KIND_FILE: {}, KIND_REPO: {}}
+        offset = 0
+
+        for member in self.members:
+            index[member["kind"]][member["key"]] = {
+                "filename": member["filename"],
+                "offset": offset,
+                "size": member["size"],
+                "sha256": member["sha256"]
+            }
+            offset = align(offset + member["size"])
+
+        data = json.dumps(index).encode()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".bundle-")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, len(data)))
+                f.write(data)
+                start = align(f.tell())
+
+                for member in self.members:
+                    f.seek(start + index[member["kind"]][member["key"]]["offset"])
+
+                    with open(member["path"], "rb") as src:
+                        shutil.copyfileobj(src, f, COPY_BUFFER_SIZE)
+
+                f.truncate(start + offset)
+
+            # mkstemp only lets the owner read it.
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        return start + offset
+
+
+class BundleMember(io.RawIOBase):
+    """
+    A read only, seekable file over one artifact in a mapped bundle.
+    """
+
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self.view) - self.pos))
+        b[:n] = self.view[self.pos:self.pos + n]
+        self.pos += n
+
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+
+        if offset < 0:
+            raise ValueError("negative seek position " + str(offset))
+
+        self.pos = offset
+
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
+class Bundle:
+    """
+    A bundle mapped into memory. Artifacts are served straight from the
+    mapping, nothing is unpacked up front.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.verified = set()
+        self.lock = threading.Lock()
+
+        with open(path, "rb") as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise BundleError(path + " is empty.")
+
+        if len(self.map) < HEADER.size:
+            raise BundleError(path + " isn't a bundle.")
+
+        magic, length = HEADER.unpack_from(self.map)
+
+        if magic != MAGIC or HEADER.size + length > len(self.map):
+            raise BundleError(path + " isn't a bundle.")
+
+        try:
+            self.index = json.loads(bytes(self.map[HEADER.size:HEADER.size + length]))
+        except ValueError:
+            raise BundleError("The index of " + path + " is corrupt.")
+
+        self.start = align(HEADER.size + length)
+
+    def lookup(self, kind: str, key: str):
+        return self.index.get(kind, {}).get(key)
+
+    def view(self, entry):
+        """
+        The artifact's bytes, checked against its SHA-256 the first time.
+        """
+        view = memoryview(self.map)[self.start + entry["offset"]:self.start + entry["offset"] + entry["size"]]
+
+        with self.lock:
+            verified = entry["sha256"] in self.verified
+
+        if not verified:
+            if hashlib.sha256(view).hexdigest() != entry["sha256"]:
+                raise BundleError(entry["filename"] + " is corrupt in " + self.path)
+
+            with self.lock:
+                self.verified.add(entry["sha256"])
+
+        return view
+
+    def open(self, entry):
+        return BundleMember(self.view(entry))
+
+    def write_to(self, entry, dest: str):
+        directory = os.path.dirname(os.path.abspath(dest))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".bundle-")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.view(entry))
+
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, dest)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        return dest
+
+    def entries(self):
+        for kind in (KIND_FILE, KIND_REPO):
+            for key, entry in self.index.get(kind, {}).items():
+                yield (kind, key, entry)
+
+
+def configure(path=None):
+    global _bundle, _bundle_path
+
+    _bundle = None
+    _bundle_path = path
+
+
+def get_bundle():
+    """
+    The bundle given with --from-bundle, or None.
+    """
+    global _bundle
+
+    if _bundle_path is None:
+        return None
+
+    with _bundle_lock:
+        if _bundle is None:
+            _bundle = Bundle(_bundle_path)
+
+        return _bundle
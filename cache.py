@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from utils import cache_dir
+
+DEFAULT_CACHE_SIZE = 1_000_000_000
+INDEX_FILE = "index.json"
+
+
+def default_cache_dir():
+    return os.path.join(cache_dir(), "downloads")
+
+
+def url_key(url: str):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+class DownloadCache:
+    """
+    A persistent download cache. The index is keyed by URL and the content is
+    stored by its SHA-256 so identical artifacts are only kept once.
+    """
+
+    def __init__(self, path=None, max_size=DEFAULT_CACHE_SIZE):
+        self.path = path if path is not None else default_cache_dir()
+        self.objects_path = os.path.join(self.path, "objects")
+        self.partial_dir = os.path.join(self.path, "partial")
+        self.index_path = os.path.join(self.path, INDEX_FILE)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # How many fetches are still using each object. Eviction waits until
+        # none are, so nothing is removed from under a download in use.
+        self.pins = {}
+
+        Path(self.objects_path).mkdir(parents=True, exist_ok=True)
+        Path(self.partial_dir).mkdir(parents=True, exist_ok=True)
+
+        self.index = self.__load_index()
+
+    def __load_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        if not isinstance(index, dict):
+            return {}
+
+        return index
+
+    def __save_index(self):
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".index-")
+
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.index, f)
+
+        os.replace(tmp, self.index_path)
+
+    def object_path(self, digest: str):
+        return os.path.join(self.objects_path, digest)
+
+    def lookup(self, url: str):
+        with self.lock:
+            entry = self.index.get(url)
+
+            if entry is None:
+                return None
+
+            if not os.path.isfile(self.object_path(entry["sha256"])):
+                del self.index[url]
+                self.__save_index()
+                return None
+
+            return dict(entry)
+
+    def conditional_headers(self, entry):
+        headers = {}
+
+        if entry is None:
+            return headers
+
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        return headers
+
+    def touch(self, url: str):
+        with self.lock:
+            if url in self.index:
+                self.index[url]["last_used"] = time.time()
+                self.__save_index()
+
+    def pin(self, digest: str):
+        """
+        Keep the object for digest until it's unpinned. Returns False if it
+        has already gone.
+        """
+        with self.lock:
+            if not os.path.isfile(self.object_path(digest)):
+                return False
+
+            self.pins[digest] = self.pins.get(digest, 0) + 1
+
+            return True
+
+    def unpin(self, digest: str):
+        with self.lock:
+            self.pins[digest] -= 1
+
+            if self.pins[digest] > 0:
+                return
+
+            del self.pins[digest]
+
+            if len(self.pins) == 0 and self.__evict():
+                self.__save_index()
+
+    def partial_path(self, url: str):
+        """
+        Where an in-progress download of url is written, so an interrupted
+        download can be resumed by the next run.
+        """
+        return os.path.join(self.partial_dir, url_key(url))
+
+    def store(self, url: str, tmp_path: str, digest: str, filename: str, headers):
+        """
+        Move a completed download into the cache and record it for url. The
+        object is pinned for the caller, the cache is trimmed to its size once
+        everything is unpinned.
+        """
+        size = os.path.getsize(tmp_path)
+        obj = self.object_path(digest)
+
+        with self.lock:
+            if os.path.isfile(obj):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, obj)
+
+            old = self.index.get(url)
+
+            self.index[url] = {
+                "sha256": digest,
+                "filename": filename,
+                "size": size,
+                "etag": headers.get("etag"),
+                "last_modified": headers.get("last-modified"),
+                "last_used": time.time()
+            }
+
+            # The content changed, the old version is only kept if another URL
+            # still uses it.
+            if old is not None and old["sha256"] != digest:
+                self.__remove_unused(old["sha256"])
+
+            self.pins[digest] = self.pins.get(digest, 0) + 1
+            self.__save_index()
+
+            return dict(self.index[url])
+
+    def materialize(self, entry, dest=None):
+        """
+        Copy a cached object out to dest, by default its file name in the
+        current directory.
+        """
+        if dest is None:
+            dest = entry["filename"]
+
+        shutil.copyfile(self.object_path(entry["sha256"]), dest)
+
+        return dest
+
+    def __object_sizes(self):
+        sizes = {}
+
+        with os.scandir(self.objects_path) as it:
+            for entry in it:
+                if entry.is_file():
+                    sizes[entry.name] = entry.stat().st_size
+
+        return sizes
+
+    def total_size(self):
+        """
+        The size of every object on disk, whether the index still refers to
+        it or not.
+        """
+        return sum(self.__object_sizes().values())
+
+    def __remove_unused(self, digest: str):
+        """
+        Remove the object for digest unless an entry still refers to it or
+        it's pinned. Returns whether it was removed.
+        """
+        if digest in self.pins or any(e["sha256"] == digest for e in self.index.values()):
+            return False
+
+        try:
+            os.remove(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+
+        return True
+
+    def __evict(self):
+        """
+        Remove the least recently used entries until the cache fits. Returns
+        whether the index changed.
+        """
+        sizes = self.__object_sizes()
+        total = sum(sizes.values())
+        changed = False
+
+        if total <= self.max_size:
+            return False
+
+        # Objects nothing refers to anymore go first, left behind by an older
+        # version or an interrupted run.
+        for digest, size in sizes.items():
+            if self.__remove_unused(digest):
+                total -= size
+
+        by_age = sorted(self.index.items(), key=lambda e: e[1]["last_used"])
+
+        for url, entry in by_age:
+            if total <= self.max_size:
+                break
+
+            del self.index[url]
+            changed = True
+
+            # The same content may still be used by another URL.
+            if self.__remove_unused(entry["sha256"]):
+                total -= sizes.get(entry["sha256"], 0)
+
+        return changed
@@ -1,78 +1,439 @@
 import requests
+import hashlib
 import re
-import sys
-from terminal import eprint
+import os
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib.parse import unquote, urlparse
+from terminal import default_print, get_progress, file_size_string
+from cache import DownloadCache, DEFAULT_CACHE_SIZE, url_key
+from archives import ArchiveError, StreamExtractor, archive_format, extract_file, is_streamable
+from bundle import get_bundle, KIND_FILE
+from profiling import span
+from scheduler import DEFAULT_WORKERS
+from utils import hash_file
 
 
-def get_file_name_from_url(url: str):
-    def get_filename_from_cd(cd):
-        """
-        Get filename from content-disposition
-        """
-        if not cd:
-            return None
+INITIAL_CHUNK_SIZE = 64 * 1024
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+FAST_READ_SECONDS = 0.05
+SLOW_READ_SECONDS = 0.5
 
-        fname = re.findall('filename=(.+)', cd)
+_session = None
+_session_lock = threading.Lock()
 
-        if len(fname) == 0:
-            return None
+_cache = None
+_cache_enabled = True
+_cache_dir = None
+_cache_size = DEFAULT_CACHE_SIZE
+_offline = False
+# As many pooled connections as downloads can run at once, one per worker.
+_workers = DEFAULT_WORKERS
 
-        return fname[0]
 
-    remotefile = requests.head(url, allow_redirects=True)
-    cd = remotefile.headers.get('content-disposition')
-    filename = get_filename_from_cd(cd)
+class DownloadError(Exception):
+    pass
+
+
+def configure(cache_dir=None, cache_size=None, use_cache=True, offline=False, workers=None):
+    global _cache, _cache_enabled, _cache_dir, _cache_size, _offline, _session, _workers
+
+    _cache = None
+    _cache_enabled = use_cache
+    _cache_dir = cache_dir
+    _offline = offline
+
+    if workers is not None and workers != _workers:
+        _workers = max(1, workers)
+        _session = None
+
+    if cache_size is not None:
+        _cache_size = cache_size
+
+
+def get_cache():
+    global _cache
+
+    if not _cache_enabled:
+        return None
+
+    with _session_lock:
+        if _cache is None:
+            _cache = DownloadCache(_cache_dir, _cache_size)
+
+        return _cache
+
+
+def get_session():
+    """
+    Return the shared session so every request reuses pooled connections.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=_workers, pool_maxsize=_workers)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+
+        return _session
+
+
+def get_filename_from_cd(cd):
+    """
+    Get filename from content-disposition
+    """
+    if not cd:
+        return None
+
+    fname = re.findall(r"filename\*=[^']*''([^;]+)", cd)
+
+    if len(fname) == 0:
+        fname = re.findall(r'filename="?([^";]+)"?', cd)
+
+    if len(fname) == 0:
+        return None
+
+    return os.path.basename(unquote(fname[0].strip()))
+
+
+def get_filename_from_response(response, url: str):
+    filename = get_filename_from_cd(response.headers.get('content-disposition'))
 
     if filename is None:
-        filename = url.rsplit("/")[-1]
+        # Prefer the final URL after redirects, fall back to the one we asked for.
+        for u in (response.url, url):
+            filename = urlparse(u).path.rsplit("/")[-1]
+
+            if filename:
+                break
+
     return filename
 
 
-def download_file(url: str, chunk_size=4096):
-    filename = get_file_name_from_url(url)
+def bundled(url: str):
+    """
+    The entry for url in the bundle given with --from-bundle, if any.
+    """
+    b = get_bundle()
 
-    with open(filename, "wb") as f:
-        print("Downloading %s" % filename)
-        response = requests.get(url, stream=True, allow_redirects=True)
-        total_length = response.headers.get('content-length')
+    return b.lookup(KIND_FILE, url) if b is not None else None
 
-        if total_length is None:  # no content length header
-            eprint("The header does not specify the file size.")
-            dl = 0
 
-            for data in response.iter_content(chunk_size=chunk_size):
-                dl += len(data)
-                f.write(data)
+def iter_adaptive_chunks(response):
+    """
+    Read the response body, growing the read size while reads complete quickly
+    and shrinking it again when they stall.
+    """
+    size = INITIAL_CHUNK_SIZE
+
+    while True:
+        start = time.monotonic()
+        data = response.raw.read(size, decode_content=True)
+
+        if not data:
+            break
 
-                sys.stdout.write("\r%s" % file_size_string(dl))
-                sys.stdout.flush()
+        elapsed = time.monotonic() - start
 
-        else:
-            dl = 0
-            total_length = int(total_length)
+        yield data
 
-            for data in response.iter_content(chunk_size=chunk_size):
-                dl += len(data)
+        if elapsed < FAST_READ_SECONDS and len(data) == size:
+            size = min(size * 2, MAX_CHUNK_SIZE)
+        elif elapsed > SLOW_READ_SECONDS:
+            size = max(size // 2, MIN_CHUNK_SIZE)
+
+
+def write_response(response, f, offset, progress_label, digest, sink=None):
+    total_length = response.headers.get('content-length')
+    dl = offset
+    bar = None
+
+    if total_length is not None:
+        total_length = int(total_length) + offset
+
+    if progress_label is not None:
+        bar = get_progress().add(progress_label, total_length, done=offset)
+
+    try:
+        for data in iter_adaptive_chunks(response):
+            dl += len(data)
+            digest.update(data)
+
+            if f is not None:
                 f.write(data)
-                done = int(50 * dl / total_length)
-                p = dl / total_length * 100
-                p = p if p <= 100 else 100
-                sys.stdout.write("\r[%s%s] %.2f" %
-                                 ('#' * done, ' ' * (50-done), p))
-                sys.stdout.flush()
-
-
-def file_size_string(bytes: int):
-    if bytes > 1_000_000_000:
-        s = "{:.2f}GB".format(bytes / 1_000_000_000)
-    elif bytes > 1_000_000:
-        s = "{:.2f}MB".format(bytes / 1_000_000)
-    elif bytes > 1_000:
-        s = "{:.2f}KB".format(bytes / 1_000)
+
+            if sink is not None:
+                sink(data)
+
+            if bar is not None:
+                bar.update(len(data))
+    finally:
+        if bar is not None:
+            bar.close()
+
+    if total_length is not None and dl < total_length:
+        raise DownloadError("Connection closed after %d of %d bytes." % (dl, total_length))
+
+    return dl
+
+
+def partial_path(url: str):
+    cache = get_cache()
+
+    if cache is not None:
+        return cache.partial_path(url)
+
+    return "." + url_key(url)[:16] + ".part"
+
+
+def read_validator(part: str):
+    try:
+        with open(part + ".validator", "r") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_validator(part: str, headers):
+    # Only a strong ETag or a Last-Modified date can be used with If-Range.
+    validator = headers.get("etag")
+
+    if validator is None or validator.startswith("W/"):
+        validator = headers.get("last-modified")
+
+    if validator is None:
+        remove_file(part + ".validator")
+        return
+
+    with open(part + ".validator", "w") as f:
+        f.write(validator)
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class FetchedFile:
+    """
+    A complete download on disk. entry is its cache entry, if it has none
+    path is a temporary file the caller has to move or remove. path is None
+    if the content was only streamed to a sink.
+
+    A cached object is pinned so it isn't evicted while it's used, call
+    release once done with it.
+    """
+
+    def __init__(self, path, filename, entry=None, streamed=False, cache=None):
+        self.path = path
+        self.filename = filename
+        self.entry = entry
+        self.streamed = streamed
+        self.cache = cache
+
+    def release(self):
+        if self.cache is not None:
+            self.cache.unpin(self.entry["sha256"])
+            self.cache = None
+
+
+def fetch(url: str, progress=True, sha256=None, sink_for=None):
+    """
+    Make sure the content of url is on disk and return a FetchedFile.
+
+    The body is streamed into a partial file which is renamed once complete,
+    an existing partial file is resumed with a Range request. If sha256 is
+    given the content is verified while it is written.
+
+    sink_for is called with the file name once it is known and may return a
+    function which is fed every byte of the content as it arrives. Without
+    the cache the content then isn't written to disk at all.
+    """
+    if sha256 is not None:
+        sha256 = sha256.lower()
+
+    cache = get_cache()
+    entry = cache.lookup(url) if cache is not None else None
+
+    if entry is not None and sha256 is not None and entry["sha256"] != sha256:
+        entry = None
+
+    if _offline:
+        if entry is None or not cache.pin(entry["sha256"]):
+            raise DownloadError(url + " is not in the download cache.")
+
+        default_print("Using cached " + entry["filename"], bold=False)
+        cache.touch(url)
+        return FetchedFile(cache.object_path(entry["sha256"]), entry["filename"], entry, cache=cache)
+
+    part = partial_path(url)
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+    headers = {"Accept-Encoding": "identity"}
+
+    if offset > 0:
+        headers["Range"] = "bytes=%d-" % offset
+        validator = read_validator(part)
+
+        if validator is not None:
+            headers["If-Range"] = validator
+    elif cache is not None:
+        headers.update(cache.conditional_headers(entry))
+
+    response = get_session().get(url, stream=True, allow_redirects=True, headers=headers)
+
+    if response.status_code == 304 and entry is not None:
+        response.close()
+
+        if not cache.pin(entry["sha256"]):
+            # Evicted since it was looked up, fetch it again.
+            return fetch(url, progress, sha256, sink_for)
+
+        default_print("Using cached " + entry["filename"], bold=False)
+        cache.touch(url)
+        return FetchedFile(cache.object_path(entry["sha256"]), entry["filename"], entry, cache=cache)
+
+    if response.status_code == 416:
+        # The partial file doesn't fit the remote file anymore, start over.
+        response.close()
+        remove_file(part)
+        remove_file(part + ".validator")
+        return fetch(url, progress, sha256, sink_for)
+
+    response.raise_for_status()
+    filename = get_filename_from_response(response, url)
+    digest = hashlib.sha256()
+    sink = sink_for(filename) if sink_for is not None else None
+
+    if response.status_code == 206 and offset > 0:
+        hash_file(part, digest, sink)
+        default_print("Resuming " + filename + " from " + file_size_string(offset).strip(), bold=False)
+        mode = "ab"
     else:
-        s = "{}B".format(bytes)
+        offset = 0
+        default_print("Downloading " + filename, bold=False)
+        write_validator(part, response.headers)
+        mode = "wb"
+
+    if sink is not None and cache is None and offset == 0:
+        # Nothing will keep the file, don't write it at all.
+        remove_file(part + ".validator")
+        write_response(response, None, offset, filename if progress else None, digest, sink)
+        part = None
+    else:
+        with open(part, mode) as f:
+            write_response(response, f, offset, filename if progress else None, digest, sink)
+
+        remove_file(part + ".validator")
+
+    actual = digest.hexdigest()
+
+    if sha256 is not None and actual != sha256:
+        if part is not None:
+            remove_file(part)
+
+        raise DownloadError("Checksum mismatch for %s: expected %s, got %s." %
+                            (filename, sha256, actual))
+
+    if cache is None or part is None:
+        return FetchedFile(part, filename, streamed=sink is not None)
+
+    entry = cache.store(url, part, actual, filename, response.headers)
+
+    return FetchedFile(cache.object_path(entry["sha256"]), filename, entry, sink is not None, cache)
+
+
+def download_file(url: str, progress=True, sha256=None):
+    """
+    Download url into the current directory and return the file name.
+    """
+    with span("download", url) as s:
+        filename = _download_file(url, progress, sha256)
+        s.set("bytes", os.path.getsize(filename))
+
+        return filename
+
+
+def _download_file(url: str, progress=True, sha256=None):
+    entry = bundled(url)
+
+    if entry is not None and (sha256 is None or entry["sha256"] == sha256.lower()):
+        default_print("Using bundled " + entry["filename"], bold=False)
+        return get_bundle().write_to(entry, entry["filename"])
+
+    fetched = fetch(url, progress, sha256)
+
+    if fetched.entry is None:
+        os.replace(fetched.path, fetched.filename)
+        return fetched.filename
+
+    try:
+        return get_cache().materialize(fetched.entry)
+    finally:
+        fetched.release()
+
+
+def download_and_extract(url: str, dest: str, include=None, progress=True, sha256=None):
+    """
+    Download the archive at url and extract it into dest, optionally only the
+    members matching the include globs. Tars are extracted while they are
+    downloading, zips have to be complete first. Returns the number of files
+    extracted.
+    """
+    with span("download", url) as s:
+        count = _download_and_extract(url, dest, include, progress, sha256)
+        s.set("files", count)
+
+        return count
+
+
+def _download_and_extract(url: str, dest: str, include=None, progress=True, sha256=None):
+    entry = bundled(url)
+
+    if entry is not None and (sha256 is None or entry["sha256"] == sha256.lower()):
+        default_print("Extracting bundled " + entry["filename"], bold=False)
+        b = get_bundle()
+
+        return extract_file(lambda: b.open(entry), dest, include,
+                            archive_format(entry["filename"]), entry["filename"])
+
+    extractor = []
+
+    def sink_for(filename):
+        fmt = archive_format(filename)
+
+        # A pinned checksum has to be verified before anything is extracted.
+        if sha256 is None and fmt is not None and is_streamable(fmt):
+            extractor.append(StreamExtractor(dest, include, fmt))
+            return extractor[0].write
+
+        return None
+
+    try:
+        fetched = fetch(url, progress, sha256, sink_for)
+    except ArchiveError:
+        # The extractor failed first, its error is the useful one.
+        extractor[0].finish()
+        raise
+    except BaseException:
+        if len(extractor) > 0:
+            extractor[0].abort()
+        raise
+
+    try:
+        if len(extractor) > 0:
+            return extractor[0].finish()
+
+        return extract_file(fetched.path, dest, include, archive_format(fetched.filename))
+    finally:
+        fetched.release()
 
-    if len(s) < 9:
-        s = (" " * (9 - len(s))) + s
+        if fetched.entry is None and fetched.path is not None:
+            remove_file(fetched.path)
 
-    return s
@@ -1,49 +1,37 @@
 #!/usr/bin/python3
 
+import hashlib
 import json
 import sys
 import os
-import re
 import shutil
-import pathlib
-from terminal import eprint, status_print, warning_print, success_print, confirm_prompt, default_print
-from downloads import get_file_name_from_url, download_file
-from pathlib import Path
-from utils import which
+import tempfile
+import time
+from terminal import eprint, status_print, warning_print, success_print, default_print, file_size_string, write_line
+from utils import which, which_all, state_dir
+from sync import ConfigSync, FileCopier
+from links import LinkFarm
+import manifest
+from manifest import load_manifest
+import managers
+from managers import SUPPORTED_PACKAGE_MANAGERS_COMMANDS, SUPPORTED_PACKAGE_MANAGERS_REFRESH, SudoSession, batch_install, by_preference, chunk_names, installed_packages, install_command, manager_database, manager_lock, needs_refresh, needs_sudo, output_prefix, refresh, upgrade
+from plan import Answers, AnswersError, Plan, ANSWER_SKIP, ANSWER_URL
+import journal
+from journal import get_journal, DONE_STEP, STATUS_OK
+import profiling
+from profiling import span
+from scheduler import Scheduler, find_cycle, DEFAULT_WORKERS
+from variables import VariableError, expand, get_variables, variables_for
+
+# The network stack, archives, git and the command runner are imported by
+# the modes which use them, install_configs, --help and --version start
+# without them.
 
 VERSION = "v1.0.0"
 PACKAGES_FILE = "packages_list.json"
-SUPPORTED_PACKAGE_MANAGERS_COMMANDS = {
-    "apt": "sudo apt install",
-    "pacman": "sudo pacman -Sy",
-    "yay": "yay -Sy",
-    "brew": "brew install"
-}
-
-SUPPORTED_PACKAGE_MANAGERS_SYSTEM_UPDATE = {
-    "apt": [["sudo", "apt", "update"], ["sudo", "apt", "upgrade"]],
-    "pacman": ["sudo", "pacman", "-Syu"],
-    "yay": ["yay", "-Syu"],
-    "brew": [["brew", "update"], ["brew", "upgrade"]]
-}
-
-SUPPORTED_VARIABLES = {
-    "FONT_DIR": str(Path.home()) + "/Library/Fonts" if sys.platform == "darwin" else str(
-        Path.home()) + "/.local/share/fonts",
-    "LOCAL_BIN_DIR": str(Path.home()) + "/.local/bin",
-    "HOME": str(Path.home())
-}
-
-
-def replace_variables(s: str):
-    # regex: \%\(([^)]+)\)
-
-    m = s
-
-    for key in SUPPORTED_VARIABLES:
-        m = re.sub(r"\%\(\b{}\b\)".format(key), SUPPORTED_VARIABLES[key], m)
-
-    return m
+DEFAULT_BUNDLE_FILE = "dotfiles.bundle"
+INSTALL_WITH_MANAGER = "manager"
+INSTALL_WITH_URL = "url"
 
 
 class Options:
@@ -55,6 +43,28 @@ class Options:
         self.batch_mode = False
         self.dry_run = False
         self.skip_all = False
+        self.offline = False
+        self.use_cache = True
+        self.cache_dir = None
+        self.cache_size = None
+        self.jobs = DEFAULT_WORKERS
+        self.timeout = None
+        self.use_journal = True
+        self.use_manifest_cache = True
+        self.profile = None
+        self.poll = False
+        self.link = False
+        self.targets = []
+        self.hardlink = False
+        self.from_bundle = None
+        self.refresh_ttl = None
+        self.manager = None
+        self.answers_file = None
+        self.save_answers = None
+        self.interactive = True
+        self.plan_file = None
+        self.force_refresh = False
+        self.output = None
 
         i = 0
         while i < len(options_array):
@@ -73,6 +83,154 @@ class Options:
             elif options_array[i] == '--skip-all':
                 self.skip_all = True
                 i += 1
+            elif options_array[i] == '--offline':
+                self.offline = True
+                i += 1
+            elif options_array[i] == '--no-cache':
+                self.use_cache = False
+                i += 1
+            elif options_array[i] == '--cache-dir':
+                i += 1
+
+                if i >= len(options_array):
+                    eprint("No directory given for the download cache.")
+                    exit(1)
+
+                self.cache_dir = options_array[i]
+                i += 1
+            elif options_array[i] == '--cache-size':
+                i += 1
+
+                if i >= len(options_array) or not options_array[i].isdigit():
+                    eprint("The cache size must be a number of megabytes.")
+                    exit(1)
+
+                self.cache_size = int(options_array[i]) * 1_000_000
+                i += 1
+            elif options_array[i] == '--jobs' or options_array[i] == '-j':
+                i += 1
+
+                if i >= len(options_array) or not options_array[i].isdigit() or int(options_array[i]) < 1:
+                    eprint("The number of jobs must be a positive number.")
+                    exit(1)
+
+                self.jobs = int(options_array[i])
+                i += 1
+            elif options_array[i] == '--timeout':
+                i += 1
+
+                if i >= len(options_array) or not options_array[i].isdigit():
+                    eprint("The timeout must be a number of seconds.")
+                    exit(1)
+
+                self.timeout = int(options_array[i])
+                i += 1
+            elif options_array[i] == '--target' or options_array[i] == '--root':
+                i += 1
+
+                if i >= len(options_array):
+                    eprint("No home directory given to deploy configs to.")
+                    exit(1)
+
+                if not os.path.isdir(options_array[i]):
+                    eprint("The target " + options_array[i] + " isn't a directory.")
+                    exit(1)
+
+                self.targets.append(os.path.abspath(options_array[i]))
+                i += 1
+            elif options_array[i] == '--manager':
+                i += 1
+
+                if i >= len(options_array) or options_array[i] not in SUPPORTED_PACKAGE_MANAGERS_COMMANDS:
+                    eprint("--manager must be one of " + ", ".join(SUPPORTED_PACKAGE_MANAGERS_COMMANDS) + ".")
+                    exit(1)
+
+                self.manager = options_array[i]
+                i += 1
+            elif options_array[i] == '--answers':
+                i += 1
+
+                if i >= len(options_array):
+                    eprint("No answers file given.")
+                    exit(1)
+
+                self.answers_file = options_array[i]
+                i += 1
+            elif options_array[i] == '--save-answers':
+                i += 1
+
+                if i >= len(options_array):
+                    eprint("No file given to save the answers to.")
+                    exit(1)
+
+                self.save_answers = options_array[i]
+                i += 1
+            elif options_array[i] == '--plan':
+                i += 1
+
+                if i >= len(options_array):
+                    eprint("No file given to write the plan to.")
+                    exit(1)
+
+                self.plan_file = options_array[i]
+                i += 1
+            elif options_array[i] == '--no-prompt':
+                self.interactive = False
+                i += 1
+            elif options_array[i] == '--refresh-ttl':
+                i += 1
+
+                if i >= len(options_array) or not options_array[i].isdigit():
+                    eprint("The refresh TTL must be a number of minutes.")
+                    exit(1)
+
+                self.refresh_ttl = int(options_array[i]) * 60
+                i += 1
+            elif options_array[i] == '--refresh':
+                self.force_refresh = True
+                i += 1
+            elif options_array[i] == '--from-bundle':
+                i += 1
+
+                if i >= len(options_array) or not os.path.isfile(options_array[i]):
+                    eprint("--from-bundle needs a bundle file made by the bundle mode.")
+                    exit(1)
+
+                self.from_bundle = options_array[i]
+                i += 1
+            elif options_array[i] == '--output' or options_array[i] == '-o':
+                i += 1
+
+                if i >= len(options_array):
+                    eprint("No file given to write the bundle to.")
+                    exit(1)
+
+                self.output = options_array[i]
+                i += 1
+            elif options_array[i] == '--hardlink':
+                self.hardlink = True
+                i += 1
+            elif options_array[i] == '--link':
+                self.link = True
+                i += 1
+            elif options_array[i] == '--no-journal':
+                self.use_journal = False
+                i += 1
+            elif options_array[i] == '--poll':
+                self.poll = True
+                i += 1
+            elif options_array[i] == '--profile':
+                i += 1
+
+                if i >= len(options_array):
+                    eprint("No file given to write the profile to.")
+                    exit(1)
+
+                self.profile = options_array[i]
+                i += 1
+            elif options_array[i] == '--no-manifest-cache':
+                self.use_manifest_cache = False
+                i += 1
             elif options_array[i] == '--enable':
                 i += 1
 
@@ -95,27 +253,59 @@ class Options:
                 eprint("Unknown flag: " + options_array[i])
                 exit(1)
 
-    def is_package_enabled(self, package):
-        return (package.package_name() in self.enabled_packages_array or package.is_enabled() or self.all_enabled) and package.package_name() not in self.disabled_packages_array
+    def answers(self):
+        """
+        The answers given by the answers file and flags, flags win.
+        """
+        answers = Answers(self.interactive)
+
+        if self.answers_file is not None:
+            try:
+                answers.load(self.answers_file)
+            except AnswersError as e:
+                eprint(str(e))
+                exit(1)
+
+        if self.manager is not None:
+            answers.manager = self.manager
+
+        if self.skip_all:
+            answers.detected = ANSWER_SKIP
+
+        return answers
 
-    def enabled_packages(self, packages_list):
+    def unattended(self):
+        """
+        Whether every question is answered up front, by --no-prompt or an
+        answers file, so nothing may stop to ask once the plan runs.
+        """
+        return not self.interactive or self.answers_file is not None
+
+    def is_package_enabled(self, record):
+        return (record.name in self.enabled_packages_array or not record.disabled or self.all_enabled) and record.name not in self.disabled_packages_array
+
+    def enabled_packages(self, records):
+        """
+        Build a Package for every enabled record.
+        """
         packages = []
 
-        for package in packages_list:
-            if self.is_package_enabled(package):
-                success_print("Enabling " + package.package_name())
-                packages.append(package)
+        for record in records:
+            if self.is_package_enabled(record):
+                success_print("Enabling " + record.name)
+                packages.append(Package(record))
             elif self.verbose:
-                warning_print("Disabling " + package.package_name())
+                warning_print("Disabling " + record.name)
 
         return packages
 
 
 class Config:
-    def __init__(self, source, dest=None, platform="all"):
+    def __init__(self, source, dest=None, platform="all", template=False):
         self.source = source
         self.dest = dest
         self.platform = platform
+        self.template = template
 
     def valid(self):
         if self.platform == "all":
@@ -127,31 +317,28 @@ class Config:
         else:
             return False
 
-    def source_path(self):
-        return self.source
+    def source_path(self, variables=None):
+        return expand(self.source, variables)
 
-    def destination_path(self):
+    def destination_path(self, variables=None):
         if self.dest is None:
             # Remove up to the directory where this script is running.
             dir_path = os.path.dirname(os.path.realpath(__file__))
+            home = (variables if variables is not None else get_variables())["HOME"]
 
-            return self.source.replace(dir_path, str(Path.home()))
+            return self.source_path(variables).replace(dir_path, home)
         else:
-            return self.dest
+            return expand(self.dest, variables)
 
-    def make_dest_path(self, options: Options):
-        pth = os.path.split(self.destination_path())[0]
-
-        if os.path.exists(pth):
-            if options.verbose:
-                default_print("Path already exists: " + pth)
-            return
+    def template_variables(self, variables=None):
+        """
+        The variables to render the contents with, None unless it's a
+        template.
+        """
+        if not self.template:
+            return None
 
-        if options.verbose:
-            default_print("Making path " + pth)
-
-        if not options.dry_run:
-            pathlib.Path(pth).mkdir(parents=True, exist_ok=True)
+        return variables if variables is not None else get_variables()
 
     def __str__(self):
         if self.dest is not None:
@@ -163,63 +350,42 @@ class Config:
         return str(self)
 
 
+class Extract:
+    def __init__(self, dest, include=None):
+        self.dest = dest
+        self.include = include if include is not None else []
+
+    def __str__(self):
+        return "Extract (dest: " + self.dest + ", include: " + str(self.include) + ")"
+
+    def __repr__(self):
+        return str(self)
+
+
 class Package:
-    def __init__(self, dictionary):
-        if "name" not in dictionary or "supported-package-managers" not in dictionary:
-            eprint("Error invalid package: " + str(dictionary) +
-                   " " + str(type(dictionary)))
-            exit(1)
-        else:
-            self.name = dictionary["name"]
-            self.supported_package_managers = {}
-            self.disabled = False
-            self.configs = []
-            self.install_cmds = []
-            self.post_install_cmds = []
-            self.url = None
-            self.repo = None
-
-            if "disabled" in dictionary:
-                self.disabled = bool(dictionary["disabled"])
-
-            if dictionary["supported-package-managers"] is not None:
-                for pm in dictionary["supported-package-managers"]:
-                    if "name_" + pm in dictionary:
-                        self.supported_package_managers[pm] = dictionary["name_"+pm]
-                    else:
-                        self.supported_package_managers[pm] = self.name
-
-            if "configs" in dictionary:
-                for config in dictionary["configs"]:
-                    if "source" not in config:
-                        eprint(
-                            "No 'source' key in the 'config' section for " + self.name)
-                        exit(1)
-
-                    source = replace_variables(str(config["source"]))
-
-                    if "dest" in config:
-                        c = Config(source, dest=replace_variables(
-                            str(config["dest"])))
-                    else:
-                        c = Config(source)
-
-                    if c.valid():
-                        self.configs.append(c)
-
-            if "install-cmds" in dictionary:
-                for cmd in dictionary["install-cmds"]:
-                    self.install_cmds.append(replace_variables(cmd))
-
-            if "post-install-cmds" in dictionary:
-                for cmd in dictionary["post-install-cmds"]:
-                    self.post_install_cmds.append(replace_variables(cmd))
-
-            if "url" in dictionary:
-                self.url = dictionary["url"]
-
-            if "repo" in dictionary:
-                self.repo = dictionary["repo"]
+    def __init__(self, record):
+        self.name = record.name
+        self.entry_hash = record.entry_hash
+        self.supported_package_managers = record.managers
+        self.disabled = record.disabled
+        self.configs = []
+        self.install_cmds = record.install_cmds
+        self.post_install_cmds = record.post_install_cmds
+        self.url = record.url
+        self.repo = record.repo
+        self.ref = record.ref
+        self.extract = None
+        self.sha256 = record.sha256
+        self.depends_on = record.depends_on
+
+        for source, dest, template in record.configs:
+            c = Config(source, dest=dest, template=template)
+
+            if c.valid():
+                self.configs.append(c)
+
+        if record.extract is not None:
+            self.extract = Extract(record.extract[0], record.extract[1])
 
     def package_name(self, manager=None):
         if manager is not None and manager in self.supported_package_managers:
@@ -230,109 +396,245 @@ class Package:
     def is_enabled(self):
         return not self.disabled
 
-    def install_configs(self, options: Options):
+    def install_configs(self, options: Options, sync: ConfigSync, links: LinkFarm, variables=None):
+        """
+        Deploy every config of this package. Returns the number of files
+        which were copied, linked or removed.
+        """
+        changed = 0
+
         for conf in self.configs:
-            conf.make_dest_path(options)
+            source = conf.source_path(variables)
+            dest = conf.destination_path(variables)
 
-            if options.verbose:
-                default_print("Copying " + conf.source_path() +
-                              " to " + conf.destination_path())
+            if not os.path.exists(source):
+                eprint("The config source " + source +
+                       " for " + self.name + " does not exist.")
+                exit(1)
 
-            if not options.dry_run:
-                shutil.copy(conf.source_path(), conf.destination_path())
+            # A link would show the template instead of its contents.
+            if options.link and not conf.template:
+                linked, removed, conflicts = links.link(source, dest)
 
-    def install(self, options: Options, manager=None):
-        if which(self.name) is not None:
-            def conf():
-                warning_print("The binary " + self.name +
-                              " has been detected on this system. Do you wish to skip this package? (y/n): ", end="")
+                if len(conflicts) > 0:
+                    for path, reason in conflicts:
+                        eprint(path + " " + reason, bold=False)
 
-            if options.skip_all or confirm_prompt(conf):
-                warning_print("Skipping " + self.name)
-                return False
+                    eprint("Not linking " + source + " for " + self.name +
+                           ", move the conflicting files out of the way first.")
+                    exit(1)
 
-        if manager is None:
-            self.__install_with_url(options)
-        elif manager not in self.supported_package_managers:
-            if self.url is not None or self.repo is not None:
-                def conf():
-                    warning_print("The package " + self.name + " cannot be installed by " +
-                                  manager + ". Do you wish to install this package using the provided URL/repo (y/n): ", end="")
-
-                if confirm_prompt(conf):
-                    self.__install_with_url(options)
-                else:
-                    warning_print("Skipping " + self.name)
-                    return False
+                if options.verbose:
+                    default_print("Linked " + source + " to " + dest +
+                                  " (" + str(linked) + " linked, " + str(removed) + " removed)", bold=False)
+
+                changed += linked + removed
+                continue
+
+            # Switching back from --link, copying through a linked
+            # directory would write into the repository.
+            links.undo(source)
+
+            try:
+                copied, removed = sync.sync(source, dest, conf.template_variables(variables))
+            except VariableError as e:
+                eprint("Error in the config " + source + " for " + self.name + ": " + str(e))
+                exit(1)
+
+            if options.verbose:
+                default_print("Synced " + source + " to " + dest +
+                              " (" + str(copied) + " copied, " + str(removed) + " removed)", bold=False)
+
+            changed += copied + removed
+
+        return changed
+
+    def installed_by(self, installed=None):
+        """
+        The manager which has already installed this package, installed
+        maps each manager to the names it has installed.
+        """
+        if installed is None:
+            return None
+
+        for manager, names in installed.items():
+            if names is not None and manager in self.supported_package_managers and self.package_name(manager) in names:
+                return manager
+
+        return None
+
+    def route(self, managers):
+        """
+        The first of managers, in order of preference, which can install
+        this package.
+        """
+        for manager in managers:
+            if manager in self.supported_package_managers:
+                return manager
+
+        return None
+
+    def decide(self, answers: Answers, managers=None, present=None, installed=None):
+        """
+        Work out how this package will be installed from what is already on
+        the system and the answers. Returns (action, reason), action is
+        INSTALL_WITH_MANAGER, INSTALL_WITH_URL or None to skip the package for
+        reason. Both are None while a question is unanswered.
+        """
+        managers = managers if managers is not None else []
+
+        # Our own previous run got part of the way, finish what it started.
+        if not get_journal().is_started(self.name, self.entry_hash):
+            installed_by = self.installed_by(installed)
+
+            if installed_by is not None:
+                return (None, "already installed by " + installed_by)
+
+            if present is None:
+                detected = which(self.name) is not None
             else:
-                def conf():
-                    warning_print("The package " + self.name + " cannot be installed by " +
-                                  manager + ". Do you wish to skip this package (y/n): ", end="")
+                detected = self.name in present
 
-                if confirm_prompt(conf):
-                    warning_print("Skipping " + self.name)
-                    return False
-                else:
-                    eprint("Failed to install " + self.name)
-                    exit(1)
+            if detected:
+                answer = answers.on_detected(self.name)
+
+                if answer is None:
+                    return (None, None)
+
+                if answer == ANSWER_SKIP:
+                    return (None, "the binary is already present")
+
+        if len(managers) == 0:
+            return (INSTALL_WITH_URL, None)
+        elif self.route(managers) is not None:
+            return (INSTALL_WITH_MANAGER, None)
+
+        manager = " or ".join(managers)
+        answer = answers.on_unsupported(self.name, manager, self.url is not None or self.repo is not None)
+
+        if answer is None:
+            return (None, None)
+        elif answer == ANSWER_URL:
+            return (INSTALL_WITH_URL, None)
+        elif answer == ANSWER_SKIP:
+            return (None, manager + " can't install it")
+
+        eprint("Failed to install " + self.name + ", " + manager + " can't install it.")
+        exit(1)
+
+    def plan_entry(self, action, manager=None, batched=False):
+        """
+        What installing this package will run, for the JSON plan.
+        """
+        entry = {"action": action, "depends_on": self.depends_on}
+
+        if action == INSTALL_WITH_MANAGER:
+            entry["manager"] = manager
+            entry["name"] = self.package_name(manager)
+
+            if not batched:
+                entry["commands"] = [install_command(manager) + [self.package_name(manager)]]
         else:
-            self.__install_with_manager(options, manager)
+            if self.repo is not None:
+                entry["repo"] = self.repo
+                entry["ref"] = self.ref
+            else:
+                entry["url"] = self.url
+                entry["sha256"] = self.sha256
+
+                if self.extract is not None:
+                    entry["extract"] = {"dest": self.extract.dest, "include": self.extract.include}
+
+            entry["commands"] = self.install_cmds
 
+        entry["post_install_commands"] = self.post_install_cmds
+
+        return entry
+
+    def output_prefix(self):
+        return "[" + self.name + "] "
+
+    def run_post_install_cmds(self, options: Options):
         if len(self.post_install_cmds) > 0:
             status_print("Running post-install commands for " + self.name)
 
-            for cmd in self.post_install_cmds:
-                if not execute_system_cmd(cmd, options.dry_run):
+            for i, cmd in enumerate(self.post_install_cmds):
+                if not get_journal().run_step(self, "post-install-cmd " + str(i),
+                                              lambda cmd=cmd: execute_system_cmd(cmd, self.output_prefix())):
                     exit(1)
 
-        return True
-
-    def __install_with_url(self, options: Options):
+    def fetch(self, options: Options, progress=True):
+        # The install commands may need the fetched files again, so this is
+        # recorded but never skipped.
         if self.repo is not None:
-            self.__git_clone(options.dry_run)
+            get_journal().run_step(self, "fetch", self.__git_clone, skippable=False)
         else:
-            self.__download(options.dry_run)
+            get_journal().run_step(self, "fetch", lambda: self.__download(progress), skippable=False)
 
+    def run_install_cmds(self, options: Options):
         status_print("Running install commands for " + self.name)
 
-        for cmd in self.install_cmds:
-            if not execute_system_cmd(cmd, options.dry_run):
+        for i, cmd in enumerate(self.install_cmds):
+            if not get_journal().run_step(self, "install-cmd " + str(i),
+                                          lambda cmd=cmd: execute_system_cmd(cmd, self.output_prefix())):
                 exit(1)
 
         return True
 
-    def __git_clone(self, dry_run):
+    def __git_clone(self):
+        import repos
+        from bundle import BundleError
+
         if self.repo is None:
             eprint("No git repo URL provided for package " + self.name)
             exit(1)
 
-        if dry_run:
-            status_print("git clone " + self.repo)
-        else:
-            if os.system("git clone" + self.repo) != 0:
-                eprint("Git clone failed for package " + self.name)
-                exit(1)
+        try:
+            repos.checkout(self.repo, ref=self.ref, prefix=self.output_prefix())
+        except (repos.RepoError, BundleError, OSError) as e:
+            eprint(str(e))
+            eprint("Git checkout failed for package " + self.name)
+            exit(1)
+
+    def __download(self, progress=True):
+        from archives import ArchiveError
+        from bundle import BundleError
+        from downloads import download_file, download_and_extract, DownloadError
+        from requests import RequestException
 
-    def __download(self, dry_run):
         if self.url is None:
             eprint("No URL provided for package " + self.name)
             exit(1)
 
-        file_name = get_file_name_from_url(self.url)
-
-        if dry_run:
-            status_print("Download " + file_name + " from " + self.url + " ")
-        else:
-            download_file(self.url)
+        try:
+            if self.extract is not None:
+                count = download_and_extract(
+                    self.url, self.extract.dest, self.extract.include, progress, self.sha256)
+                default_print("Extracted " + str(count) + " files into " + self.extract.dest, bold=False)
+            else:
+                download_file(self.url, progress, self.sha256)
+        except (RequestException, OSError, DownloadError, ArchiveError, BundleError) as e:
+            eprint("Failed to download " + self.url + ": " + str(e))
+            exit(1)
 
-    def __install_with_manager(self, options: Options, manager):
+    def install_with_manager(self, options: Options, manager, concurrent=False):
         if manager is None:
             eprint("Failed attempt to install " +
                    self.name + ". No package manager.")
             exit(1)
         else:
-            return execute_system_cmd(
-                SUPPORTED_PACKAGE_MANAGERS_COMMANDS[manager] + " " + self.package_name(manager), options.dry_run)
+            # Package managers lock their database, only run one at a time
+            # per database.
+            def install():
+                refresh(manager, concurrent=concurrent)
+                prefix = output_prefix(manager, concurrent)
+
+                with manager_lock(manager):
+                    return execute_system_cmd(
+                        install_command(manager) + [self.package_name(manager)],
+                        prefix, mode="interactive" if prefix is None else "stream")
+
+            return get_journal().run_step(self, "install", install)
 
     def __str__(self) -> str:
         return "Package {{\n\tname: {0}\n\tsupported_package_managers: {1}\n\tconfigs: {2}\n\tinstall_cmds: {3}\n\tpost_install_cmds: {4}\n\turl: {5}\n}}".format(self.name, self.supported_package_managers, self.configs, self.install_cmds, self.post_install_cmds, self.url)
@@ -350,31 +652,128 @@ def main():
 
     options = Options(options)
 
-    manager = check_for_package_manager()
+    if options.offline and not options.use_cache:
+        eprint("--offline requires the download cache.")
+        exit(1)
+
+    manifest.configure(use_cache=options.use_manifest_cache)
+
+    if options.profile is None:
+        run(mode, options)
+        return
+
+    profiling.configure()
+
+    try:
+        with span("run", mode):
+            run(mode, options)
+    finally:
+        profiling.get_profiler().write(options.profile)
+        profiling.get_profiler().print_summary()
+        success_print("Wrote the profile to " + options.profile)
+
 
-    if manager is None:
+def run(mode, options: Options):
+    if mode == "status":
+        journal.configure(read_only=True)
+        print_status(load_packages_list())
+        return
+
+    if mode == "unlink_configs":
+        journal.configure(enabled=options.use_journal, read_only=options.dry_run)
+        unlink_configs(options.enabled_packages(load_packages_list()), options)
+        return
+
+    if mode == "watch":
+        journal.configure(enabled=options.use_journal, read_only=options.dry_run)
+        watch_configs(options.enabled_packages(load_packages_list()), options)
+        return
+
+    journal.configure(enabled=options.use_journal, read_only=options.dry_run)
+
+    if mode != "install_configs":
+        configure_backends(options)
+
+    if mode == "bundle":
+        create_bundle(options.enabled_packages(load_packages_list()), options)
+        return
+
+    answers = options.answers()
+    managers = find_package_managers(answers)
+
+    if len(managers) == 0:
         eprint(
             "No package manager was found and most packages require a package manager.")
         exit(1)
 
-    if options.verbose:
-        for k in SUPPORTED_VARIABLES:
-            default_print("Initializing variable " + k + " to " +
-                          SUPPORTED_VARIABLES[k], bold=False)
+    if mode == "update":
+        # Upgrades ask before they change anything, one at a time.
+        for manager in managers:
+            if not upgrade(manager, options.dry_run):
+                eprint("Updating the system with " + manager + " failed.")
+                exit(1)
+
+            success_print("Updated the system with " + manager)
+
+        return
 
     packages = load_packages_list()
 
+    # The manifest defines its own variables.
+    if options.verbose:
+        variables = get_variables()
+
+        for k in variables:
+            try:
+                default_print("Initializing variable " + k + " to " + variables[k], bold=False)
+            except VariableError as e:
+                warning_print("Variable " + k + " has no value: " + str(e))
+
     packages = options.enabled_packages(packages)
 
-    if mode == "install":
-        install_packages(packages, options, manager)
-        install_configs(packages, options)
-    elif mode == "install_packages":
-        install_packages(packages, options, manager)
-    elif mode == "install_configs":
+    if mode == "install" or mode == "install_packages":
+        plan = plan_install(packages, options, answers, managers)
+
+        if options.save_answers is not None:
+            answers.save(options.save_answers)
+
+        if options.plan_file is not None:
+            with open(options.plan_file, "w") as f:
+                json.dump(plan.to_json(), f, indent=4)
+
+        if options.dry_run:
+            write_line(json.dumps(plan.to_json(), indent=4))
+        else:
+            install_packages(plan, packages, options)
+
+    if mode == "install" or mode == "install_configs":
         install_configs(packages, options)
 
 
+def configure_backends(options: Options):
+    """
+    Import and set up everything which runs commands or touches the network.
+    """
+    import bundle
+    import downloads
+    import repos
+    import runner
+
+    runner.configure(options.jobs, options.timeout)
+    downloads.configure(options.cache_dir, options.cache_size,
+                        options.use_cache, options.offline, options.jobs)
+    repos.configure(offline=options.offline)
+    managers.configure(options.refresh_ttl, options.force_refresh, options.unattended())
+    bundle.configure(options.from_bundle)
+
+    if options.from_bundle is not None:
+        try:
+            bundle.get_bundle()
+        except (OSError, bundle.BundleError) as e:
+            eprint("Failed to open the bundle: " + str(e))
+            exit(1)
+
+
 def process_cli_args():
     mode = None
     options = list()
@@ -390,24 +789,52 @@ def process_cli_args():
             print(" install                \tInstall all packages and configs")
             print(" install_configs        \tInstall configs only")
             print(" install_packages       \tInstall packages only")
+            print(" update                 \tUpdate the packages already installed by the package manager")
+            print(" bundle                 \tFetch every download and repo into one file for offline installs")
+            print(" unlink_configs         \tRemove the links made by --link")
+            print(" status                 \tShow which install steps have completed")
+            print(" watch                  \tInstall configs, then copy every change to them until stopped")
             print("\nOptions")
             print(" --help, -h             \tShow this message")
             print(" --version              \tShow version information")
             print(" --disable [package]    \tDisable a package")
             print(" --enable  [package]    \tEnable a package")
             print(" --enable-all           \tEnable all packages")
-            print(" --dry-run              \tPrint commands but don't execute them.")
+            print(" --dry-run              \tPrint the plan as JSON and the config changes but don't make them.")
             print(" --skip-all             \tSkip any packages that are already installed but still install their configs.")
+            print(" --manager [manager]    \tOnly use this package manager when more than one is installed")
+            print(" --answers [file]       \tTake the answers to questions from this JSON file")
+            print(" --save-answers [file]  \tSave every answer given to a file for --answers")
+            print(" --plan [file]          \tWrite the plan as JSON to this file before installing")
+            print(" --no-prompt            \tFail instead of asking questions which aren't answered up front")
             print(
                 " --batch                \tInstall all enabled packages with a single package manager command")
             print(" --verbose              \tEnable verbose printing")
+            print(" --jobs, -j [n]         \tNumber of packages to work on at once")
+            print(" --timeout [seconds]    \tStop any command which runs longer than this")
+            print(" --link                 \tSymlink configs to this repository instead of copying them")
+            print(" --target, --root [home]\tDeploy configs into this home instead of yours, may be repeated")
+            print(" --hardlink             \tShare one copy of each config between all the targets")
+            print(" --no-journal           \tIgnore and don't update the record of completed steps")
+            print(" --poll                 \tHave watch check for changes every second instead of using inotify")
+            print(" --profile [file]       \tWrite a Chrome trace of where the run spent its time to this file")
+            print(" --no-manifest-cache    \tRead " + PACKAGES_FILE + " again instead of its compiled cache")
+            print(" --refresh-ttl [minutes]\tDon't refresh package metadata younger than this, " +
+                  str(managers.DEFAULT_REFRESH_TTL // 60) + " by default")
+            print(" --refresh              \tAlways refresh package metadata")
+            print(" --from-bundle [file]   \tTake downloads and repos from a bundle instead of the network")
+            print(" --output, -o [file]    \tWhere the bundle mode writes the bundle, " + DEFAULT_BUNDLE_FILE + " by default")
+            print(" --offline              \tOnly use previously cached downloads")
+            print(" --no-cache             \tDon't use the download cache")
+            print(" --cache-dir [dir]      \tDirectory for the download cache")
+            print(" --cache-size [MB]      \tMaximum size of the download cache")
 
             exit(0)
         elif arg == '--version':
             print(VERSION)
             exit(0)
         elif mode is None:
-            if arg == "install" or arg == "install_configs" or arg == "install_packages":
+            if arg == "install" or arg == "install_configs" or arg == "install_packages" or arg == "unlink_configs" or arg == "bundle" or arg == "update" or arg == "status" or arg == "watch":
                 mode = arg
             else:
                 eprint("Invalid mode: " + arg)
@@ -425,70 +852,569 @@ def process_cli_args():
     return (mode, options)
 
 
-def check_for_package_manager():
-    found_manager = None
+def find_package_managers(answers: Answers):
+    """
+    Every package manager on the system, or only the one asked for with
+    --manager.
+    """
+    available = which_all(SUPPORTED_PACKAGE_MANAGERS_COMMANDS)
+    candidates = [m for m in SUPPORTED_PACKAGE_MANAGERS_COMMANDS if m in available]
 
-    for manager in SUPPORTED_PACKAGE_MANAGERS_COMMANDS:
-        if which(manager):
-            if found_manager is None:
-                found_manager = manager
-            else:
-                opt = input("Two package managers have been found. \n1: " + found_manager +
-                            "\n2: " + manager + "\nWhich manager do you want to use (1/2): ")
-
-                if opt == "1":
-                    pass
-                elif opt == "2":
-                    found_manager = manager
-                else:
-                    eprint("Invalid option: " + opt)
-                    exit(1)
+    if len(candidates) == 0:
+        return []
+
+    try:
+        managers = answers.choose_managers(candidates)
+    except AnswersError as e:
+        eprint(str(e))
+        exit(1)
 
-                warning_print("Using " + found_manager)
+    if len(managers) > 1:
+        warning_print("Using " + ", ".join(managers))
 
-    return found_manager
+    return managers
+
+
+def installed_by_managers(managers):
+    """
+    What each of managers has installed, asked all at once.
+    """
+    if len(managers) < 2:
+        return {m: installed_packages(m) for m in managers}
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=len(managers)) as pool:
+        return dict(zip(managers, pool.map(installed_packages, managers)))
 
 
 def load_packages_list():
-    f = open(PACKAGES_FILE, "r")
-    packages = f.read()
-    packages = json.loads(packages)
+    """
+    The record of every package in the manifest, see manifest.py. Packages
+    are built from the enabled ones by Options.enabled_packages.
+    """
+    with span("manifest", "load_packages_list") as s:
+        records = load_manifest(PACKAGES_FILE, check_dependencies)
+        s.set("packages", len(records))
+
+        return records
+
+
+def plan_install(packages, options: Options, answers: Answers, managers=None):
+    """
+    Decide what happens to every package before anything runs, asking every
+    question which the flags and answers file don't settle up front. Each
+    package a manager installs goes to the most preferred manager which
+    supports it.
+    """
+    managers = by_preference(managers if managers is not None else [])
+    present = which_all([p.name for p in packages])
+    installed = installed_by_managers(managers)
+    journal = get_journal()
+    plan = Plan(managers)
+
+    for package in packages:
+        if journal.is_done(package.name, DONE_STEP, package.entry_hash):
+            plan.skip(package.name, "a previous run installed it")
+            continue
+
+        action, reason = package.decide(answers, managers, present, installed)
+
+        if action == INSTALL_WITH_MANAGER:
+            plan.add(package.name, action, None, package.route(managers))
+        elif action is not None:
+            plan.add(package.name, action, None)
+        elif reason is not None:
+            plan.skip(package.name, reason)
+
+    if len(answers.unanswered) > 0:
+        eprint("These questions need answers, give them with flags or --answers:")
+
+        for question in answers.unanswered:
+            eprint(" " + question, bold=False)
+
+        exit(1)
+
+    selected = {p.name: p for p in packages if p.name in plan.actions}
+
+    for package in selected.values():
+        for dep in package.depends_on:
+            if dep not in selected and options.verbose:
+                warning_print(package.name + " depends on " + dep +
+                              " which isn't being installed")
+
+    def deps_of(package):
+        return [d for d in package.depends_on if d in selected]
+
+    batched = set()
+
+    if options.batch_mode:
+        batched = {n for n in selected if n in plan.routes}
+
+        # A package waiting on something outside its manager's batch has to
+        # be installed on its own after it.
+        changed = True
+        while changed:
+            changed = False
+
+            for name in list(batched):
+                if any(d not in batched or plan.routes[d] != plan.routes[name] for d in deps_of(selected[name])):
+                    batched.discard(name)
+                    changed = True
+
+    for manager in plan.routed_managers():
+        batch = [n for n in selected if n in batched and plan.routes[n] == manager]
+
+        if len(batch) > 0:
+            base = install_command(manager)
+            names = list(dict.fromkeys(selected[n].package_name(manager) for n in batch))
+            plan.batches[manager] = batch
+            plan.batch_commands[manager] = [base + chunk for chunk in chunk_names(base, names)]
+
+        if needs_refresh(manager):
+            plan.refresh.append(SUPPORTED_PACKAGE_MANAGERS_REFRESH[manager])
+
+    for name, package in selected.items():
+        plan.entries[name] = package.plan_entry(plan.actions[name], plan.routes.get(name), name in batched)
+
+    for name, reason in plan.skipped.items():
+        if options.verbose or not reason.startswith("already installed"):
+            warning_print("Skipping " + name + ", " + reason)
+
+    return plan
+
 
-    packages_list = []
+def install_packages(plan: Plan, packages, options: Options):
+    journal = get_journal()
+    selected = {p.name: p for p in packages if p.name in plan.actions}
+    batched = {n for batch in plan.batches.values() for n in batch}
+    concurrent = plan.concurrent()
 
-    for package in packages["packages"]:
-        if "name" in package:
-            packages_list += [Package(package)]
+    def deps_of(package):
+        return [d for d in package.depends_on if d in selected]
+
+    scheduler = Scheduler(options.jobs)
+    # The names each manager failed to install.
+    failed = {m: [] for m in plan.batches}
+
+    for manager, names in plan.batches.items():
+        batch = [selected[n] for n in names]
+
+        def install_batch(manager=manager, batch=batch):
+            pending = [p for p in batch if not journal.is_done(
+                p.name, "install", p.entry_hash)]
+
+            if len(pending) == 0:
+                return
+
+            status_print("Installing " + str(len(pending)) +
+                         " packages with " + manager)
+            start = time.monotonic()
+            failed[manager].extend(batch_install([p.package_name(manager)
+                                                  for p in pending], manager, concurrent))
+
+            for p in pending:
+                journal.record(p.name, "install", p.entry_hash, p.package_name(
+                    manager) not in failed[manager], time.monotonic() - start)
+
+        scheduler.add("batch " + manager, install_batch, resource=manager_database(manager))
+
+    for name, package in selected.items():
+        deps = ["install " + d for d in deps_of(package)]
+        manager = plan.routes.get(name)
+        resource = None
+
+        if name in batched:
+            deps.append("batch " + manager)
+
+            def install_task(package=package, manager=manager):
+                if package.package_name(manager) in failed[manager]:
+                    eprint("Failed to install " + package.package_name(manager))
+                    return False
+
+                package.run_post_install_cmds(options)
+                journal.record(package.name, DONE_STEP, package.entry_hash, True, 0)
+                success_print("Successfully installed " +
+                              package.package_name(manager))
+        elif plan.actions[name] == INSTALL_WITH_URL:
+            scheduler.add("fetch " + name, lambda package=package: package.fetch(options))
+            deps.append("fetch " + name)
+
+            def install_task(package=package):
+                package.run_install_cmds(options)
+                package.run_post_install_cmds(options)
+                journal.record(package.name, DONE_STEP, package.entry_hash, True, 0)
+                success_print("Successfully installed " + package.name)
         else:
-            eprint("Error invalid package: " + str(package) +
-                   " " + str(type(package)))
+            # Queued behind the other installs on the same database instead of
+            # taking a worker to wait for its lock.
+            resource = manager_database(manager)
+
+            def install_task(package=package, manager=manager):
+                if not package.install_with_manager(options, manager, concurrent):
+                    return False
+
+                package.run_post_install_cmds(options)
+                journal.record(package.name, DONE_STEP, package.entry_hash, True, 0)
+                success_print("Successfully installed " +
+                              package.package_name(manager))
+
+        scheduler.add("install " + name, install_task, deps, resource)
+
+    sudo = None
+
+    # The managers share the terminal, sudo can't ask for a password while
+    # they're all running.
+    if concurrent and any(needs_sudo(m) for m in plan.routed_managers()):
+        sudo = SudoSession()
+
+        if not sudo.start():
+            eprint("sudo failed, the package managers can't install anything.")
             exit(1)
 
-    return packages_list
+    try:
+        ok = scheduler.run()
+    finally:
+        if sudo is not None:
+            sudo.close()
 
+    scheduler.report(None if options.verbose else 10)
 
-def install_packages(packages, options: Options, manager=None):
-    for package in packages:
-        if package.install(options, manager):
-            success_print("Successfully installed " +
-                          package.package_name(manager))
+    if not ok:
+        eprint("Not every package was installed.")
+        exit(1)
+
+
+def print_status(packages_list):
+    entries = get_journal().entries()
+
+    if len(entries) == 0:
+        warning_print("Nothing has been recorded yet.")
+        return
+
+    current = {p.name: p.entry_hash for p in packages_list}
+    by_package = {}
+
+    for entry in entries:
+        by_package.setdefault(entry[0], []).append(entry)
+
+    for name, steps in by_package.items():
+        if name not in current:
+            warning_print(name + " (no longer in " + PACKAGES_FILE + ")")
+        elif steps[0][2] != current[name]:
+            warning_print(name + " (changed since, will run again)")
+        elif any(s[1] == DONE_STEP for s in steps):
+            success_print(name + " (installed)")
+        else:
+            status_print(name)
+
+        for _, step, _, status, finished_at, duration in steps:
+            line = "{:<7} {}  {:>8.2f}s  {}".format(status, time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(finished_at)), duration, step)
+
+            if status == STATUS_OK:
+                default_print(line, bold=False)
+            else:
+                eprint(line, bold=False)
+
+
+def check_dependencies(packages_list):
+    names = {p.name for p in packages_list}
+
+    for package in packages_list:
+        for dep in package.depends_on:
+            if dep not in names:
+                eprint("The package " + package.name +
+                       " depends on an unknown package: " + dep)
+                exit(1)
+
+    cycle = find_cycle({p.name: p.depends_on for p in packages_list})
+
+    if cycle is not None:
+        eprint("Dependency cycle between packages: " + " -> ".join(cycle))
+        exit(1)
+
+
+def target_manifest(target: str, name: str):
+    """
+    Where the state for configs deployed into target is kept.
+    """
+    key = hashlib.sha256(target.encode()).hexdigest()[:16]
+
+    return os.path.join(state_dir(), "targets", key + "-" + name + ".json")
 
 
 def install_configs(packages, options: Options):
+    if len(options.targets) > 0:
+        install_configs_to_targets(packages, options)
+        return
+
+    sync = ConfigSync(dry_run=options.dry_run, verbose=options.verbose)
+    links = LinkFarm(dry_run=options.dry_run,
+                     verbose=options.verbose, sync=sync)
+
+    try:
+        for pkg in packages:
+            status_print("Installing configs for " + pkg.name)
+            # The sync manifest already skips unchanged files, the journal
+            # only keeps track of when the configs were last deployed. A
+            # rerun which changes nothing writes nothing.
+            start = time.monotonic()
+
+            with span("configs", pkg.name):
+                changed = pkg.install_configs(options, sync, links)
+
+            if changed > 0 or not get_journal().is_done(pkg.name, "configs", pkg.entry_hash):
+                get_journal().record(pkg.name, "configs", pkg.entry_hash,
+                                     True, time.monotonic() - start)
+    finally:
+        sync.save()
+        links.save()
+
+
+def install_configs_to_targets(packages, options: Options):
+    # Shared so a config copied into one target can be cloned or hard
+    # linked into the rest.
+    copier = FileCopier(options.hardlink)
+    scheduler = Scheduler(options.jobs)
+    start = time.monotonic()
+
+    for target in options.targets:
+        def deploy(target=target):
+            variables = variables_for(target)
+            sync = ConfigSync(target_manifest(target, "configs"),
+                              options.dry_run, options.verbose, copier)
+            links = LinkFarm(target_manifest(target, "links"),
+                             options.dry_run, options.verbose, sync)
+
+            try:
+                for pkg in packages:
+                    with span("configs", pkg.name + " -> " + target):
+                        pkg.install_configs(options, sync, links, variables)
+            finally:
+                sync.save()
+                links.save()
+
+        scheduler.add("configs " + target, deploy)
+
+    status_print("Deploying configs for " + str(len(packages)) + " packages to " +
+                 str(len(options.targets)) + " targets")
+    ok = scheduler.run()
+    scheduler.report(None if options.verbose else 10)
+
+    if options.verbose:
+        for how, count in sorted(copier.counts.items()):
+            default_print("{:>8}  files by {}".format(count, how), bold=False)
+
+    if not ok:
+        eprint("The configs weren't deployed to every target.")
+        exit(1)
+
+    duration = time.monotonic() - start
+
     for pkg in packages:
-        status_print("Installing configs for " + pkg.name)
-        pkg.install_configs(options)
+        get_journal().record(pkg.name, "configs", pkg.entry_hash, True, duration)
+
+
+def create_bundle(packages, options: Options):
+    import downloads
+    import repos
+    from bundle import BundleWriter, KIND_FILE, KIND_REPO
+
+    path = options.output if options.output is not None else DEFAULT_BUNDLE_FILE
+    writer = BundleWriter(path)
+    scheduler = Scheduler(options.jobs)
+    work_dir = tempfile.mkdtemp(prefix=".bundle-", dir=os.path.dirname(os.path.abspath(path)))
+    # Downloads which aren't in the cache, removed once bundled.
+    temporary = []
+    # Cached downloads, kept from eviction until they're bundled.
+    fetched_files = []
+    # Packages may share a URL or repo, each is only bundled once.
+    urls = set()
+    repo_urls = set()
 
+    for package in packages:
+        if package.url is not None and package.url not in urls:
+            urls.add(package.url)
 
-def execute_system_cmd(cmd, dry_run):
-    default_print("Executing '" + cmd + "'", bold=False)
+            def add_file(package=package):
+                if options.dry_run:
+                    status_print("Bundle " + package.url)
+                    return
 
-    if not dry_run:
-        code = os.system(cmd)
+                fetched = downloads.fetch(package.url, True, package.sha256)
+                fetched_files.append(fetched)
 
-        if code != 0:
-            eprint("Error: The return code was " + code + ", not 0.")
-            return False
+                if fetched.entry is None:
+                    temporary.append(fetched.path)
+
+                writer.add(KIND_FILE, package.url, fetched.path, fetched.filename)
+
+            scheduler.add("fetch " + package.name, add_file)
+
+        if package.repo is not None and package.repo not in repo_urls:
+            repo_urls.add(package.repo)
+
+            def add_repo(package=package):
+                if options.dry_run:
+                    status_print("Bundle " + package.repo)
+                    return
+
+                dest = os.path.join(work_dir, package.name + ".bundle")
+                repos.bundle_mirror(package.repo, dest, package.output_prefix())
+                writer.add(KIND_REPO, package.repo, dest, package.name + ".bundle")
+
+            scheduler.add("mirror " + package.name, add_repo)
+
+    try:
+        ok = scheduler.run()
+        scheduler.report(None if options.verbose else 10)
+
+        if not ok:
+            eprint("Not every artifact could be fetched, no bundle was written.")
+            exit(1)
+
+        if not options.dry_run:
+            size = writer.write()
+            success_print("Wrote " + str(len(writer.members)) + " artifacts to " +
+                          path + " (" + file_size_string(size).strip() + ")")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+        for fetched in fetched_files:
+            fetched.release()
+
+        for p in temporary:
+            os.remove(p)
+
+
+def watch_configs(packages, options: Options):
+    """
+    Deploy the configs once, then wait for their sources to change and only
+    copy what changed, to every target.
+    """
+    import signal
+    from watch import watcher_for
+
+    if options.link:
+        eprint("Linked configs always match the repository, there is nothing to watch.")
+        exit(1)
+
+    install_configs(packages, options)
+
+    copier = FileCopier(options.hardlink)
+    syncs = []
+    # Each source to the syncs and destinations it is deployed with.
+    sources = {}
+
+    for target in (options.targets if len(options.targets) > 0 else [None]):
+        if target is None:
+            variables = None
+            sync = ConfigSync(None, options.dry_run, options.verbose, copier)
+        else:
+            variables = variables_for(target)
+            sync = ConfigSync(target_manifest(target, "configs"), options.dry_run, options.verbose, copier)
+
+        syncs.append(sync)
+
+        for pkg in packages:
+            for conf in pkg.configs:
+                source = os.path.abspath(conf.source_path(variables))
+                sources.setdefault(source, []).append(
+                    (sync, conf.destination_path(variables), conf.template_variables(variables)))
+
+    if len(sources) == 0:
+        warning_print("None of the enabled packages have configs to watch.")
+        return
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # Stopped like any other daemon, the manifests are still saved.
+    signal.signal(signal.SIGTERM, stop)
+    watcher, polling = watcher_for(list(sources), options.poll)
+    status_print("Watching " + str(len(sources)) + " config sources" +
+                 (" for changes every second" if polling else "") + ", press Ctrl-C to stop")
+
+    try:
+        while True:
+            changed = watcher.wait()
+
+            for source, deployments in sources.items():
+                paths = [p for p in changed if p == source or p.startswith(source + os.sep)]
+
+                if len(paths) == 0:
+                    continue
+
+                for sync, dest, template in deployments:
+                    try:
+                        copied, removed = sync.sync_paths(source, dest, paths, template)
+                    except (OSError, VariableError) as e:
+                        # Most likely changed again while it was copied,
+                        # the next event brings it up to date.
+                        warning_print("Failed to sync " + source + " to " + dest + ": " + str(e))
+                        continue
+
+                    if copied > 0 or removed > 0:
+                        success_print("Synced " + source + " to " + dest +
+                                      " (" + str(copied) + " copied, " + str(removed) + " removed)")
+
+            for sync in syncs:
+                sync.save()
+    except KeyboardInterrupt:
+        status_print("Stopped watching")
+    finally:
+        watcher.close()
+
+        for sync in syncs:
+            sync.save()
+
+
+def unlink_configs(packages, options: Options):
+    if len(options.targets) > 0:
+        farms = [(variables_for(t), LinkFarm(target_manifest(t, "links"), options.dry_run, options.verbose))
+                 for t in options.targets]
+    else:
+        farms = [(None, LinkFarm(dry_run=options.dry_run, verbose=options.verbose))]
+
+    try:
+        for pkg in packages:
+            removed = 0
+
+            for variables, links in farms:
+                for conf in pkg.configs:
+                    removed += links.undo(conf.source_path(variables))
+
+            if removed > 0:
+                status_print("Removed " + str(removed) +
+                             " config links for " + pkg.name)
+                get_journal().forget(pkg.name, "configs")
+    finally:
+        for _, links in farms:
+            links.save()
+
+
+def execute_system_cmd(cmd, prefix=None, mode="stream"):
+    from runner import get_runner, command_string
+
+    default_print("Executing '" + command_string(cmd) + "'", bold=False)
+
+    with span("command", command_string(cmd)) as s:
+        result = get_runner().run(cmd, prefix, mode)
+        s.set("status", "timed out" if result.timed_out else result.returncode)
+
+    if result.timed_out:
+        eprint("Error: '" + command_string(cmd) + "' timed out after {:.0f}s.".format(result.duration))
+        return False
+
+    if result.returncode != 0:
+        if mode == "quiet":
+            for line in result.output:
+                eprint(line.rstrip("\n"), bold=False)
+
+        eprint("Error: The return code was " +
+               str(result.returncode) + ", not 0.")
+        return False
 
     return True
 
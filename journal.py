@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from pathlib import Path
+from terminal import default_print
+from utils import state_dir
+from profiling import span
+
+# Written once every step of a package has completed.
+DONE_STEP = "done"
+
+# The steps of installing a package, as opposed to deploying its configs.
+INSTALL_STEPS = ["fetch", "install"]
+# Numbered steps, "install-cmd 0" and so on.
+NUMBERED_INSTALL_STEPS = ["install-cmd", "post-install-cmd"]
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+
+
+def default_journal_path():
+    return os.path.join(state_dir(), "journal.sqlite")
+
+
+class Journal:
+    """
+    Records every completed install step per package together with a hash of
+    the package's manifest entry, so a rerun can skip what already succeeded
+    and resume at the first step that failed or whose package changed.
+    """
+
+    def __init__(self, path=None, read_only=False):
+        self.path = path if path is not None else default_journal_path()
+        self.read_only = read_only
+        self.lock = threading.Lock()
+
+        if read_only and not os.path.isfile(self.path):
+            self.db = None
+            return
+
+        import sqlite3
+
+        Path(os.path.dirname(self.path)).mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS steps (
+            package TEXT NOT NULL,
+            step TEXT NOT NULL,
+            entry_hash TEXT NOT NULL,
+            status TEXT NOT NULL,
+            finished_at REAL NOT NULL,
+            duration REAL NOT NULL,
+            seq INTEGER NOT NULL,
+            PRIMARY KEY (package, step))""")
+        self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def is_done(self, package: str, step: str, entry_hash: str):
+        if self.db is None:
+            return False
+
+        with self.lock:
+            row = self.db.execute("SELECT entry_hash, status FROM steps WHERE package = ? AND step = ?",
+                                  (package, step)).fetchone()
+
+        return row is not None and row[0] == entry_hash and row[1] == STATUS_OK
+
+    def is_started(self, package: str, entry_hash: str):
+        """
+        Whether a previous run got part of the way through installing
+        package. Deploying its configs doesn't count.
+        """
+        if self.db is None:
+            return False
+
+        steps = " OR ".join(["step = ?"] * len(INSTALL_STEPS) + ["step LIKE ?"] * len(NUMBERED_INSTALL_STEPS))
+
+        with self.lock:
+            row = self.db.execute("SELECT 1 FROM steps WHERE package = ? AND entry_hash = ? AND status = ? AND (" +
+                                  steps + ")",
+                                  [package, entry_hash, STATUS_OK] + INSTALL_STEPS +
+                                  [s + " %" for s in NUMBERED_INSTALL_STEPS]).fetchone()
+
+        return row is not None
+
+    def record(self, package: str, step: str, entry_hash: str, ok: bool, duration: float):
+        if self.db is None or self.read_only:
+            return
+
+        with self.lock:
+            # A changed package starts over, forget what its old entry did.
+            self.db.execute("DELETE FROM steps WHERE package = ? AND entry_hash != ?",
+                            (package, entry_hash))
+            seq = self.db.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM steps").fetchone()[0]
+            self.db.execute("INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (package, step, entry_hash, STATUS_OK if ok else STATUS_FAILED,
+                             time.time(), duration, seq))
+            self.db.commit()
+
+    def forget(self, package: str, step=None):
+        if self.db is None or self.read_only:
+            return
+
+        with self.lock:
+            if step is None:
+                self.db.execute("DELETE FROM steps WHERE package = ?", (package,))
+            else:
+                self.db.execute("DELETE FROM steps WHERE package = ? AND step = ?", (package, step))
+
+            self.db.commit()
+
+    def run_step(self, package, step: str, fn, skippable=True):
+        """
+        Run fn as step of package unless the journal says it already
+        completed. Returns whether the step succeeded.
+        """
+        if skippable and self.is_done(package.name, step, package.entry_hash):
+            default_print("Already completed " + step + " for " + package.name, bold=False)
+            return True
+
+        start = time.monotonic()
+
+        try:
+            with span("step", package.name + " " + step) as s:
+                ok = fn() is not False
+                s.set("status", "ok" if ok else "failed")
+        except BaseException:
+            self.record(package.name, step, package.entry_hash, False, time.monotonic() - start)
+            raise
+
+        self.record(package.name, step, package.entry_hash, ok, time.monotonic() - start)
+
+        return ok
+
+    def entries(self):
+        """
+        Every recorded step as (package, step, entry_hash, status, finished_at,
+        duration), in the order they finished.
+        """
+        if self.db is None:
+            return []
+
+        with self.lock:
+            return self.db.execute(
+                "SELECT package, step, entry_hash, status, finished_at, duration FROM steps ORDER BY seq").fetchall()
+
+
+class NullJournal(Journal):
+    """
+    A journal which remembers nothing, for --no-journal and dry runs.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.read_only = True
+        self.lock = threading.Lock()
+        self.db = None
+
+
+_journal = NullJournal()
+
+
+def get_journal():
+    return _journal
+
+
+def configure(path=None, enabled=True, read_only=False):
+    global _journal
+
+    _journal.close()
+
+    if enabled:
+        _journal = Journal(path, read_only)
+    else:
+        _journal = NullJournal()
@@ -0,0 +1,252 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from terminal import default_print, warning_print
+from utils import state_dir
+
+
+def default_manifest_path():
+    return os.path.join(state_dir(), "links.json")
+
+
+class LinkFarm:
+    """
+    Deploys configs as symlinks back into the repository, like GNU stow. A
+    directory is linked whole while its destination doesn't exist, otherwise
+    its contents are linked one by one. Every link made is recorded so it can
+    be undone.
+    """
+
+    def __init__(self, manifest_path=None, dry_run=False, verbose=False, sync=None):
+        self.manifest_path = manifest_path if manifest_path is not None else default_manifest_path()
+        self.dry_run = dry_run
+        self.verbose = verbose
+        # Files copied by this ConfigSync may be replaced by links.
+        self.sync = sync
+        self.links, self.dirs = self.__load()
+        self.changed = False
+
+    def __load(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return ({}, [])
+
+        if not isinstance(manifest, dict) or not isinstance(manifest.get("links"), dict):
+            return ({}, [])
+
+        return (manifest["links"], manifest.get("dirs", []))
+
+    def save(self):
+        if self.dry_run or not self.changed:
+            return
+
+        directory = os.path.dirname(self.manifest_path)
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".links-")
+
+        with os.fdopen(fd, "w") as f:
+            json.dump({"links": self.links, "dirs": self.dirs}, f)
+
+        os.replace(tmp, self.manifest_path)
+        self.changed = False
+
+    def __state(self, path: str, virtual):
+        """
+        What path is, or will be once the planned unfolds have run.
+        """
+        if path in virtual:
+            return virtual[path]
+
+        if os.path.islink(path):
+            return ("link", os.readlink(path))
+
+        if os.path.isdir(path):
+            return ("dir", None)
+
+        if os.path.lexists(path):
+            return ("file", None)
+
+        return ("missing", None)
+
+    def __plan(self, src: str, dst: str, root: str, actions, conflicts, seen, virtual):
+        kind, current = self.__state(dst, virtual)
+
+        if kind == "missing":
+            actions.append(("link", src, dst))
+        elif kind == "link":
+            owner = self.links.get(dst)
+
+            if owner is None and dst in virtual:
+                # Will be linked by the config whose directory is unfolded.
+                owner = {"root": None}
+
+            if current == src:
+                pass
+            elif owner is None:
+                conflicts.append((dst, "is a symlink to " + current))
+                return
+            elif owner["root"] == root or not os.path.exists(current):
+                actions.append(("relink", src, dst))
+            elif os.path.isdir(src) and os.path.isdir(current):
+                # Another config linked this directory whole, split it into
+                # links to its contents so both fit.
+                actions.append(("unfold", current, dst))
+                virtual[dst] = ("dir", None)
+
+                for name in os.listdir(current):
+                    virtual[os.path.join(dst, name)] = ("link", os.path.join(current, name))
+
+                for name in sorted(os.listdir(src)):
+                    self.__plan(os.path.join(src, name), os.path.join(dst, name),
+                                root, actions, conflicts, seen, virtual)
+            else:
+                conflicts.append((dst, "is already linked to " + current))
+                return
+        elif kind == "dir" and os.path.isdir(src):
+            for name in sorted(os.listdir(src)):
+                self.__plan(os.path.join(src, name), os.path.join(dst, name),
+                            root, actions, conflicts, seen, virtual)
+            return
+        elif kind == "file" and not os.path.isdir(src) and self.sync is not None and self.sync.is_deployed(dst):
+            actions.append(("replace", src, dst))
+        else:
+            conflicts.append((dst, "already exists"))
+            return
+
+        seen.add(dst)
+
+    def plan(self, source: str, dest: str):
+        """
+        Work out the links needed to deploy source to dest without touching
+        anything. Returns the actions and a list of (path, reason) conflicts.
+        """
+        root = os.path.abspath(source)
+        dest = os.path.normpath(dest) if os.path.isdir(source) else dest
+
+        if not os.path.isdir(source) and (dest.endswith("/") or (os.path.isdir(dest) and not os.path.islink(dest))):
+            dest = os.path.join(dest, os.path.basename(root))
+
+        actions = []
+        conflicts = []
+        seen = set()
+        self.__plan(root, os.path.normpath(dest), root, actions, conflicts, seen, {})
+
+        # Links this config made before which it no longer needs.
+        for path, entry in self.links.items():
+            if entry["root"] == root and path not in seen:
+                actions.append(("remove", entry["source"], path))
+
+        return (actions, conflicts)
+
+    def __symlink(self, src: str, dst: str, root: str):
+        Path(os.path.dirname(dst)).mkdir(parents=True, exist_ok=True)
+        os.symlink(src, dst)
+        self.links[dst] = {"source": src, "root": root}
+        self.changed = True
+
+    def __apply(self, action, root: str):
+        kind, src, dst = action
+
+        if self.verbose or self.dry_run:
+            if kind == "remove":
+                warning_print("Removing link " + dst)
+            elif kind == "unfold":
+                default_print("Splitting " + dst + " into links to its contents")
+            else:
+                default_print("Linking " + dst + " to " + src)
+
+        if self.dry_run:
+            return
+
+        if kind == "link":
+            self.__symlink(src, dst, root)
+        elif kind == "relink" or kind == "replace":
+            os.remove(dst)
+
+            if kind == "replace":
+                self.sync.forget(dst)
+
+            self.__symlink(src, dst, root)
+        elif kind == "unfold":
+            owner = self.links.pop(dst)["root"]
+            os.remove(dst)
+            os.mkdir(dst)
+            self.dirs.append(dst)
+
+            for name in os.listdir(src):
+                self.__symlink(os.path.join(src, name), os.path.join(dst, name), owner)
+        elif kind == "remove":
+            if os.path.islink(dst) and os.readlink(dst) == src:
+                os.remove(dst)
+
+            del self.links[dst]
+            self.changed = True
+
+    def link(self, source: str, dest: str):
+        """
+        Link source to dest. Nothing is changed if there are conflicts.
+        Returns the number of links made and removed, and the conflicts.
+        """
+        actions, conflicts = self.plan(source, dest)
+
+        if len(conflicts) > 0:
+            return (0, 0, conflicts)
+
+        root = os.path.abspath(source)
+        linked = 0
+        removed = 0
+
+        for action in actions:
+            self.__apply(action, root)
+
+            if action[0] == "remove":
+                removed += 1
+            elif action[0] != "unfold":
+                linked += 1
+
+        return (linked, removed, conflicts)
+
+    def undo(self, source=None):
+        """
+        Remove every link made for source, or every link if it is None.
+        Returns the number of links removed.
+        """
+        root = os.path.abspath(source) if source is not None else None
+        removed = 0
+
+        for path, entry in list(self.links.items()):
+            if root is not None and entry["root"] != root:
+                continue
+
+            if self.verbose or self.dry_run:
+                warning_print("Removing link " + path)
+
+            if self.dry_run:
+                removed += 1
+                continue
+
+            # Leave anything which has been replaced since alone.
+            if os.path.islink(path) and os.readlink(path) == entry["source"]:
+                os.remove(path)
+
+            del self.links[path]
+            self.changed = True
+            removed += 1
+
+        if not self.dry_run:
+            # Deepest first so nested directories empty out their parents.
+            for path in sorted(self.dirs, key=len, reverse=True):
+                try:
+                    os.rmdir(path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+
+                self.dirs.remove(path)
+                self.changed = True
+
+        return removed
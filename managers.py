@@ -0,0 +1,484 @@
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from terminal import eprint, default_print, warning_print
+from profiling import span
+
+SUPPORTED_PACKAGE_MANAGERS_COMMANDS = {
+    "apt": "sudo apt install",
+    "pacman": "sudo pacman -S",
+    "yay": "yay -S",
+    "brew": "brew install"
+}
+
+SUPPORTED_PACKAGE_MANAGERS_REFRESH = {
+    "apt": ["sudo", "apt", "update"],
+    "pacman": ["sudo", "pacman", "-Sy"],
+    "yay": ["yay", "-Sy"],
+    "brew": ["brew", "update"]
+}
+
+SUPPORTED_PACKAGE_MANAGERS_UPGRADE = {
+    "apt": ["sudo", "apt", "upgrade"],
+    "pacman": ["sudo", "pacman", "-Su"],
+    "yay": ["yay", "-Su"],
+    "brew": ["brew", "upgrade"]
+}
+
+# Every manager updates in two steps, pacman's -Syu is split too so the
+# refresh can be skipped when the metadata is still fresh.
+SUPPORTED_PACKAGE_MANAGERS_SYSTEM_UPDATE = {
+    m: [SUPPORTED_PACKAGE_MANAGERS_REFRESH[m], SUPPORTED_PACKAGE_MANAGERS_UPGRADE[m]]
+    for m in SUPPORTED_PACKAGE_MANAGERS_REFRESH
+}
+
+SUPPORTED_PACKAGE_MANAGERS_LIST_INSTALLED = {
+    "apt": ["dpkg-query", "-W", "-f=${Package}\t${db:Status-Abbrev}\n"],
+    "pacman": ["pacman", "-Qq"],
+    "yay": ["yay", "-Qq"],
+    "brew": [["brew", "list", "--formula", "-1"], ["brew", "list", "--cask", "-1"]]
+}
+
+# Added to every install command, the plan was confirmed before anything ran
+# so the managers mustn't stop to ask again. Upgrades only add them when
+# nobody is there to confirm.
+SUPPORTED_PACKAGE_MANAGERS_NO_CONFIRM = {
+    "apt": ["-y"],
+    "pacman": ["--noconfirm"],
+    "yay": ["--noconfirm"],
+    "brew": []
+}
+
+# Which manager each package goes to when it supports more than one of the
+# available managers, unless the manifest's "manager-preference" says
+# otherwise.
+DEFAULT_MANAGER_PREFERENCE = ["apt", "pacman", "yay", "brew"]
+
+# apt, pacman and brew each hold a lock on their own database while they
+# run, yay runs pacman so it has to wait for the same one. Different
+# databases can be worked on at the same time.
+MANAGER_DATABASES = {
+    "apt": "dpkg",
+    "pacman": "pacman",
+    "yay": "pacman",
+    "brew": "brew"
+}
+
+_database_locks = {db: threading.Lock() for db in set(MANAGER_DATABASES.values())}
+
+# How often sudo's credentials are refreshed while managers run at once,
+# well inside its default five minute timeout.
+SUDO_REFRESH_SECONDS = 60
+
+# Used when the system won't tell us its argument limit.
+DEFAULT_ARG_MAX = 131072
+
+DEFAULT_REFRESH_TTL = 60 * 60
+
+_refresh_ttl = DEFAULT_REFRESH_TTL
+_force_refresh = False
+_unattended = False
+_refreshed = set()
+_preference = list(DEFAULT_MANAGER_PREFERENCE)
+
+
+def configure(refresh_ttl=None, force_refresh=False, unattended=False):
+    """
+    unattended is for runs where every question was answered up front, the
+    upgrades mustn't stop to ask for confirmation either.
+    """
+    global _refresh_ttl, _force_refresh, _unattended
+
+    _refresh_ttl = refresh_ttl if refresh_ttl is not None else DEFAULT_REFRESH_TTL
+    _force_refresh = force_refresh
+    _unattended = unattended
+
+
+def configure_preference(preference=None):
+    """
+    Set the order managers are preferred in from the manifest, any it leaves
+    out come after it in the default order. Raises ValueError if it isn't a
+    list of supported managers.
+    """
+    global _preference
+
+    if preference is None:
+        _preference = list(DEFAULT_MANAGER_PREFERENCE)
+        return
+
+    if not isinstance(preference, list) or any(m not in SUPPORTED_PACKAGE_MANAGERS_COMMANDS for m in preference):
+        raise ValueError("it must be a list of " + ", ".join(SUPPORTED_PACKAGE_MANAGERS_COMMANDS) + ".")
+
+    ordered = list(dict.fromkeys(preference))
+    _preference = ordered + [m for m in DEFAULT_MANAGER_PREFERENCE if m not in ordered]
+
+
+def by_preference(managers):
+    return [m for m in _preference if m in managers]
+
+
+def manager_database(manager):
+    return MANAGER_DATABASES[manager]
+
+
+def manager_lock(manager):
+    """
+    The lock to hold while manager changes the system.
+    """
+    return _database_locks[manager_database(manager)]
+
+
+def install_command(manager):
+    return SUPPORTED_PACKAGE_MANAGERS_COMMANDS[manager].split() + SUPPORTED_PACKAGE_MANAGERS_NO_CONFIRM[manager]
+
+
+def output_prefix(manager, concurrent=False):
+    """
+    What the output of manager is shown behind when it runs alongside other
+    managers, None gives it the terminal.
+    """
+    return "[" + manager + "] " if concurrent else None
+
+
+def needs_sudo(manager):
+    return install_command(manager)[0] == "sudo" or SUPPORTED_PACKAGE_MANAGERS_REFRESH[manager][0] == "sudo"
+
+
+class SudoSession:
+    """
+    Asks for the sudo password once, on the terminal, before several managers
+    start at once, then keeps the credentials fresh until it's closed so
+    none of them has to ask halfway through while others share the terminal.
+    """
+
+    def __init__(self, interval=SUDO_REFRESH_SECONDS):
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Returns whether sudo can be used.
+        """
+        from runner import get_runner
+
+        default_print("Executing 'sudo -v'", bold=False)
+
+        if get_runner().run(["sudo", "-v"], mode="interactive").returncode != 0:
+            return False
+
+        def keep_alive():
+            while not self.stopped.wait(self.interval):
+                # -n never asks, if the credentials are gone it just fails.
+                get_runner().run(["sudo", "-n", "-v"], mode="quiet")
+
+        self.thread = threading.Thread(target=keep_alive, name="sudo", daemon=True)
+        self.thread.start()
+
+        return True
+
+    def close(self):
+        self.stopped.set()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def metadata_paths(manager):
+    """
+    Files or directories which are rewritten whenever manager refreshes its
+    repository metadata.
+    """
+    if manager == "apt":
+        return ["/var/lib/apt/lists"]
+
+    if manager == "pacman" or manager == "yay":
+        return ["/var/lib/pacman/sync"]
+
+    if manager == "brew":
+        cache = os.environ.get("HOMEBREW_CACHE")
+
+        if not cache:
+            cache = os.path.join(str(Path.home()), "Library/Caches/Homebrew" if sys.platform ==
+                                 "darwin" else ".cache/Homebrew")
+
+        # The API download, or the fetch of the tap for older installs.
+        return [os.path.join(cache, "api", "formula.jws.json"),
+                "/opt/homebrew/.git/FETCH_HEAD",
+                "/usr/local/Homebrew/.git/FETCH_HEAD",
+                "/home/linuxbrew/.linuxbrew/Homebrew/.git/FETCH_HEAD"]
+
+    return []
+
+
+def metadata_age(manager):
+    """
+    Seconds since manager last refreshed its metadata, or None if unknown.
+    """
+    newest = None
+
+    for path in metadata_paths(manager):
+        try:
+            if os.path.isdir(path):
+                with os.scandir(path) as it:
+                    mtimes = [e.stat().st_mtime for e in it if e.is_file()]
+            else:
+                mtimes = [os.stat(path).st_mtime]
+        except OSError:
+            continue
+
+        if len(mtimes) > 0 and (newest is None or max(mtimes) > newest):
+            newest = max(mtimes)
+
+    if newest is None:
+        return None
+
+    return max(0, time.time() - newest)
+
+
+def needs_refresh(manager):
+    """
+    Whether refresh() would run the refresh command for manager.
+    """
+    if manager in _refreshed:
+        return False
+
+    age = metadata_age(manager)
+
+    return _force_refresh or age is None or age >= _refresh_ttl
+
+
+def refresh(manager, dry_run=False, concurrent=False):
+    """
+    Refresh manager's repository metadata, at most once per run and not at
+    all while it is fresher than the TTL. Returns whether the metadata can be
+    used.
+    """
+    with manager_lock(manager):
+        if manager in _refreshed:
+            return True
+
+        age = metadata_age(manager)
+
+        if not _force_refresh and age is not None and age < _refresh_ttl:
+            default_print("The " + manager + " metadata was refreshed " + str(int(age // 60)) +
+                          " minutes ago, not refreshing it again", bold=False)
+            _refreshed.add(manager)
+            return True
+
+        ok = run_cmd(SUPPORTED_PACKAGE_MANAGERS_REFRESH[manager], dry_run, output_prefix(manager, concurrent))
+
+        if ok:
+            _refreshed.add(manager)
+        else:
+            warning_print("Refreshing the " + manager + " metadata failed, carrying on with what we have.")
+
+        return ok
+
+
+def upgrade_commands(manager):
+    """
+    The commands which update the system after the refresh, which refresh()
+    runs on its own so it can be skipped.
+    """
+    commands = SUPPORTED_PACKAGE_MANAGERS_SYSTEM_UPDATE[manager][1:]
+
+    if _unattended:
+        return [cmd + SUPPORTED_PACKAGE_MANAGERS_NO_CONFIRM[manager] for cmd in commands]
+
+    return commands
+
+
+def upgrade(manager, dry_run):
+    refresh(manager, dry_run)
+    ok = True
+
+    with manager_lock(manager):
+        for cmd in upgrade_commands(manager):
+            if not run_cmd(cmd, dry_run):
+                ok = False
+                break
+
+    forget_installed(manager)
+
+    return ok
+
+
+def arg_max():
+    try:
+        limit = os.sysconf("SC_ARG_MAX")
+    except (ValueError, OSError, AttributeError):
+        limit = -1
+
+    if limit <= 0:
+        limit = DEFAULT_ARG_MAX
+
+    # The environment shares the same space as the arguments, leave it room
+    # and keep a healthy margin on top of that.
+    env_size = sum(len(k) + len(v) + 2 for k, v in os.environ.items())
+
+    return max(4096, (limit - env_size) // 2)
+
+
+def chunk_names(base_cmd, names, limit=None):
+    """
+    Split names into groups so that each command stays under the argv limit.
+    """
+    if limit is None:
+        limit = arg_max()
+
+    def arg_size(arg):
+        # Each argument costs its bytes, a terminator and a pointer.
+        return len(arg.encode()) + 1 + 8
+
+    base_size = sum(arg_size(a) for a in base_cmd)
+    chunks = []
+    current = []
+    size = base_size
+
+    for name in names:
+        n = arg_size(name)
+
+        if len(current) > 0 and size + n > limit:
+            chunks.append(current)
+            current = []
+            size = base_size
+
+        current.append(name)
+        size += n
+
+    if len(current) > 0:
+        chunks.append(current)
+
+    return chunks
+
+
+def run_cmd(cmd, dry_run=False, prefix=None):
+    """
+    Run a manager command with the terminal, or with its output streamed
+    behind prefix.
+    """
+    from runner import get_runner, command_string
+
+    default_print("Executing '" + command_string(cmd) + "'", bold=False)
+
+    if dry_run:
+        return True
+
+    # The manager may ask questions, give it the terminal.
+    with span("manager", command_string(cmd)) as s:
+        result = get_runner().run(cmd, prefix, mode="interactive" if prefix is None else "stream")
+        s.set("status", result.returncode)
+
+    if result.returncode != 0:
+        eprint("Error: The return code was " + str(result.returncode) + ", not 0.")
+        return False
+
+    return True
+
+
+def batch_install(names, manager, concurrent=False):
+    """
+    Install names with as few package manager invocations as possible.
+    concurrent is whether other managers are running at the same time.
+    Returns the names which failed to install, even individually.
+    """
+    base = install_command(manager)
+    prefix = output_prefix(manager, concurrent)
+    failed = []
+
+    refresh(manager, concurrent=concurrent)
+
+    # Remove duplicates, two packages may map to the same manager name.
+    unique = list(dict.fromkeys(names))
+
+    with manager_lock(manager):
+        for chunk in chunk_names(base, unique):
+            if run_cmd(base + chunk, prefix=prefix):
+                continue
+
+            if len(chunk) == 1:
+                failed += chunk
+                continue
+
+            warning_print("Batch install failed, falling back to installing " +
+                          str(len(chunk)) + " packages one at a time.")
+
+            for name in chunk:
+                if not run_cmd(base + [name], prefix=prefix):
+                    failed.append(name)
+
+    return failed
+
+
+def command_list(commands):
+    """
+    Commands are either a single argv list or a list of them.
+    """
+    if len(commands) > 0 and isinstance(commands[0], list):
+        return commands
+
+    return [commands]
+
+
+def parse_installed(manager, output: str):
+    installed = set()
+
+    for line in output.splitlines():
+        if manager == "apt":
+            # Only count packages dpkg reports as installed, not removed ones
+            # which still have their config files around.
+            fields = line.split("\t")
+
+            if len(fields) < 2 or not fields[1].startswith("ii"):
+                continue
+
+            line = fields[0]
+
+        line = line.strip()
+
+        if line:
+            installed.add(line)
+
+    return installed
+
+
+_installed_cache = {}
+
+
+def installed_packages(manager):
+    """
+    Ask manager for every installed package in one go. Returns a set of
+    package names, or None if the manager couldn't be queried.
+    """
+    from runner import get_runner, command_string
+
+    if manager in _installed_cache:
+        return _installed_cache[manager]
+
+    installed = set()
+
+    for cmd in command_list(SUPPORTED_PACKAGE_MANAGERS_LIST_INSTALLED[manager]):
+        with span("manager", command_string(cmd)) as s:
+            result = get_runner().run(cmd, mode="quiet")
+            s.set("status", result.returncode)
+
+        if result.returncode != 0:
+            installed = None
+            break
+
+        installed |= parse_installed(manager, "".join(result.output))
+
+    _installed_cache[manager] = installed
+
+    return installed
+
+
+def forget_installed(manager=None):
+    if manager is None:
+        _installed_cache.clear()
+    else:
+        _installed_cache.pop(manager, None)
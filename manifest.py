@@ -0,0 +1,258 @@
+import gc
+import hashlib
+import json
+import marshal
+import os
+import sys
+import tempfile
+from pathlib import Path
+from terminal import eprint
+from utils import cache_dir
+from managers import configure_preference
+from variables import VariableError, configure as configure_variables, get_variables
+
+# Bump when the shape of a record changes.
+CACHE_VERSION = 3
+
+_cache_enabled = True
+_cache_dir = None
+
+
+class PackageRecord:
+    """
+    A validated manifest entry with its commands already expanded. Records
+    are what the manifest cache stores, a Package is only built from one
+    once it has been enabled.
+    """
+
+    __slots__ = ("name", "entry_hash", "disabled", "managers", "configs", "install_cmds",
+                 "post_install_cmds", "url", "repo", "ref", "sha256", "extract", "depends_on")
+
+    def __init__(self, name, entry_hash, disabled, managers, configs, install_cmds,
+                 post_install_cmds, url, repo, ref, sha256, extract, depends_on):
+        self.name = name
+        self.entry_hash = entry_hash
+        self.disabled = disabled
+        # Package manager to the name it knows the package by.
+        self.managers = managers
+        # (source, dest, template) tuples, dest is None to mirror the source
+        # into HOME. Their variables are expanded per target when deployed,
+        # and in the contents of templates.
+        self.configs = configs
+        self.install_cmds = install_cmds
+        self.post_install_cmds = post_install_cmds
+        self.url = url
+        self.repo = repo
+        self.ref = ref
+        self.sha256 = sha256
+        # None or (dest, include).
+        self.extract = extract
+        self.depends_on = depends_on
+
+    def to_tuple(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __repr__(self):
+        return "PackageRecord (name: " + self.name + ")"
+
+
+def compile_entry(dictionary, variables):
+    """
+    Validate one manifest entry and turn it into a PackageRecord.
+    """
+    if not isinstance(dictionary, dict) or "name" not in dictionary or "supported-package-managers" not in dictionary:
+        eprint("Error invalid package: " + str(dictionary) +
+               " " + str(type(dictionary)))
+        exit(1)
+
+    name = dictionary["name"]
+
+    try:
+        return _compile_entry(name, dictionary, variables)
+    except VariableError as e:
+        eprint("Error in the package " + name + ": " + str(e))
+        exit(1)
+
+
+def _compile_entry(name, dictionary, variables):
+    entry_hash = hashlib.sha256(json.dumps(dictionary, sort_keys=True).encode()).hexdigest()
+    managers = {}
+    configs = []
+    extract = None
+
+    if dictionary["supported-package-managers"] is not None:
+        for pm in dictionary["supported-package-managers"]:
+            managers[pm] = dictionary.get("name_" + pm, name)
+
+    for config in dictionary.get("configs", []):
+        if "source" not in config:
+            eprint("No 'source' key in the 'config' section for " + name)
+            exit(1)
+
+        source = str(config["source"])
+        dest = str(config["dest"]) if "dest" in config else None
+
+        # Only checked, the values depend on the target.
+        variables.check(source)
+
+        if dest is not None:
+            variables.check(dest)
+
+        configs.append((source, dest, bool(config.get("template", False))))
+
+    if "extract" in dictionary:
+        if "dest" not in dictionary["extract"]:
+            eprint("No 'dest' key in the 'extract' section for " + name)
+            exit(1)
+
+        include = dictionary["extract"].get("include", [])
+
+        if isinstance(include, str):
+            include = [include]
+
+        extract = (variables.expand(str(dictionary["extract"]["dest"])), [str(i) for i in include])
+
+    return PackageRecord(
+        name,
+        entry_hash,
+        bool(dictionary.get("disabled", False)),
+        managers,
+        configs,
+        [variables.expand(cmd) for cmd in dictionary.get("install-cmds", [])],
+        [variables.expand(cmd) for cmd in dictionary.get("post-install-cmds", [])],
+        dictionary.get("url"),
+        dictionary.get("repo"),
+        str(dictionary["ref"]) if "ref" in dictionary else None,
+        str(dictionary["sha256"]) if "sha256" in dictionary else None,
+        extract,
+        [str(d) for d in dictionary.get("depends-on", [])]
+    )
+
+
+def default_cache_dir():
+    return os.path.join(cache_dir(), "manifests")
+
+
+def configure(use_cache=True, cache_dir=None):
+    global _cache_enabled, _cache_dir
+
+    _cache_enabled = use_cache
+    _cache_dir = cache_dir
+
+
+def cache_key(path: str, st):
+    """
+    The file a compiled manifest was made from and the Python which wrote
+    the cache. The values of the variables used are checked separately.
+    """
+    return (CACHE_VERSION, marshal.version, sys.version_info[:2], os.path.abspath(path),
+            st.st_mtime_ns, st.st_size)
+
+
+def cache_path(path: str):
+    directory = _cache_dir if _cache_dir is not None else default_cache_dir()
+
+    return os.path.join(directory, hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:16] + ".bin")
+
+
+def load_cached(path: str, key):
+    """
+    The records cached for path, or None if the file or the values of the
+    variables it used have changed since. The manifest's variables and
+    manager preference are set up from the cache too.
+    """
+    # Nothing loaded here is garbage, collecting while tens of thousands of
+    # containers are made only costs time.
+    collecting = gc.isenabled()
+    gc.disable()
+
+    try:
+        # Reading it whole, marshal.load reads a file in small pieces.
+        with open(cache_path(path), "rb") as f:
+            cached_key, definitions, preference, used, records = marshal.loads(f.read())
+
+        if cached_key != key:
+            return None
+
+        configure_preference(preference)
+        configure_variables(definitions)
+        current = get_variables()
+
+        # Only what the commands used is resolved.
+        if any(current[name] != value for name, value in used.items()):
+            return None
+
+        return [PackageRecord(*r) for r in records]
+    except (OSError, EOFError, ValueError, TypeError, VariableError):
+        return None
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def save_cached(path: str, key, definitions, preference, used, records):
+    destination = cache_path(path)
+
+    try:
+        Path(os.path.dirname(destination)).mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(destination), prefix=".manifest-")
+
+        with os.fdopen(fd, "wb") as f:
+            f.write(marshal.dumps((key, definitions, preference, used, [r.to_tuple() for r in records])))
+
+        os.replace(tmp, destination)
+    except OSError:
+        # The cache only saves time, a run doesn't need it.
+        pass
+
+
+def load_manifest(path: str, validate=None):
+    """
+    The records of every package in the manifest at path, the manifest's
+    variables and manager preference are set up along the way. The compiled records are cached
+    until the file or the values of the variables they used change.
+    validate is called with the records before they're cached, so a cached
+    manifest is known to be valid.
+    """
+    st = os.stat(path)
+    key = cache_key(path, st)
+
+    if _cache_enabled:
+        cached = load_cached(path, key)
+
+        if cached is not None:
+            return cached
+
+    with open(path, "r") as f:
+        manifest = json.load(f)
+
+    definitions = manifest.get("variables")
+    preference = manifest.get("manager-preference")
+
+    try:
+        configure_preference(preference)
+    except ValueError as e:
+        eprint("Error in the manager-preference of " + path + ": " + str(e))
+        exit(1)
+
+    try:
+        configure_variables(definitions)
+    except VariableError as e:
+        eprint("Error in the variables of " + path + ": " + str(e))
+        exit(1)
+
+    current = get_variables()
+    used = current.track()
+
+    try:
+        records = [compile_entry(package, current) for package in manifest["packages"]]
+    finally:
+        current.stop()
+
+    if validate is not None:
+        validate(records)
+
+    if _cache_enabled:
+        save_cached(path, key, definitions, preference, used, records)
+
+    return records
@@ -0,0 +1,208 @@
+import json
+import os
+import tempfile
+from terminal import warning_print, confirm_prompt
+
+ANSWER_SKIP = "skip"
+ANSWER_INSTALL = "install"
+ANSWER_URL = "url"
+ANSWER_FAIL = "fail"
+
+ANSWERS = [ANSWER_SKIP, ANSWER_INSTALL, ANSWER_URL, ANSWER_FAIL]
+
+
+class AnswersError(Exception):
+    pass
+
+
+class Answers:
+    """
+    Answers to every question an install can ask. They come from flags, an
+    answers file or the terminal, and are all settled while planning so the
+    install itself never waits on anyone.
+
+    detected is the answer for packages whose binary is already on the
+    system (skip or install), unsupported for packages the package manager
+    can't install (url, skip or fail). packages holds answers for single
+    packages which take precedence over both.
+    """
+
+    def __init__(self, interactive=True):
+        self.manager = None
+        self.detected = None
+        self.unsupported = None
+        self.packages = {}
+        self.interactive = interactive
+        self.unanswered = []
+
+    def load(self, path: str):
+        try:
+            with open(path, "r") as f:
+                answers = json.load(f)
+        except OSError as e:
+            raise AnswersError("Failed to read " + path + ": " + str(e))
+        except ValueError as e:
+            raise AnswersError(path + " isn't valid JSON: " + str(e))
+
+        if not isinstance(answers, dict):
+            raise AnswersError(path + " must contain a JSON object.")
+
+        for key in ["detected", "unsupported"]:
+            if key in answers and answers[key] not in ANSWERS:
+                raise AnswersError("Invalid answer for '" + key + "' in " + path + ": " + str(answers[key]))
+
+        packages = answers.get("packages", {})
+
+        if not isinstance(packages, dict) or any(a not in ANSWERS for a in packages.values()):
+            raise AnswersError("'packages' in " + path + " must map package names to one of " +
+                               ", ".join(ANSWERS) + ".")
+
+        self.manager = answers.get("manager", self.manager)
+        self.detected = answers.get("detected", self.detected)
+        self.unsupported = answers.get("unsupported", self.unsupported)
+        self.packages.update(packages)
+
+    def save(self, path: str):
+        answers = {"packages": self.packages}
+
+        for key in ["manager", "detected", "unsupported"]:
+            if getattr(self, key) is not None:
+                answers[key] = getattr(self, key)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".answers-")
+
+        with os.fdopen(fd, "w") as f:
+            json.dump(answers, f, indent=4)
+
+        os.replace(tmp, path)
+
+    def __confirm(self, question: str, prompt_fn):
+        if not self.interactive:
+            self.unanswered.append(question)
+            return None
+
+        return confirm_prompt(prompt_fn)
+
+    def choose_managers(self, candidates):
+        """
+        The managers to install with, every one found unless a single one
+        was asked for.
+        """
+        if self.manager is not None:
+            if self.manager not in candidates:
+                raise AnswersError("The package manager " + self.manager + " wasn't found.")
+
+            return [self.manager]
+
+        return candidates
+
+    def on_detected(self, name: str):
+        """
+        Whether to skip or install a package whose binary is already present.
+        """
+        answer = self.packages.get(name, self.detected)
+
+        if answer is not None:
+            return ANSWER_SKIP if answer == ANSWER_SKIP else ANSWER_INSTALL
+
+        def conf():
+            warning_print("The binary " + name +
+                          " has been detected on this system. Do you wish to skip this package? (y/n): ", end="")
+
+        skip = self.__confirm("Skip " + name + ", its binary is already present", conf)
+
+        if skip is None:
+            return None
+
+        self.packages[name] = ANSWER_SKIP if skip else ANSWER_INSTALL
+
+        return self.packages[name]
+
+    def on_unsupported(self, name: str, manager: str, has_source: bool):
+        """
+        What to do with a package none of the managers can install: install
+        it from its URL or repo, skip it or fail. manager names them.
+        """
+        answer = self.packages.get(name, self.unsupported)
+
+        if answer == ANSWER_URL or answer == ANSWER_INSTALL:
+            return ANSWER_URL if has_source else ANSWER_FAIL
+
+        if answer is not None:
+            return answer
+
+        if has_source:
+            def conf():
+                warning_print("The package " + name + " cannot be installed by " +
+                              manager + ". Do you wish to install this package using the provided URL/repo (y/n): ", end="")
+
+            use_url = self.__confirm("Install " + name + " from its URL/repo, " + manager + " can't install it", conf)
+
+            if use_url is None:
+                return None
+
+            self.packages[name] = ANSWER_URL if use_url else ANSWER_SKIP
+        else:
+            def conf():
+                warning_print("The package " + name + " cannot be installed by " +
+                              manager + ". Do you wish to skip this package (y/n): ", end="")
+
+            skip = self.__confirm("Skip " + name + ", " + manager + " can't install it", conf)
+
+            if skip is None:
+                return None
+
+            self.packages[name] = ANSWER_SKIP if skip else ANSWER_FAIL
+
+        return self.packages[name]
+
+
+class Plan:
+    """
+    Everything an install will do, worked out before any of it runs.
+    routes holds the manager each package installed by a manager goes to,
+    batches the packages each manager installs in one go.
+    """
+
+    def __init__(self, managers=None):
+        self.managers = managers if managers is not None else []
+        self.routes = {}
+        self.refresh = []
+        self.batches = {}
+        self.batch_commands = {}
+        self.actions = {}
+        self.entries = {}
+        self.skipped = {}
+
+    def add(self, name: str, action: str, entry, manager=None):
+        self.actions[name] = action
+        self.entries[name] = entry
+
+        if manager is not None:
+            self.routes[name] = manager
+
+    def routed_managers(self):
+        """
+        The managers which have something to install, in preference order.
+        """
+        return [m for m in self.managers if m in self.routes.values()]
+
+    def concurrent(self):
+        """
+        Whether more than one manager will be running at the same time.
+        """
+        return len(self.routed_managers()) > 1
+
+    def skip(self, name: str, reason: str):
+        self.skipped[name] = reason
+
+    def to_json(self):
+        return {
+            "managers": self.managers,
+            "refresh": self.refresh,
+            "batches": {m: {"packages": self.batches[m], "commands": self.batch_commands.get(m, [])}
+                        for m in self.batches},
+            "packages": self.entries,
+            "skipped": self.skipped
+        }
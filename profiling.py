@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+import time
+from terminal import status_print, default_print
+
+_profiler = None
+
+
+class Span:
+    """
+    One timed step of a run. Anything set with set() is shown with the event
+    in the trace viewer, bytes and status are also used by the summary.
+    """
+
+    __slots__ = ("profiler", "category", "name", "args", "start", "end", "thread")
+
+    def __init__(self, profiler, category: str, name: str, args):
+        self.profiler = profiler
+        self.category = category
+        self.name = name
+        self.args = args
+        self.start = None
+        self.end = None
+        self.thread = None
+
+    def set(self, key: str, value):
+        self.args[key] = value
+
+    def __enter__(self):
+        self.thread = threading.current_thread()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+
+        if exc_type is not None and "status" not in self.args:
+            self.args["status"] = exc_type.__name__
+
+        self.profiler.add(self)
+        return False
+
+
+class NullSpan:
+    """
+    What span() returns while profiling is off.
+    """
+
+    def set(self, key: str, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_null_span = NullSpan()
+
+
+class Profiler:
+    """
+    Collects the spans of a run for --profile.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self.lock:
+            if span.thread.ident not in self.threads:
+                self.threads[span.thread.ident] = (len(self.threads) + 1, span.thread.name)
+
+            self.spans.append(span)
+
+    def to_trace(self):
+        """
+        The spans in the Chrome trace event format, for chrome://tracing or
+        Perfetto.
+        """
+        pid = os.getpid()
+        events = []
+
+        with self.lock:
+            spans = list(self.spans)
+            threads = dict(self.threads)
+
+        for tid, name in threads.values():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+
+        for span in spans:
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": round((span.start - self.origin) * 1_000_000, 3),
+                "dur": round((span.end - span.start) * 1_000_000, 3),
+                "pid": pid,
+                "tid": threads[span.thread.ident][0],
+                "args": span.args
+            })
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_trace(), f)
+
+    def print_summary(self, limit=10):
+        with self.lock:
+            spans = list(self.spans)
+
+        categories = {}
+
+        for span in spans:
+            total = categories.setdefault(span.category, [0, 0.0, 0])
+            total[0] += 1
+            total[1] += span.end - span.start
+            total[2] += span.args.get("bytes", 0)
+
+        status_print("Time by category")
+        default_print("{:<10} {:>7} {:>10} {:>10}".format("category", "count", "seconds", "bytes"), bold=False)
+
+        for category, (count, seconds, moved) in sorted(categories.items(), key=lambda c: -c[1][1]):
+            default_print("{:<10} {:>7} {:>10.3f} {:>10}".format(category, count, seconds, moved), bold=False)
+
+        status_print("Slowest steps")
+        default_print("{:>10} {:<10} {:<10} {}".format("seconds", "category", "status", "step"), bold=False)
+
+        # The whole run is one span, it would always come first.
+        steps = [s for s in spans if s.category != "run"]
+
+        for span in sorted(steps, key=lambda s: s.start - s.end)[:limit]:
+            default_print("{:>10.3f} {:<10} {:<10} {}".format(
+                span.end - span.start, span.category, str(span.args.get("status", "")), " ".join(span.name.split())), bold=False)
+
+
+def configure(enabled=True):
+    global _profiler
+
+    _profiler = Profiler() if enabled else None
+
+
+def get_profiler():
+    return _profiler
+
+
+def span(category: str, name: str, **args):
+    """
+    Time the steps in a with block: with span("download", url) as s: ...
+    Costs next to nothing while profiling is off.
+    """
+    if _profiler is None:
+        return _null_span
+
+    return Span(_profiler, category, name, args)
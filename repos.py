@@ -0,0 +1,185 @@
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+from bundle import get_bundle, KIND_REPO
+from cache import url_key
+from runner import get_runner, command_string
+from terminal import eprint, default_print
+from profiling import span
+from utils import cache_dir
+
+_repos_dir = None
+_offline = False
+_mirror_locks = {}
+_mirror_locks_lock = threading.Lock()
+
+
+class RepoError(Exception):
+    pass
+
+
+def configure(repos_dir=None, offline=False):
+    global _repos_dir, _offline
+
+    _repos_dir = repos_dir
+    _offline = offline
+
+
+def default_repos_dir():
+    return os.path.join(cache_dir(), "repos")
+
+
+def repos_dir():
+    return _repos_dir if _repos_dir is not None else default_repos_dir()
+
+
+def checkout_name(url: str):
+    """
+    The directory git clone would create for url.
+    """
+    name = urlparse(url).path.rstrip("/").rsplit("/")[-1]
+
+    if name.endswith(".git"):
+        name = name[:-4]
+
+    return name
+
+
+def mirror_path(url: str):
+    return os.path.join(repos_dir(), url_key(url)[:16] + "-" + checkout_name(url) + ".git")
+
+
+def is_commit(ref: str):
+    return re.fullmatch(r"[0-9a-fA-F]{7,40}", ref) is not None
+
+
+def git(args, prefix=None, cwd=None):
+    cmd = ["git"] + args
+
+    if prefix is not None:
+        default_print("Executing '" + command_string(cmd) + "'", bold=False)
+
+    with span("git", command_string(cmd)) as s:
+        result = get_runner().run(cmd, prefix, mode="quiet", cwd=cwd)
+        s.set("status", result.returncode)
+
+    if not result.ok():
+        for line in result.output:
+            eprint(line.rstrip("\n"), bold=False)
+
+        raise RepoError("'" + command_string(cmd) + "' failed with code " + str(result.returncode))
+
+    return "".join(result.output).strip()
+
+
+def mirror_lock(url: str):
+    with _mirror_locks_lock:
+        if url not in _mirror_locks:
+            _mirror_locks[url] = threading.Lock()
+
+        return _mirror_locks[url]
+
+
+def update_from_bundle(url: str, mirror: str, entry, prefix=None):
+    # git can only read a bundle from a file, write out just this one.
+    Path(repos_dir()).mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=repos_dir(), prefix=".bundle-")
+    os.close(fd)
+
+    try:
+        get_bundle().write_to(entry, tmp)
+
+        if not os.path.isdir(mirror):
+            git(["clone", "--mirror", "--quiet", tmp, mirror], prefix)
+            git(["--git-dir", mirror, "remote", "set-url", "origin", url], prefix)
+        else:
+            git(["--git-dir", mirror, "fetch", "--quiet", tmp, "+refs/*:refs/*"], prefix)
+    finally:
+        os.remove(tmp)
+
+
+def bundle_mirror(url: str, dest: str, prefix=None):
+    """
+    Write every ref of the mirror of url into the git bundle dest.
+    """
+    git(["--git-dir", update_mirror(url, prefix), "bundle", "create", "--quiet", dest, "--all"], prefix)
+
+
+def update_mirror(url: str, prefix=None):
+    """
+    Make sure the bare mirror of url exists and is up to date. A bundle given
+    with --from-bundle is used instead of the network.
+    """
+    mirror = mirror_path(url)
+    b = get_bundle()
+    entry = b.lookup(KIND_REPO, url) if b is not None else None
+
+    with mirror_lock(url):
+        if entry is not None:
+            update_from_bundle(url, mirror, entry, prefix)
+        elif not os.path.isdir(mirror):
+            if _offline:
+                raise RepoError(url + " has not been mirrored yet and we are offline.")
+
+            Path(repos_dir()).mkdir(parents=True, exist_ok=True)
+            git(["clone", "--mirror", "--quiet", url, mirror], prefix)
+        elif not _offline:
+            git(["--git-dir", mirror, "fetch", "--prune", "--quiet", "origin"], prefix)
+
+    return mirror
+
+
+def resolve_ref(dest: str, ref: str):
+    """
+    What to check out for ref in the checkout dest. A branch is checked out
+    as it is in the mirror, not as a local branch.
+    """
+    if is_commit(ref) or git(["-C", dest, "tag", "--list", ref]) != "":
+        return ref
+
+    return "origin/" + ref
+
+
+def checkout(url: str, dest=None, ref=None, prefix=None):
+    """
+    Check url out into dest, by default the directory git clone would use.
+    The checkout is made from a local mirror, an existing checkout is
+    fast-forwarded instead. ref pins a branch, tag or commit.
+    """
+    if dest is None:
+        dest = checkout_name(url)
+
+    mirror = update_mirror(url, prefix)
+
+    if not os.path.exists(dest):
+        # A local clone hardlinks the mirror's objects, nothing is copied.
+        git(["clone", "--quiet", mirror, dest], prefix)
+        git(["-C", dest, "remote", "set-url", "origin", url], prefix)
+
+        if ref is not None:
+            git(["-C", dest, "checkout", "--quiet", "--detach", resolve_ref(dest, ref)], prefix)
+
+        return dest
+
+    if not os.path.isdir(os.path.join(dest, ".git")):
+        raise RepoError(dest + " already exists and isn't a git checkout.")
+
+    git(["-C", dest, "fetch", "--quiet", "--tags", mirror,
+         "+refs/heads/*:refs/remotes/origin/*"], prefix)
+
+    if ref is not None:
+        git(["-C", dest, "checkout", "--quiet", "--detach", resolve_ref(dest, ref)], prefix)
+        return dest
+
+    if git(["-C", dest, "rev-parse", "--abbrev-ref", "HEAD"]) == "HEAD":
+        # It was pinned before, go back to the default branch. git makes
+        # the local branch from origin's if there isn't one yet.
+        branch = git(["--git-dir", mirror, "symbolic-ref", "--short", "HEAD"])
+        git(["-C", dest, "checkout", "--quiet", branch], prefix)
+
+    git(["-C", dest, "merge", "--ff-only", "--quiet", "@{upstream}"], prefix)
+
+    return dest
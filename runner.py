@@ -0,0 +1,214 @@
+import asyncio
+import os
+import shlex
+import signal
+import threading
+import time
+from terminal import TerminalHandover, write_line
+
+DEFAULT_CONCURRENCY = 4
+OUTPUT_TAIL_LINES = 20
+LINE_LIMIT = 1024 * 1024
+
+# Commands containing any of these need a shell to run.
+SHELL_CHARACTERS = set("|&;<>()$`\\*?[]~!{}#\n")
+
+
+def split_command(cmd):
+    """
+    Turn a command string into an argv list, or None if it needs a shell.
+    """
+    if isinstance(cmd, list):
+        return cmd
+
+    if any(c in SHELL_CHARACTERS for c in cmd):
+        return None
+
+    try:
+        return shlex.split(cmd)
+    except ValueError:
+        return None
+
+
+def uses_sudo(argv):
+    return argv is not None and len(argv) > 0 and os.path.basename(argv[0]) == "sudo"
+
+
+def command_string(cmd):
+    if isinstance(cmd, list):
+        return " ".join(shlex.quote(a) for a in cmd)
+
+    return cmd
+
+
+class CommandResult:
+    def __init__(self, cmd, returncode, duration, output, timed_out=False):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.duration = duration
+        self.output = output
+        self.timed_out = timed_out
+
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out
+
+    def __str__(self):
+        return "CommandResult (cmd: " + command_string(self.cmd) + ", returncode: " + str(self.returncode) + ", duration: {:.2f}s)".format(self.duration)
+
+    def __repr__(self):
+        return str(self)
+
+
+class CommandRunner:
+    """
+    Runs commands on an asyncio event loop in a background thread so any
+    thread can run commands, and several can run at once up to the
+    concurrency limit.
+
+    Commands either stream their output a line at a time behind a prefix,
+    run interactively with the terminal attached, or run quietly with their
+    output only captured.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, timeout=None, out=None):
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.out = out
+        self.lock = threading.Lock()
+        self.loop = None
+        self.semaphore = None
+        self.thread = None
+
+    def __start(self):
+        with self.lock:
+            if self.loop is not None:
+                return
+
+            ready = threading.Event()
+
+            def run_loop():
+                self.loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self.loop)
+                self.semaphore = asyncio.Semaphore(self.concurrency)
+                ready.set()
+                self.loop.run_forever()
+
+            self.thread = threading.Thread(target=run_loop, name="command-runner", daemon=True)
+            self.thread.start()
+            ready.wait()
+
+    def close(self):
+        with self.lock:
+            if self.loop is None:
+                return
+
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.loop = None
+
+    def __write_line(self, prefix, line):
+        write_line(prefix + line, self.out)
+
+    def __new_session(self, cmd, pipe):
+        # Interactive commands may need the terminal, so they stay in our
+        # session, and so does sudo so it can ask for a password and use the
+        # credentials cached for this terminal. Everything else gets its own
+        # so a timeout can kill it all.
+        return pipe and not uses_sudo(split_command(cmd))
+
+    async def __spawn(self, cmd, pipe, cwd):
+        argv = split_command(cmd)
+        stdout = asyncio.subprocess.PIPE if pipe else None
+        stderr = asyncio.subprocess.STDOUT if pipe else None
+        new_session = self.__new_session(cmd, pipe)
+
+        if argv is None:
+            return await asyncio.create_subprocess_shell(
+                cmd, stdout=stdout, stderr=stderr, cwd=cwd, start_new_session=new_session, limit=LINE_LIMIT)
+
+        return await asyncio.create_subprocess_exec(
+            *argv, stdout=stdout, stderr=stderr, cwd=cwd, start_new_session=new_session, limit=LINE_LIMIT)
+
+    def __kill(self, proc, new_session):
+        try:
+            if new_session:
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def run_async(self, cmd, prefix=None, mode="stream", timeout=None, cwd=None):
+        if timeout is None:
+            timeout = self.timeout
+
+        pipe = mode != "interactive"
+        output = []
+
+        async with self.semaphore:
+            start = time.monotonic()
+
+            try:
+                proc = await self.__spawn(cmd, pipe, cwd)
+            except OSError as e:
+                return CommandResult(cmd, 127, time.monotonic() - start, [str(e)])
+
+            async def pump():
+                if not pipe:
+                    return
+
+                while True:
+                    line = await proc.stdout.readline()
+
+                    if not line:
+                        break
+
+                    text = line.decode(errors="replace")
+                    output.append(text)
+
+                    # Quiet commands are run for their output, keep all of it.
+                    if mode != "quiet" and len(output) > OUTPUT_TAIL_LINES:
+                        output.pop(0)
+
+                    if mode == "stream":
+                        self.__write_line(prefix if prefix is not None else "", text)
+
+            timed_out = False
+
+            try:
+                await asyncio.wait_for(asyncio.gather(pump(), proc.wait()), timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+                self.__kill(proc, self.__new_session(cmd, pipe))
+                await proc.wait()
+
+            return CommandResult(cmd, proc.returncode, time.monotonic() - start, output, timed_out)
+
+    def run(self, cmd, prefix=None, mode="stream", timeout=None, cwd=None):
+        """
+        Run one command and wait for it. cmd is an argv list or a string which
+        is only given to a shell if it uses shell syntax.
+        """
+        self.__start()
+
+        # Progress bars drawn over a prompt would hide or garble it.
+        with TerminalHandover(mode == "interactive"):
+            future = asyncio.run_coroutine_threadsafe(
+                self.run_async(cmd, prefix, mode, timeout, cwd), self.loop)
+
+            return future.result()
+
+
+_runner = CommandRunner()
+
+
+def get_runner():
+    return _runner
+
+
+def configure(concurrency=DEFAULT_CONCURRENCY, timeout=None):
+    global _runner
+
+    _runner.close()
+    _runner = CommandRunner(concurrency, timeout)
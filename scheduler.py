@@ -0,0 +1,207 @@
+import threading
+import time
+from terminal import eprint, default_print, status_print, warning_print, get_progress
+
+DEFAULT_WORKERS = 4
+
+
+def find_cycle(graph):
+    """
+    graph maps each node to the nodes it depends on. Returns a list of nodes
+    forming a cycle, or None if there isn't one.
+    """
+    visiting = set()
+    done = set()
+
+    for root in graph:
+        if root in done:
+            continue
+
+        path = [root]
+        visiting.add(root)
+        stack = [iter(graph.get(root, []))]
+
+        while len(stack) > 0:
+            node = next(stack[-1], None)
+
+            if node is None:
+                stack.pop()
+                finished = path.pop()
+                visiting.discard(finished)
+                done.add(finished)
+                continue
+
+            if node in visiting:
+                return path[path.index(node):] + [node]
+
+            if node in done:
+                continue
+
+            path.append(node)
+            visiting.add(node)
+            stack.append(iter(graph.get(node, [])))
+
+    return None
+
+
+class Task:
+    def __init__(self, name, fn, deps=None, resource=None):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps) if deps is not None else []
+        self.resource = resource
+        self.dependents = []
+        self.status = "pending"
+        self.start = None
+        self.end = None
+
+    def duration(self):
+        if self.start is None or self.end is None:
+            return 0.0
+
+        return self.end - self.start
+
+
+class Scheduler:
+    """
+    Runs tasks on a worker pool as soon as everything they depend on has
+    succeeded. A task fails if it returns False or raises, anything depending
+    on it is then skipped.
+
+    Tasks sharing a resource run one after another without failing together,
+    the others wait in the queue rather than holding a worker.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = max(1, workers)
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self.finished = threading.Condition(self.lock)
+
+    def add(self, name, fn, deps=None, resource=None):
+        if name in self.tasks:
+            raise ValueError("Duplicate task " + name)
+
+        self.tasks[name] = Task(name, fn, deps, resource)
+
+        return name
+
+    def __validate(self):
+        for task in self.tasks.values():
+            for dep in task.deps:
+                if dep not in self.tasks:
+                    raise ValueError("Task " + task.name + " depends on unknown task " + dep)
+
+                self.tasks[dep].dependents.append(task)
+
+        cycle = find_cycle({t.name: t.deps for t in self.tasks.values()})
+
+        if cycle is not None:
+            raise ValueError("Dependency cycle: " + " -> ".join(cycle))
+
+    def __run_task(self, task):
+        task.start = time.monotonic()
+
+        try:
+            ok = task.fn() is not False
+        except SystemExit:
+            ok = False
+        except Exception as e:
+            eprint("Task " + task.name + " failed: " + str(e))
+            ok = False
+
+        task.end = time.monotonic()
+
+        return ok
+
+    def __skip(self, task):
+        stack = list(task.dependents)
+
+        while len(stack) > 0:
+            t = stack.pop()
+
+            if t.status == "pending":
+                t.status = "skipped"
+                stack += t.dependents
+
+    def run(self):
+        """
+        Run every task. Returns True if they all succeeded.
+        """
+        # Not needed to load the module, only to run.
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.__validate()
+
+        remaining = {t.name: len(t.deps) for t in self.tasks.values()}
+        ready = [t for t in self.tasks.values() if remaining[t.name] == 0]
+        running = [0]
+        busy = set()
+        bar = get_progress().add("tasks", len(self.tasks), unit_bytes=False)
+
+        def done(task, ok):
+            bar.update()
+
+            with self.lock:
+                task.status = "done" if ok else "failed"
+                running[0] -= 1
+                busy.discard(task.resource)
+
+                if ok:
+                    for t in task.dependents:
+                        remaining[t.name] -= 1
+
+                        if remaining[t.name] == 0 and t.status == "pending":
+                            ready.append(t)
+                else:
+                    self.__skip(task)
+
+                self.finished.notify()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            with self.lock:
+                while True:
+                    for task in list(ready):
+                        if task.resource is not None:
+                            if task.resource in busy:
+                                continue
+
+                            busy.add(task.resource)
+
+                        ready.remove(task)
+                        task.status = "running"
+                        running[0] += 1
+                        pool.submit(lambda t=task: done(t, self.__run_task(t)))
+
+                    if running[0] == 0:
+                        break
+
+                    self.finished.wait()
+
+        bar.close()
+
+        return all(t.status == "done" for t in self.tasks.values())
+
+    def report(self, limit=None):
+        tasks = sorted([t for t in self.tasks.values() if t.start is not None],
+                       key=lambda t: t.duration(), reverse=True)
+
+        if limit is not None:
+            tasks = tasks[:limit]
+
+        if len(tasks) == 0:
+            return
+
+        status_print("Task timings")
+
+        for task in tasks:
+            line = "{:>8.2f}s  {}".format(task.duration(), task.name)
+
+            if task.status == "failed":
+                eprint(line + " (failed)")
+            else:
+                default_print(line, bold=False)
+
+        for task in self.tasks.values():
+            if task.status == "skipped":
+                warning_print("Skipped " + task.name + " because a dependency failed")
@@ -0,0 +1,87 @@
+#!/bin/bash
+#
+# Stand-in for apt, dpkg-query, pacman, yay, brew and sudo so the install
+# script can be exercised without a real package manager. Use setup.sh to
+# link it under the names of the managers you want on PATH.
+#
+# FAKE_MANAGER_STATE    File listing installed packages, one per line.
+# FAKE_MANAGER_FAIL     Space separated packages which fail to install.
+# FAKE_MANAGER_LATENCY  Seconds to sleep on every invocation.
+
+STATE="${FAKE_MANAGER_STATE:-${TMPDIR:-/tmp}/fake_manager_installed}"
+touch "$STATE"
+
+if [ -n "$FAKE_MANAGER_LATENCY" ]; then
+    sleep "$FAKE_MANAGER_LATENCY"
+fi
+
+install_packages() {
+    for pkg in "$@"; do
+        case "$pkg" in
+            -*) continue ;;
+        esac
+
+        for failing in $FAKE_MANAGER_FAIL; do
+            if [ "$pkg" = "$failing" ]; then
+                echo "error: target not found: $pkg" >&2
+                exit 1
+            fi
+        done
+    done
+
+    for pkg in "$@"; do
+        case "$pkg" in
+            -*) continue ;;
+        esac
+
+        grep -qxF "$pkg" "$STATE" || echo "$pkg" >> "$STATE"
+    done
+}
+
+name="$(basename "$0")"
+
+case "$name" in
+    sudo)
+        # sudo -v and -n only deal with credentials.
+        while [ "${1#-}" != "$1" ]; do
+            shift
+        done
+
+        if [ $# -eq 0 ]; then
+            exit 0
+        fi
+
+        exec "$@"
+        ;;
+    apt)
+        case "$1" in
+            install) shift; install_packages "$@" ;;
+            update|upgrade) ;;
+            *) echo "fake apt: unsupported command $1" >&2; exit 1 ;;
+        esac
+        ;;
+    dpkg-query)
+        while read -r pkg; do
+            printf '%s\tii \n' "$pkg"
+        done < "$STATE"
+        ;;
+    pacman|yay)
+        case "$1" in
+            -Q*) cat "$STATE" ;;
+            -S*) shift; install_packages "$@" ;;
+            *) echo "fake $name: unsupported command $1" >&2; exit 1 ;;
+        esac
+        ;;
+    brew)
+        case "$1" in
+            install) shift; install_packages "$@" ;;
+            list) cat "$STATE" ;;
+            update|upgrade) ;;
+            *) echo "fake brew: unsupported command $1" >&2; exit 1 ;;
+        esac
+        ;;
+    *)
+        echo "fake_manager.sh must be run through one of its links" >&2
+        exit 1
+        ;;
+esac
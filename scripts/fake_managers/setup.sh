@@ -0,0 +1,33 @@
+#!/bin/bash
+#
+# Link the fake package manager into a directory for the given managers.
+# Usage: setup.sh [dir] [manager...]
+# Then put the directory first on PATH.
+
+if [ $# -lt 2 ]; then
+    echo "Usage: setup.sh [dir] [manager...]" >&2
+    exit 1
+fi
+
+script="$(cd "$(dirname "$0")" && pwd)/fake_manager.sh"
+dir="$1"
+shift
+
+mkdir -p "$dir"
+ln -sf "$script" "$dir/sudo"
+
+for manager in "$@"; do
+    case "$manager" in
+        apt)
+            ln -sf "$script" "$dir/apt"
+            ln -sf "$script" "$dir/dpkg-query"
+            ;;
+        pacman|yay|brew)
+            ln -sf "$script" "$dir/$manager"
+            ;;
+        *)
+            echo "Unknown manager: $manager" >&2
+            exit 1
+            ;;
+    esac
+done
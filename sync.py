@@ -0,0 +1,502 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from terminal import default_print, warning_print
+from utils import COPY_BUFFER_SIZE, hash_file, state_dir
+from profiling import span
+from variables import VariableError, compile_template, names_in
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The ioctl behind cp --reflink on Linux.
+FICLONE = 0x40049409
+
+# Compiled templates by path, with the size and mtime they were read at.
+_templates = {}
+
+
+def default_manifest_path():
+    return os.path.join(state_dir(), "configs.json")
+
+
+def owner_of(source: str, dest: str):
+    """
+    The config a deployed file belongs to. Several configs may deploy into
+    the same directory, each only prunes its own files.
+    """
+    return os.path.abspath(source) + " -> " + os.path.normpath(dest)
+
+
+def walk_files(source: str):
+    """
+    Yield (path, relative path, stat) for every file below source. A file
+    source yields itself with an empty relative path.
+    """
+    st = os.stat(source)
+
+    if not os.path.isdir(source):
+        yield (source, "", st)
+        return
+
+    stack = [(source, "")]
+
+    while len(stack) > 0:
+        directory, rel = stack.pop()
+
+        with os.scandir(directory) as it:
+            for entry in it:
+                entry_rel = os.path.join(rel, entry.name) if rel else entry.name
+
+                if entry.is_dir():
+                    stack.append((entry.path, entry_rel))
+                elif entry.is_file():
+                    yield (entry.path, entry_rel, entry.stat())
+
+
+class FirstCopy:
+    """
+    The first copy of a source with --hardlink. Later targets wait until it's
+    in place and link to it, path stays None if it failed.
+    """
+
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.path = None
+        self.done = threading.Event()
+
+
+class FileCopier:
+    """
+    Copies file contents as cheaply as the filesystem allows: a reflink where
+    it supports copy-on-write, then copy_file_range, then a plain copy. With
+    hardlink every further copy of a source is a hard link to the first copy
+    made, so they share their contents and any later edits.
+    """
+
+    def __init__(self, hardlink=False):
+        self.hardlink = hardlink
+        self.first = {}
+        # (source device, destination device) pairs which refused a reflink.
+        self.no_reflink = set()
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def __count(self, how):
+        with self.lock:
+            self.counts[how] = self.counts.get(how, 0) + 1
+
+    def __link(self, source: str, dest: str):
+        # Whoever gets here first makes the copy the others link to.
+        with self.lock:
+            first = self.first.get(source)
+
+            if first is None:
+                self.first[source] = FirstCopy()
+                return False
+
+        if first.thread == threading.get_ident() and not first.done.is_set():
+            return False
+
+        first.done.wait()
+
+        if first.path is None:
+            return False
+
+        try:
+            os.remove(dest)
+            os.link(first.path, dest)
+        except OSError:
+            # Another filesystem, or the first copy has gone.
+            open(dest, "wb").close()
+            return False
+
+        return True
+
+    def __reflink(self, src, dst):
+        if fcntl is None:
+            return False
+
+        devices = (os.fstat(src.fileno()).st_dev, os.fstat(dst.fileno()).st_dev)
+
+        if devices in self.no_reflink:
+            return False
+
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            with self.lock:
+                self.no_reflink.add(devices)
+
+            return False
+
+        return True
+
+    def __copy_range(self, src, dst):
+        if not hasattr(os, "copy_file_range"):
+            return False
+
+        copied = 0
+
+        while True:
+            try:
+                n = os.copy_file_range(src.fileno(), dst.fileno(), COPY_BUFFER_SIZE * 64)
+            except OSError:
+                if copied == 0:
+                    return False
+
+                raise
+
+            if n == 0:
+                return True
+
+            copied += n
+
+    def copy(self, source: str, dest: str):
+        """
+        Replace the contents of dest, an empty file, with those of source.
+        """
+        with span("copy", source) as s:
+            if self.hardlink and self.__link(source, dest):
+                self.__count("hardlink")
+                s.set("how", "hardlink")
+                return
+
+            with open(source, "rb") as src, open(dest, "wb") as dst:
+                if self.__reflink(src, dst):
+                    how = "reflink"
+                elif self.__copy_range(src, dst):
+                    how = "copy_file_range"
+                else:
+                    shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+                    how = "copy"
+
+                s.set("bytes", os.fstat(src.fileno()).st_size)
+                s.set("how", how)
+
+            self.__count(how)
+
+    def remember(self, source: str, dest):
+        """
+        Called once the copy of source is in place at dest, or with None if
+        it failed. Releases the targets waiting to link to the first copy.
+        """
+        if not self.hardlink:
+            return
+
+        with self.lock:
+            first = self.first.get(source)
+
+        if first is not None and first.thread == threading.get_ident() and not first.done.is_set():
+            first.path = dest
+            first.done.set()
+
+
+class ConfigSync:
+    """
+    Copies config sources to their destinations, skipping anything that hasn't
+    changed since the last run according to a manifest of deployed files.
+    """
+
+    def __init__(self, manifest_path=None, dry_run=False, verbose=False, copier=None):
+        self.manifest_path = manifest_path if manifest_path is not None else default_manifest_path()
+        self.dry_run = dry_run
+        self.verbose = verbose
+        self.copier = copier if copier is not None else FileCopier()
+        self.files = self.__load()
+        self.changed = False
+
+    def __load(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        if not isinstance(manifest, dict) or not isinstance(manifest.get("files"), dict):
+            return {}
+
+        return manifest["files"]
+
+    def save(self):
+        if self.dry_run or not self.changed:
+            return
+
+        directory = os.path.dirname(self.manifest_path)
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".configs-")
+
+        with os.fdopen(fd, "w") as f:
+            json.dump({"files": self.files}, f)
+
+        os.replace(tmp, self.manifest_path)
+        self.changed = False
+
+    def destination_for(self, source: str, dest: str, rel: str):
+        if rel:
+            return os.path.join(dest, rel)
+
+        if dest.endswith("/") or os.path.isdir(dest):
+            return os.path.join(dest, os.path.basename(source))
+
+        return dest
+
+    def __unchanged(self, entry, src_stat, dest: str):
+        if entry is None:
+            return False
+
+        if entry["src_size"] != src_stat.st_size or entry["src_mtime_ns"] != src_stat.st_mtime_ns:
+            return False
+
+        try:
+            dest_stat = os.stat(dest)
+        except FileNotFoundError:
+            return False
+
+        return entry["size"] == dest_stat.st_size and entry["mtime_ns"] == dest_stat.st_mtime_ns
+
+    def is_deployed(self, dest: str):
+        """
+        Whether dest is a file we copied which hasn't been touched since.
+        """
+        entry = self.files.get(dest)
+
+        if entry is None:
+            return False
+
+        try:
+            st = os.lstat(dest)
+        except FileNotFoundError:
+            return False
+
+        return entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns
+
+    def forget(self, dest: str):
+        if self.files.pop(dest, None) is not None:
+            self.changed = True
+
+    def __copy(self, source: str, dest: str):
+        directory = os.path.dirname(dest)
+        Path(directory).mkdir(parents=True, exist_ok=True)
+
+        # Write next to the destination and rename so nothing ever sees a
+        # half written config.
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".dotfiles-")
+        os.close(fd)
+        copied = None
+
+        try:
+            self.copier.copy(source, tmp)
+            shutil.copystat(source, tmp)
+            os.replace(tmp, dest)
+            copied = dest
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        finally:
+            self.copier.remember(source, copied)
+
+    def __record(self, owner: str, source: str, dest: str, src_stat, digest: str, values=None):
+        dest_stat = os.stat(dest)
+
+        self.files[dest] = {
+            "owner": owner,
+            "source": source,
+            "src_size": src_stat.st_size,
+            "src_mtime_ns": src_stat.st_mtime_ns,
+            "size": dest_stat.st_size,
+            "mtime_ns": dest_stat.st_mtime_ns,
+            "sha256": digest
+        }
+
+        if values is not None:
+            # What a template was rendered with.
+            self.files[dest]["variables"] = values
+
+        self.changed = True
+
+    def __template(self, path: str, src_stat):
+        cached = _templates.get(path)
+
+        if cached is not None and cached[0] == src_stat.st_size and cached[1] == src_stat.st_mtime_ns:
+            return cached[2]
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                parts = compile_template(f.read())
+        except UnicodeDecodeError:
+            raise VariableError(path + " isn't text, it can't be a template.")
+
+        _templates[path] = (src_stat.st_size, src_stat.st_mtime_ns, parts)
+
+        return parts
+
+    def __render_file(self, owner: str, path: str, target: str, src_stat, template):
+        entry = self.files.get(target)
+
+        if self.__unchanged(entry, src_stat, target) and entry.get("variables") is not None and \
+                all(template[name] == value for name, value in entry["variables"].items()):
+            return False
+
+        parts = self.__template(path, src_stat)
+        values = {name: template[name] for name in names_in(parts)}
+        data = template.render(parts).encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+
+        if entry is not None and entry["sha256"] == digest and os.path.isfile(target) and hash_file(target) == digest:
+            if not self.dry_run:
+                self.__record(owner, path, target, src_stat, digest, values)
+            return False
+
+        if self.verbose or self.dry_run:
+            default_print("Rendering " + path + " to " + target)
+
+        if not self.dry_run:
+            directory = os.path.dirname(target)
+            Path(directory).mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".dotfiles-")
+
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+
+                shutil.copystat(path, tmp)
+                os.replace(tmp, target)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+
+            self.__record(owner, path, target, src_stat, digest, values)
+
+        return True
+
+    def __sync_file(self, owner: str, path: str, target: str, src_stat, template=None):
+        """
+        Copy path to target unless it hasn't changed. Returns whether it was
+        copied.
+        """
+        if template is not None:
+            return self.__render_file(owner, path, target, src_stat, template)
+
+        entry = self.files.get(target)
+
+        if self.__unchanged(entry, src_stat, target):
+            return False
+
+        digest = hash_file(path)
+
+        if entry is not None and entry["sha256"] == digest and os.path.isfile(target) and hash_file(target) == digest:
+            # Only the timestamps moved.
+            if not self.dry_run:
+                self.__record(owner, path, target, src_stat, digest)
+            return False
+
+        if self.verbose or self.dry_run:
+            default_print("Copying " + path + " to " + target)
+
+        if not self.dry_run:
+            self.__copy(path, target)
+            self.__record(owner, path, target, src_stat, digest)
+
+        return True
+
+    def __remove(self, target: str):
+        if self.verbose or self.dry_run:
+            warning_print("Removing " + target)
+
+        if not self.dry_run:
+            try:
+                os.remove(target)
+            except FileNotFoundError:
+                pass
+
+            del self.files[target]
+            self.changed = True
+
+    def sync(self, source: str, dest: str, template=None):
+        """
+        Bring dest up to date with source, which may be a file or a directory.
+        With template, the Variables to expand in the contents of the files,
+        they're rendered instead of copied and rendered again whenever a
+        variable they use changes. Returns the number of files copied and
+        removed.
+        """
+        copied = 0
+        removed = 0
+        owner = owner_of(source, dest)
+        seen = set()
+
+        for path, rel, src_stat in walk_files(source):
+            target = self.destination_for(source, dest, rel)
+            seen.add(target)
+
+            if self.__sync_file(owner, path, target, src_stat, template):
+                copied += 1
+
+        for target in [d for d, e in self.files.items() if e.get("owner") == owner and d not in seen]:
+            self.__remove(target)
+            removed += 1
+
+        # Files deployed before they had an owner, or by another config.
+        for target in seen:
+            entry = self.files.get(target)
+
+            if entry is not None and entry.get("owner") != owner and not self.dry_run:
+                entry["owner"] = owner
+                self.changed = True
+
+        return (copied, removed)
+
+    def sync_paths(self, source: str, dest: str, paths, template=None):
+        """
+        Like sync, but only for the given paths below source, for when it is
+        known what changed. The copies of paths which are gone are removed.
+        """
+        copied = 0
+        removed = 0
+        owner = owner_of(source, dest)
+
+        for path in paths:
+            if path == source:
+                if os.path.exists(source):
+                    c, r = self.sync(source, dest, template)
+                    copied += c
+                    removed += r
+                    continue
+
+                gone = [d for d, e in self.files.items() if e.get("owner") == owner]
+            elif os.path.isdir(path):
+                rel = os.path.relpath(path, source)
+
+                for file_path, file_rel, src_stat in walk_files(path):
+                    target = self.destination_for(source, dest, os.path.join(rel, file_rel))
+
+                    if self.__sync_file(owner, file_path, target, src_stat, template):
+                        copied += 1
+
+                continue
+            elif os.path.isfile(path):
+                target = self.destination_for(source, dest, os.path.relpath(path, source))
+
+                if self.__sync_file(owner, path, target, os.stat(path), template):
+                    copied += 1
+
+                continue
+            else:
+                prefix = self.destination_for(source, dest, os.path.relpath(path, source))
+                gone = [d for d, e in self.files.items()
+                        if e.get("owner") == owner and (d == prefix or d.startswith(prefix + os.sep))]
+
+            for target in gone:
+                self.__remove(target)
+                removed += 1
+
+        return (copied, removed)
@@ -1,4 +1,8 @@
+import os
+import shutil
 import sys
+import threading
+import time
 
 
 def _wrap_with(code):
@@ -11,6 +15,9 @@ def _wrap_with(code):
     return inner
 
 
+_output_lock = threading.RLock()
+_progress = None
+
 red_text = _wrap_with('31')
 green_text = _wrap_with('32')
 yellow_text = _wrap_with('33')
@@ -20,29 +27,48 @@ cyan_text = _wrap_with('36')
 white_text = _wrap_with('37')
 
 
+def _emit(text, end, flush, file):
+    """
+    Print text above any progress bars being drawn.
+    """
+    if _progress is not None:
+        _progress.write(text + end, file=file)
+    else:
+        with _output_lock:
+            print(text, end=end, flush=flush, file=file)
+
+
 def eprint(o, bold=True, separator=' ', end='\n', flush=False):
-    print("[!] " + red_text(o, bold=bold), sep=separator,
-          end=end, flush=flush, file=sys.stderr)
+    _emit("[!] " + red_text(o, bold=bold), end, flush, sys.stderr)
 
 
 def warning_print(o, bold=True, separator=' ', end='\n', flush=False):
-    print(yellow_text(o, bold=bold), sep=separator,
-          end=end, flush=flush, file=sys.stderr)
+    _emit(yellow_text(o, bold=bold), end, flush, sys.stderr)
 
 
 def success_print(o, bold=True, separator=' ', end='\n', flush=False):
-    print(green_text(o, bold=bold), sep=separator,
-          end=end, flush=flush, file=sys.stderr)
+    _emit(green_text(o, bold=bold), end, flush, sys.stderr)
 
 
 def status_print(o, bold=True, separator=' ', end='\n', flush=False):
-    print(cyan_text(o, bold=bold), sep=separator,
-          end=end, flush=flush, file=sys.stderr)
+    _emit(cyan_text(o, bold=bold), end, flush, sys.stderr)
 
 
 def default_print(o, bold=True, separator=' ', end='\n', flush=False):
-    print("-- " + white_text(o, bold=bold), sep=separator,
-          end=end, flush=flush, file=sys.stderr)
+    _emit("-- " + white_text(o, bold=bold), end, flush, sys.stderr)
+
+
+def write_line(text, file=None):
+    """
+    Write a line of command output without breaking the progress bars.
+    """
+    if file is None:
+        file = sys.stdout
+
+    if not text.endswith("\n"):
+        text += "\n"
+
+    _emit(text, "", True, file)
 
 
 def print_color(o, color_fn, bold=False):
@@ -58,3 +84,261 @@ def confirm_prompt(prompt_fn, yes='y', no='n'):
         opt = input()
 
     return opt == yes
+
+
+def file_size_string(bytes: int):
+    if bytes > 1_000_000_000:
+        s = "{:.2f}GB".format(bytes / 1_000_000_000)
+    elif bytes > 1_000_000:
+        s = "{:.2f}MB".format(bytes / 1_000_000)
+    elif bytes > 1_000:
+        s = "{:.2f}KB".format(bytes / 1_000)
+    else:
+        s = "{}B".format(bytes)
+
+    if len(s) < 9:
+        s = (" " * (9 - len(s))) + s
+
+    return s
+
+
+def duration_string(seconds: float):
+    seconds = int(seconds)
+
+    if seconds >= 3600:
+        return "{}:{:02d}:{:02d}".format(seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+    return "{}:{:02d}".format(seconds // 60, seconds % 60)
+
+
+class ProgressBar:
+    def __init__(self, renderer, label, total=None, unit_bytes=True, done=0):
+        self.renderer = renderer
+        self.label = label
+        self.total = total
+        self.unit_bytes = unit_bytes
+        self.done = done
+        self.initial = done
+        self.start = time.monotonic()
+        self.last_log = self.start
+        self.closed = False
+
+    def update(self, n=1):
+        self.done += n
+        self.renderer.refresh()
+
+    def rate(self):
+        elapsed = time.monotonic() - self.start
+
+        if elapsed <= 0:
+            return 0.0
+
+        return (self.done - self.initial) / elapsed
+
+    def amount_string(self, n):
+        if self.unit_bytes:
+            return file_size_string(n).strip()
+
+        return str(n)
+
+    def render(self, width):
+        label = self.label if len(self.label) <= 24 else self.label[:21] + "..."
+        rate = self.rate()
+
+        if self.unit_bytes:
+            rate_str = file_size_string(int(rate)).strip() + "/s"
+        else:
+            rate_str = "{:.1f}/s".format(rate)
+
+        if self.total:
+            fraction = min(1.0, self.done / self.total)
+            amounts = self.amount_string(self.done) + "/" + self.amount_string(self.total)
+
+            if rate > 0 and self.done < self.total:
+                eta = "ETA " + duration_string((self.total - self.done) / rate)
+            else:
+                eta = "ETA -:--"
+
+            stats = " {:5.1f}% {} {} {}".format(fraction * 100, amounts, rate_str, eta)
+            bar_width = max(10, width - len(label) - len(stats) - 4)
+            filled = int(bar_width * fraction)
+            line = "{} [{}{}]{}".format(label, "#" * filled, " " * (bar_width - filled), stats)
+        else:
+            line = "{} {} {} {}".format(label, self.amount_string(self.done), rate_str,
+                                        duration_string(time.monotonic() - self.start))
+
+        return line[:width]
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.renderer.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ProgressRenderer:
+    """
+    Draws any number of progress bars at the bottom of the terminal at most
+    rate times a second. Other output is printed above them. When the output
+    isn't a terminal the bars are logged as plain lines every log_interval
+    seconds instead.
+    """
+
+    def __init__(self, out=None, rate=10, log_interval=10):
+        self.out = out if out is not None else sys.stderr
+        self.interval = 1.0 / rate
+        self.log_interval = log_interval
+        self.bars = []
+        self.drawn = 0
+        self.last_draw = 0.0
+        # While a command has the terminal nothing is drawn, see pause().
+        self.paused = 0
+
+        try:
+            self.tty = self.out.isatty() and os.environ.get("TERM") != "dumb"
+        except (AttributeError, ValueError):
+            self.tty = False
+
+    def add(self, label, total=None, unit_bytes=True, done=0):
+        bar = ProgressBar(self, label, total, unit_bytes, done)
+
+        with _output_lock:
+            self.bars.append(bar)
+            self.refresh(force=True)
+
+        return bar
+
+    def remove(self, bar):
+        with _output_lock:
+            if bar in self.bars:
+                self.bars.remove(bar)
+
+            # Leave the final state of the bar behind.
+            width = shutil.get_terminal_size().columns - 1 if self.tty else 100
+            self.write(bar.render(width) + "\n", self.out)
+
+    def __clear(self):
+        if self.drawn > 0:
+            self.out.write("\033[%dA\r\033[J" % self.drawn)
+            self.drawn = 0
+
+    def __draw(self):
+        width = shutil.get_terminal_size().columns - 1
+
+        for bar in self.bars:
+            self.out.write("\033[K" + bar.render(width) + "\n")
+
+        self.drawn = len(self.bars)
+        self.out.flush()
+
+    def pause(self):
+        """
+        Take the bars off the terminal and stop drawing them until resume(),
+        so a command can ask its questions there.
+        """
+        with _output_lock:
+            self.paused += 1
+
+            if self.tty:
+                self.__clear()
+                self.out.flush()
+
+    def resume(self):
+        with _output_lock:
+            self.paused -= 1
+
+            if self.paused == 0 and self.tty and len(self.bars) > 0:
+                self.__draw()
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+
+        if self.paused > 0 or (not force and now - self.last_draw < self.interval):
+            return
+
+        if not _output_lock.acquire(blocking=force):
+            # Someone else is drawing right now, they'll show this update.
+            return
+
+        try:
+            self.last_draw = now
+
+            if self.tty:
+                self.__clear()
+                self.__draw()
+                return
+
+            for bar in self.bars:
+                if now - bar.last_log >= self.log_interval:
+                    bar.last_log = now
+                    self.out.write(bar.render(100) + "\n")
+                    self.out.flush()
+        finally:
+            _output_lock.release()
+
+    def write(self, text, file=None):
+        if file is None:
+            file = self.out
+
+        with _output_lock:
+            drawing = self.tty and self.paused == 0
+
+            if drawing:
+                self.__clear()
+
+            # Both streams usually end up on the same terminal, keep them in order.
+            if file is not self.out:
+                self.out.flush()
+
+            file.write(text)
+            file.flush()
+
+            if drawing and len(self.bars) > 0:
+                self.__draw()
+
+
+class TerminalHandover:
+    """
+    with TerminalHandover(): ... pauses the progress bars, if any are being
+    drawn, for a command which needs the terminal.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.progress = None
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+
+        with _output_lock:
+            self.progress = _progress
+
+        if self.progress is not None:
+            self.progress.pause()
+
+        return self
+
+    def __exit__(self, *args):
+        if self.progress is not None:
+            self.progress.resume()
+
+        return False
+
+
+def get_progress():
+    """
+    Return the progress renderer, creating it the first time.
+    """
+    global _progress
+
+    with _output_lock:
+        if _progress is None:
+            _progress = ProgressRenderer()
+
+        return _progress
@@ -0,0 +1,97 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+# The modules live at the top of the repository, next to install.py.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves the files of the server with ETags, single byte ranges and 304s,
+    and logs every request as (method, path, headers, status). Keeps the
+    connection open so pooled connections can be reused.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def do_GET(self):
+        self.respond(True)
+
+    def respond(self, send_body):
+        path = self.path.split("?")[0]
+        status = 200
+        self.server.ports.add(self.client_address[1])
+
+        if path in self.server.redirects:
+            self.server.log.append((self.command, path, dict(self.headers), 302))
+            self.send_response(302)
+            self.send_header("Location", self.server.redirects[path])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if path not in self.server.files:
+            status = 404
+        elif self.headers.get("If-None-Match") == self.server.etag:
+            status = 304
+        elif self.headers.get("Range") and self.headers.get("If-Range", self.server.etag) == self.server.etag:
+            status = 206
+
+        self.server.log.append((self.command, path, dict(self.headers), status))
+
+        if status in (304, 404):
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = self.server.files[path]
+        self.send_response(status)
+
+        if status == 206:
+            start = int(self.headers["Range"].split("=")[1].split("-")[0])
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, len(body) - 1, len(body)))
+            body = body[start:]
+
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", self.server.etag)
+
+        if path in self.server.dispositions:
+            self.send_header("Content-Disposition", self.server.dispositions[path])
+
+        self.end_headers()
+
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """
+    A local HTTP server on a free port, serving whatever the test puts in
+    its files.
+    """
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    httpd.files = {}
+    httpd.etag = '"v1"'
+    httpd.redirects = {}
+    httpd.dispositions = {}
+    httpd.log = []
+    httpd.ports = set()
+    httpd.url = "http://127.0.0.1:%d" % httpd.server_address[1]
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield httpd
+
+    httpd.shutdown()
+    httpd.server_close()
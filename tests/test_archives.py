@@ -0,0 +1,127 @@
+import io
+import os
+import sys
+import tarfile
+import zipfile
+import pytest
+from archives import ArchiveError, StreamExtractor, extract_file, extract_tar_stream, extract_zip, safe_destination
+from install import Package
+from manifest import compile_entry
+from variables import Variables, builtin_variables
+
+
+def tar_bytes(members, compression="gz"):
+    data = io.BytesIO()
+
+    with tarfile.open(fileobj=data, mode="w:" + compression) as tar:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mode = 0o755
+            tar.addfile(info, io.BytesIO(content))
+
+    return data.getvalue()
+
+
+def write_zip(path, members):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+
+
+def files_below(root):
+    found = []
+
+    for directory, _, names in os.walk(root):
+        for name in names:
+            found.append(os.path.relpath(os.path.join(directory, name), root))
+
+    return sorted(found)
+
+
+def test_safe_destination_stays_inside_dest():
+    assert safe_destination("/d", "a/./b") == os.path.join("/d", "a", "b")
+    assert safe_destination("/d", "/etc/passwd") == os.path.join("/d", "etc", "passwd")
+    assert safe_destination("/d", "a\\b") == os.path.join("/d", "a", "b")
+    assert safe_destination("/d", "../escape") is None
+    assert safe_destination("/d", "a/../../escape") is None
+    assert safe_destination("/d", "./") is None
+
+
+def test_members_escaping_dest_are_skipped(tmp_path):
+    dest = tmp_path / "dest"
+    members = {"../tar-escape": b"x", "ok/file": b"fine", "/abs": b"abs"}
+
+    count = extract_tar_stream(io.BytesIO(tar_bytes(members)), str(dest))
+
+    assert count == 2
+    assert files_below(dest) == ["abs", os.path.join("ok", "file")]
+    assert not (tmp_path / "tar-escape").exists()
+
+    write_zip(tmp_path / "a.zip", {"../zip-escape": b"x", "ok/file": b"fine"})
+    assert extract_zip(str(tmp_path / "a.zip"), str(dest)) == 1
+    assert not (tmp_path / "zip-escape").exists()
+
+
+def test_tar_gz_is_extracted_while_it_streams(tmp_path):
+    dest = tmp_path / "dest"
+    members = {"bin/tool": b"#!/bin/sh\n" * 10000, "share/doc.txt": b"docs", "share/skip.md": b"no"}
+    data = tar_bytes(members)
+    extractor = StreamExtractor(str(dest), ["bin/*", "*.txt"])
+
+    for i in range(0, len(data), 1000):
+        extractor.write(data[i:i + 1000])
+
+    assert extractor.finish() == 2
+    assert (dest / "bin" / "tool").read_bytes() == members["bin/tool"]
+    assert (dest / "share" / "doc.txt").read_bytes() == b"docs"
+    assert not (dest / "share" / "skip.md").exists()
+    assert os.stat(dest / "bin" / "tool").st_mode & 0o777 == 0o755
+
+
+def test_corrupt_stream_is_reported(tmp_path):
+    extractor = StreamExtractor(str(tmp_path / "dest"))
+    extractor.write(b"not a tar archive" * 100)
+
+    with pytest.raises(ArchiveError):
+        extractor.finish()
+
+
+def test_zip_members_are_extracted_in_parallel_with_include_globs(tmp_path):
+    members = {"fonts/Font-" + str(i) + ".ttf": bytes([i]) * 1000 for i in range(20)}
+    members["fonts/LICENSE"] = b"license"
+    members["readme.md"] = b"readme"
+    write_zip(tmp_path / "fonts.zip", members)
+    dest = tmp_path / "dest"
+    opened = []
+
+    def opener():
+        opened.append(1)
+        return open(tmp_path / "fonts.zip", "rb")
+
+    assert extract_zip(opener, str(dest), ["*.ttf"], workers=4) == 20
+    assert files_below(dest) == sorted(os.path.join("fonts", "Font-" + str(i) + ".ttf") for i in range(20))
+    assert all((dest / name).read_bytes() == content for name, content in members.items() if name.endswith(".ttf"))
+    # One for the index, then one per worker.
+    assert 2 <= len(opened) <= 5
+
+
+def test_extract_directive_expands_the_font_dir(tmp_path):
+    home = str(tmp_path / "home")
+    variables = Variables(builtin_variables()).child(HOME=home)
+    entry = {
+        "name": "firacode-nerdfont",
+        "url": "https://example.com/FiraCode.zip",
+        "extract": {"dest": "%(FONT_DIR)", "include": "*.ttf"},
+        "supported-package-managers": None
+    }
+    package = Package(compile_entry(entry, variables))
+    font_dir = os.path.join(home, "Library/Fonts" if sys.platform == "darwin" else ".local/share/fonts")
+
+    assert package.extract.dest == font_dir
+    assert package.extract.include == ["*.ttf"]
+
+    write_zip(tmp_path / "FiraCode.zip", {"Fira Code Regular.ttf": b"font", "readme.md": b"readme"})
+
+    assert extract_file(str(tmp_path / "FiraCode.zip"), package.extract.dest, package.extract.include) == 1
+    assert os.listdir(font_dir) == ["Fira Code Regular.ttf"]
@@ -0,0 +1,89 @@
+import os
+import pytest
+import downloads
+from bundle import Bundle, BundleError, BundleWriter, KIND_FILE, KIND_REPO
+from install import Options, Package, create_bundle
+from manifest import compile_entry
+from variables import Variables
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+    return str(path)
+
+
+def test_written_bundle_reads_back(tmp_path):
+    tool = write(tmp_path / "tool.tar.gz", b"tool" * 5000)
+    repo = write(tmp_path / "repo.bundle", b"repo")
+    writer = BundleWriter(str(tmp_path / "out.bundle"))
+    writer.add(KIND_FILE, "https://example.com/tool", tool, "tool-1.0.tar.gz")
+    writer.add(KIND_REPO, "https://example.com/repo.git", repo)
+
+    assert writer.write() == os.path.getsize(tmp_path / "out.bundle")
+
+    bundle = Bundle(str(tmp_path / "out.bundle"))
+    entry = bundle.lookup(KIND_FILE, "https://example.com/tool")
+
+    assert entry["filename"] == "tool-1.0.tar.gz"
+    assert bundle.open(entry).read() == b"tool" * 5000
+    assert bytes(bundle.view(bundle.lookup(KIND_REPO, "https://example.com/repo.git"))) == b"repo"
+    assert bundle.lookup(KIND_FILE, "https://example.com/missing") is None
+
+    bundle.write_to(entry, str(tmp_path / "copy"))
+    assert (tmp_path / "copy").read_bytes() == b"tool" * 5000
+
+
+def test_corrupted_member_is_rejected(tmp_path):
+    good = write(tmp_path / "good", b"good" * 100)
+    bad = write(tmp_path / "bad", b"bad" * 100)
+    writer = BundleWriter(str(tmp_path / "out.bundle"))
+    writer.add(KIND_FILE, "good", good)
+    writer.add(KIND_FILE, "bad", bad)
+    writer.write()
+
+    bundle = Bundle(str(tmp_path / "out.bundle"))
+    offset = bundle.start + bundle.lookup(KIND_FILE, "bad")["offset"]
+
+    with open(tmp_path / "out.bundle", "r+b") as f:
+        f.seek(offset)
+        f.write(b"X")
+
+    bundle = Bundle(str(tmp_path / "out.bundle"))
+
+    assert bytes(bundle.view(bundle.lookup(KIND_FILE, "good"))) == b"good" * 100
+
+    with pytest.raises(BundleError):
+        bundle.view(bundle.lookup(KIND_FILE, "bad"))
+
+
+def test_not_a_bundle(tmp_path):
+    with pytest.raises(BundleError):
+        Bundle(write(tmp_path / "empty", b""))
+
+    with pytest.raises(BundleError):
+        Bundle(write(tmp_path / "other", b"x" * 100))
+
+
+def test_packages_sharing_a_url_are_bundled_once(server, tmp_path, monkeypatch):
+    server.files["/font.zip"] = b"font" * 1000
+    server.files["/tool.tar.gz"] = b"tool" * 1000
+    variables = Variables({"HOME": str(tmp_path)})
+    packages = [Package(compile_entry({"name": name, "url": server.url + path, "supported-package-managers": None},
+                                      variables))
+                for name, path in [("font", "/font.zip"), ("font-bold", "/font.zip"), ("tool", "/tool.tar.gz")]]
+    monkeypatch.chdir(tmp_path)
+    downloads.configure(cache_dir=str(tmp_path / "cache"), workers=2)
+
+    try:
+        create_bundle(packages, Options(["--output", str(tmp_path / "out.bundle"), "--jobs", "2"]))
+    finally:
+        downloads.configure()
+
+    bundle = Bundle(str(tmp_path / "out.bundle"))
+
+    assert len(bundle.index[KIND_FILE]) == 2
+    assert bundle.open(bundle.lookup(KIND_FILE, server.url + "/font.zip")).read() == b"font" * 1000
+    assert bundle.open(bundle.lookup(KIND_FILE, server.url + "/tool.tar.gz")).read() == b"tool" * 1000
+    assert [path for method, path, _, _ in server.log].count("/font.zip") == 1
@@ -0,0 +1,74 @@
+import os
+from cache import DownloadCache, url_key
+
+
+def store(cache, tmp_path, url, data, release=True):
+    path = tmp_path / ("download-" + url_key(url + str(data))[:8])
+    path.write_bytes(data)
+    entry = cache.store(url, str(path), url_key(str(data)), "file", {})
+
+    if release:
+        cache.unpin(entry["sha256"])
+
+    return entry
+
+
+def test_new_version_replaces_the_old_object(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"), max_size=10000)
+
+    for version in range(5):
+        store(cache, tmp_path, "https://example.com/tool", bytes([version]) * 3000)
+
+    assert len(cache.index) == 1
+    assert os.listdir(cache.objects_path) == [cache.index["https://example.com/tool"]["sha256"]]
+    assert cache.total_size() == 3000
+
+
+def test_content_shared_with_another_url_is_kept(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"))
+    first = store(cache, tmp_path, "https://example.com/a", b"same")
+    store(cache, tmp_path, "https://example.com/b", b"same")
+    store(cache, tmp_path, "https://example.com/a", b"new")
+
+    assert os.path.isfile(cache.object_path(first["sha256"]))
+    assert cache.lookup("https://example.com/b")["sha256"] == first["sha256"]
+
+
+def test_eviction_counts_objects_the_index_lost(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"), max_size=10000)
+
+    # Left behind by an older version of the cache.
+    with open(cache.object_path("0" * 64), "wb") as f:
+        f.write(b"x" * 8000)
+
+    store(cache, tmp_path, "https://example.com/old", b"o" * 1000)
+    store(cache, tmp_path, "https://example.com/new", b"n" * 3000)
+
+    assert not os.path.exists(cache.object_path("0" * 64))
+    assert set(cache.index) == {"https://example.com/old", "https://example.com/new"}
+    assert cache.total_size() == 4000
+
+
+def test_objects_in_use_are_evicted_once_released(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"), max_size=5000)
+    used = store(cache, tmp_path, "https://example.com/used", b"u" * 3000, release=False)
+    assert cache.pin(used["sha256"])
+
+    store(cache, tmp_path, "https://example.com/other", b"o" * 3000)
+
+    # Still being extracted, so the newer download stays over the limit.
+    assert os.path.isfile(cache.object_path(used["sha256"]))
+
+    cache.unpin(used["sha256"])
+    assert os.path.isfile(cache.object_path(used["sha256"]))
+
+    cache.unpin(used["sha256"])
+    assert not os.path.exists(cache.object_path(used["sha256"]))
+    assert cache.lookup("https://example.com/used") is None
+    assert cache.total_size() == 3000
+
+
+def test_pinning_an_evicted_object_fails(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"))
+
+    assert not cache.pin("0" * 64)
@@ -0,0 +1,129 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import downloads
+from downloads import DownloadError
+
+
+BODY = bytes(range(256)) * 1024
+ETAG = '"v1"'
+
+
+@pytest.fixture
+def server(server):
+    server.files["/files/archive.bin"] = BODY
+    server.etag = ETAG
+
+    return server
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Downloads land in the current directory, the cache lives next to it.
+    """
+    work = tmp_path / "work"
+    work.mkdir()
+    monkeypatch.chdir(work)
+    downloads.configure(cache_dir=str(tmp_path / "cache"), workers=2)
+
+    yield work
+
+    downloads.configure()
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_interrupted_download_is_resumed_with_a_range_request(server, workdir):
+    url = server.url + "/files/archive.bin"
+    part = downloads.partial_path(url)
+
+    with open(part, "wb") as f:
+        f.write(BODY[:1000])
+
+    with open(part + ".validator", "w") as f:
+        f.write(ETAG)
+
+    filename = downloads.download_file(url, progress=False, sha256=hashlib.sha256(BODY).hexdigest())
+
+    assert filename == "archive.bin"
+    assert read(filename) == BODY
+    _, _, headers, status = server.log[-1]
+    assert headers["Range"] == "bytes=1000-"
+    assert headers["If-Range"] == ETAG
+    assert status == 206
+    assert not os.path.exists(part)
+
+
+def test_changed_file_is_downloaded_again_instead_of_resumed(server, workdir):
+    url = server.url + "/files/archive.bin"
+    part = downloads.partial_path(url)
+
+    with open(part, "wb") as f:
+        f.write(b"stale")
+
+    with open(part + ".validator", "w") as f:
+        f.write('"v0"')
+
+    filename = downloads.download_file(url, progress=False)
+
+    assert read(filename) == BODY
+    assert server.log[-1][3] == 200
+
+
+def test_checksum_mismatch_is_rejected(server, workdir):
+    url = server.url + "/files/archive.bin"
+
+    with pytest.raises(DownloadError):
+        downloads.download_file(url, progress=False, sha256="0" * 64)
+
+    assert not os.path.exists("archive.bin")
+    assert not os.path.exists(downloads.partial_path(url))
+    assert downloads.get_cache().lookup(url) is None
+
+
+def test_cached_download_is_revalidated(server, workdir):
+    url = server.url + "/files/archive.bin"
+    downloads.download_file(url, progress=False)
+    os.remove("archive.bin")
+
+    filename = downloads.download_file(url, progress=False)
+
+    assert read(filename) == BODY
+    _, _, headers, status = server.log[-1]
+    assert headers["If-None-Match"] == ETAG
+    assert status == 304
+    assert [s for _, _, _, s in server.log] == [200, 304]
+
+
+def test_file_name_comes_from_the_get_response(server, workdir):
+    server.files["/download"] = b"disposition"
+    server.dispositions["/download"] = "attachment; filename*=UTF-8''tool%201.0.tar.gz"
+    server.files["/releases/tool-1.2.zip"] = b"redirected"
+    server.redirects["/latest"] = "/releases/tool-1.2.zip"
+
+    assert downloads.download_file(server.url + "/download?id=1", progress=False) == "tool 1.0.tar.gz"
+    assert downloads.download_file(server.url + "/latest", progress=False) == "tool-1.2.zip"
+    assert read("tool 1.0.tar.gz") == b"disposition"
+    assert read("tool-1.2.zip") == b"redirected"
+    assert "HEAD" not in [method for method, _, _, _ in server.log]
+
+
+def test_concurrent_downloads_share_pooled_connections(server, workdir):
+    names = ["file" + str(i) for i in range(8)]
+
+    for name in names:
+        server.files["/" + name] = name.encode() * 1000
+
+    # As many at once as the scheduler runs with --jobs 2.
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        files = list(pool.map(lambda name: downloads.download_file(server.url + "/" + name, False), names))
+
+    assert files == names
+    assert all(read(name) == name.encode() * 1000 for name in names)
+    # One pooled connection per worker, not one per download.
+    assert len(server.ports) <= 2
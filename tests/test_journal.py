@@ -0,0 +1,34 @@
+from journal import Journal
+
+
+def test_completed_steps_are_skipped_until_the_entry_changes(tmp_path):
+    journal = Journal(str(tmp_path / "journal.sqlite"))
+    journal.record("fish", "install", "hash1", True, 0.1)
+
+    assert journal.is_done("fish", "install", "hash1")
+    assert not journal.is_done("fish", "install", "hash2")
+
+    journal.record("fish", "install", "hash2", False, 0.1)
+
+    assert not journal.is_done("fish", "install", "hash2")
+
+
+def test_deployed_configs_dont_count_as_started(tmp_path):
+    journal = Journal(str(tmp_path / "journal.sqlite"))
+    journal.record("git", "configs", "hash", True, 0.1)
+
+    assert not journal.is_started("git", "hash")
+
+
+def test_install_steps_count_as_started(tmp_path):
+    journal = Journal(str(tmp_path / "journal.sqlite"))
+    journal.record("neovim", "fetch", "hash", True, 0.1)
+    journal.record("rustup", "install-cmd 0", "hash", True, 0.1)
+    journal.record("fish", "post-install-cmd 1", "hash", True, 0.1)
+    journal.record("cmake", "install", "hash", False, 0.1)
+
+    assert journal.is_started("neovim", "hash")
+    assert journal.is_started("rustup", "hash")
+    assert journal.is_started("fish", "hash")
+    assert not journal.is_started("cmake", "hash")
+    assert not journal.is_started("neovim", "other")
@@ -0,0 +1,127 @@
+import os
+from install import Options, Package, target_manifest, unlink_configs
+from links import LinkFarm
+from manifest import compile_entry
+from sync import ConfigSync
+from variables import Variables
+
+
+def write(path, text="x\n"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def new_farm(tmp_path, sync=None):
+    return LinkFarm(str(tmp_path / "state" / "links.json"), sync=sync)
+
+
+def test_directory_is_linked_whole_then_left_alone(tmp_path):
+    source = str(tmp_path / "repo" / "nvim")
+    dest = str(tmp_path / "home" / ".config" / "nvim")
+    write(os.path.join(source, "init.lua"))
+
+    farm = new_farm(tmp_path)
+    assert farm.link(source, dest) == (1, 0, [])
+    assert os.readlink(dest) == source
+
+    assert farm.link(source, dest) == (0, 0, [])
+
+
+def test_directory_linked_by_another_config_is_unfolded(tmp_path):
+    first = str(tmp_path / "repo" / "a" / "bin")
+    second = str(tmp_path / "repo" / "b" / "bin")
+    dest = str(tmp_path / "home" / "bin")
+    write(os.path.join(first, "one"))
+    write(os.path.join(second, "two"))
+
+    farm = new_farm(tmp_path)
+    assert farm.link(first, dest) == (1, 0, [])
+
+    linked, removed, conflicts = farm.link(second, dest)
+
+    assert (linked, removed, conflicts) == (1, 0, [])
+    assert not os.path.islink(dest)
+    assert os.readlink(os.path.join(dest, "one")) == os.path.join(first, "one")
+    assert os.readlink(os.path.join(dest, "two")) == os.path.join(second, "two")
+
+    # Each config still only undoes its own links, the directory goes with
+    # the last of them.
+    assert farm.undo(second) == 1
+    assert os.path.islink(os.path.join(dest, "one"))
+    assert not os.path.lexists(os.path.join(dest, "two"))
+
+    assert farm.undo(first) == 1
+    assert not os.path.lexists(dest)
+
+
+def test_foreign_files_are_never_replaced(tmp_path):
+    source = str(tmp_path / "repo" / "gitconfig")
+    dest = str(tmp_path / "home" / ".gitconfig")
+    other = str(tmp_path / "home" / ".gitconfig-other")
+    write(source, "[user]\n")
+    write(dest, "mine\n")
+
+    farm = new_farm(tmp_path)
+    linked, removed, conflicts = farm.link(source, dest)
+
+    assert (linked, removed) == (0, 0)
+    assert conflicts == [(dest, "already exists")]
+    assert not os.path.islink(dest)
+
+    os.remove(dest)
+    write(other)
+    os.symlink(other, dest)
+
+    assert farm.link(source, dest)[2] == [(dest, "is a symlink to " + other)]
+    assert os.readlink(dest) == other
+
+
+def test_copied_config_is_replaced_by_a_link(tmp_path):
+    source = str(tmp_path / "repo" / "gitconfig")
+    dest = str(tmp_path / "home" / ".gitconfig")
+    write(source, "[user]\n")
+
+    sync = ConfigSync(str(tmp_path / "state" / "configs.json"))
+    sync.sync(source, dest)
+    farm = new_farm(tmp_path, sync)
+
+    assert farm.link(source, dest) == (1, 0, [])
+    assert os.readlink(dest) == source
+    assert not sync.is_deployed(dest)
+
+
+def test_unlink_configs_only_removes_links_into_the_repository(tmp_path, monkeypatch):
+    repo = tmp_path / "repo"
+    home = tmp_path / "home"
+    home.mkdir()
+    write(str(repo / "config" / "fish" / "config.fish"))
+    write(str(repo / "config" / "starship.toml"))
+    monkeypatch.chdir(repo)
+    monkeypatch.setenv("XDG_STATE_HOME", str(tmp_path / "state"))
+
+    package = Package(compile_entry({
+        "name": "fish",
+        "configs": [{"source": "config/fish", "dest": "%(HOME)/.config/fish"},
+                    {"source": "config/starship.toml", "dest": "%(HOME)/.config/starship.toml"}],
+        "supported-package-managers": ["apt"]
+    }, Variables({"HOME": "/nonexistent"})))
+
+    farm = LinkFarm(target_manifest(str(home), "links"))
+    assert farm.link("config/fish", str(home / ".config" / "fish"))[0] == 1
+    assert farm.link("config/starship.toml", str(home / ".config" / "starship.toml"))[0] == 1
+    farm.save()
+
+    # Replaced by the user since, and a link of their own.
+    os.remove(home / ".config" / "starship.toml")
+    write(str(home / "mine.toml"))
+    os.symlink(str(home / "mine.toml"), str(home / ".config" / "starship.toml"))
+    os.symlink(str(home / "mine.toml"), str(home / ".config" / "other.toml"))
+
+    unlink_configs([package], Options(["--target", str(home)]))
+
+    assert not os.path.lexists(home / ".config" / "fish")
+    assert os.readlink(home / ".config" / "starship.toml") == str(home / "mine.toml")
+    assert os.readlink(home / ".config" / "other.toml") == str(home / "mine.toml")
+    assert LinkFarm(target_manifest(str(home), "links")).links == {}
@@ -0,0 +1,86 @@
+import os
+import time
+import pytest
+import managers
+from install import Options
+
+
+@pytest.fixture(autouse=True)
+def reset_managers():
+    yield
+    managers.configure()
+
+
+def test_confirmed_plans_install_without_asking_again():
+    managers.configure()
+
+    assert managers.install_command("apt") == ["sudo", "apt", "install", "-y"]
+    assert managers.install_command("pacman") == ["sudo", "pacman", "-S", "--noconfirm"]
+    assert managers.install_command("yay") == ["yay", "-S", "--noconfirm"]
+    assert managers.install_command("brew") == ["brew", "install"]
+
+
+def test_answers_up_front_make_a_run_unattended(tmp_path):
+    answers = tmp_path / "answers.json"
+    answers.write_text("{}")
+
+    assert Options(["--no-prompt"]).unattended()
+    assert Options(["--answers", str(answers)]).unattended()
+    assert not Options([]).unattended()
+
+
+def test_chunks_stay_under_the_limit():
+    base = ["sudo", "apt", "install"]
+    names = ["package" + str(i) for i in range(100)]
+    chunks = managers.chunk_names(base, names, limit=500)
+
+    assert [n for chunk in chunks for n in chunk] == names
+    assert len(chunks) > 1
+    assert all(sum(len(a) + 1 + 8 for a in base + chunk) <= 500 for chunk in chunks)
+
+
+def test_upgrade_runs_the_system_update_after_the_refresh():
+    managers.configure()
+
+    assert managers.upgrade_commands("apt") == [["sudo", "apt", "upgrade"]]
+    assert managers.upgrade_commands("pacman") == [["sudo", "pacman", "-Su"]]
+
+
+def test_upgrade_skips_confirmation_when_unattended():
+    managers.configure(unattended=True)
+
+    assert managers.upgrade_commands("apt") == [["sudo", "apt", "upgrade", "-y"]]
+    assert managers.upgrade_commands("yay") == [["yay", "-Su", "--noconfirm"]]
+    assert managers.upgrade_commands("brew") == [["brew", "upgrade"]]
+
+
+def fake_sudo(tmp_path, monkeypatch):
+    log = tmp_path / "sudo.log"
+    script = tmp_path / "bin" / "sudo"
+    script.parent.mkdir()
+    script.write_text("#!/bin/sh\nprintf '%s\\n' \"$*\" >> " + str(log) + "\n")
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", str(script.parent) + os.pathsep + os.environ["PATH"])
+
+    return log
+
+
+def test_sudo_session_asks_once_and_keeps_the_credentials_fresh(tmp_path, monkeypatch):
+    log = fake_sudo(tmp_path, monkeypatch)
+    session = managers.SudoSession(interval=0.05)
+
+    assert session.start()
+    time.sleep(0.3)
+    session.close()
+
+    calls = log.read_text().splitlines()
+    assert calls[0] == "-v"
+    assert len(calls) >= 2
+    assert all(c == "-n -v" for c in calls[1:])
+
+
+def test_only_apt_and_pacman_need_sudo():
+    assert managers.needs_sudo("apt")
+    assert managers.needs_sudo("pacman")
+    assert not managers.needs_sudo("yay")
+    assert not managers.needs_sudo("brew")
@@ -0,0 +1,119 @@
+import os
+import subprocess
+import pytest
+import repos
+
+
+def run_git(*args, cwd=None):
+    return subprocess.run(["git"] + list(args), cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def commit(work, name, text):
+    with open(os.path.join(work, name), "w") as f:
+        f.write(text)
+
+    run_git("add", name, cwd=work)
+    run_git("commit", "--quiet", "-m", "Change " + name, cwd=work)
+
+    return run_git("rev-parse", "HEAD", cwd=work)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+@pytest.fixture
+def origin(tmp_path, monkeypatch):
+    """
+    A bare repository served over file:// and a working copy to push to it
+    from, with main as the default branch and a second branch.
+    """
+    for key, value in [("GIT_AUTHOR_NAME", "Test"), ("GIT_AUTHOR_EMAIL", "test@example.com"),
+                       ("GIT_COMMITTER_NAME", "Test"), ("GIT_COMMITTER_EMAIL", "test@example.com"),
+                       ("GIT_CONFIG_GLOBAL", os.devnull), ("GIT_CONFIG_NOSYSTEM", "1")]:
+        monkeypatch.setenv(key, value)
+
+    bare = str(tmp_path / "origin.git")
+    work = str(tmp_path / "work")
+    run_git("init", "--quiet", "--bare", "--initial-branch", "main", bare)
+    run_git("clone", "--quiet", bare, work)
+    run_git("checkout", "--quiet", "-b", "main", cwd=work)
+    commit(work, "file", "one\n")
+    run_git("push", "--quiet", "origin", "main", cwd=work)
+    run_git("checkout", "--quiet", "-b", "feature", cwd=work)
+    commit(work, "file", "feature\n")
+    run_git("push", "--quiet", "origin", "feature", cwd=work)
+    run_git("checkout", "--quiet", "main", cwd=work)
+
+    repos.configure(repos_dir=str(tmp_path / "mirrors"))
+    yield ("file://" + bare, work)
+    repos.configure()
+
+
+def test_checkout_then_fast_forward(origin, tmp_path):
+    url, work = origin
+    dest = str(tmp_path / "checkout")
+
+    repos.checkout(url, dest)
+    assert read(os.path.join(dest, "file")) == "one\n"
+    assert run_git("remote", "get-url", "origin", cwd=dest) == url
+
+    commit(work, "file", "two\n")
+    run_git("push", "--quiet", "origin", "main", cwd=work)
+
+    repos.checkout(url, dest)
+    assert read(os.path.join(dest, "file")) == "two\n"
+
+
+def test_pinned_non_default_branch(origin, tmp_path):
+    url, _ = origin
+    dest = str(tmp_path / "checkout")
+
+    repos.checkout(url, dest, ref="feature")
+    assert read(os.path.join(dest, "file")) == "feature\n"
+
+    # And again on the existing checkout.
+    repos.checkout(url, dest, ref="feature")
+    assert read(os.path.join(dest, "file")) == "feature\n"
+
+
+def test_pinned_tag_and_commit(origin, tmp_path):
+    url, work = origin
+    first = run_git("rev-parse", "HEAD", cwd=work)
+    run_git("tag", "v1", cwd=work)
+    commit(work, "file", "two\n")
+    run_git("push", "--quiet", "--tags", "origin", "main", cwd=work)
+
+    tagged = str(tmp_path / "tagged")
+    repos.checkout(url, tagged, ref="v1")
+    assert read(os.path.join(tagged, "file")) == "one\n"
+
+    pinned = str(tmp_path / "pinned")
+    repos.checkout(url, pinned, ref=first)
+    assert read(os.path.join(pinned, "file")) == "one\n"
+
+    repos.checkout(url, pinned, ref="main")
+    assert read(os.path.join(pinned, "file")) == "two\n"
+
+
+def test_removing_a_pin_goes_back_to_the_default_branch(origin, tmp_path):
+    url, work = origin
+    dest = str(tmp_path / "checkout")
+
+    repos.checkout(url, dest, ref="feature")
+    commit(work, "file", "two\n")
+    run_git("push", "--quiet", "origin", "main", cwd=work)
+
+    repos.checkout(url, dest)
+    assert read(os.path.join(dest, "file")) == "two\n"
+    assert run_git("rev-parse", "--abbrev-ref", "HEAD", cwd=dest) == "main"
+
+
+def test_existing_directory_which_isnt_a_checkout(origin, tmp_path):
+    url, _ = origin
+    dest = tmp_path / "checkout"
+    dest.mkdir()
+
+    with pytest.raises(repos.RepoError):
+        repos.checkout(url, str(dest))
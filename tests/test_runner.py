@@ -0,0 +1,38 @@
+import os
+from runner import CommandRunner, split_command
+
+
+def test_split_command():
+    assert split_command("git clone url") == ["git", "clone", "url"]
+    assert split_command("make && make install") is None
+    assert split_command(["a", "b c"]) == ["a", "b c"]
+
+
+def test_streamed_commands_get_their_own_session_except_sudo(tmp_path, monkeypatch):
+    script = tmp_path / "bin" / "sudo"
+    script.parent.mkdir()
+    script.write_text("#!/bin/sh\nexec python3 -c 'import os; print(os.getsid(0))'\n")
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", str(script.parent) + os.pathsep + os.environ["PATH"])
+    runner = CommandRunner()
+
+    try:
+        # sudo keeps the terminal so it can ask for a password.
+        result = runner.run(["sudo"], mode="quiet")
+        assert int(result.output[0]) == os.getsid(0)
+
+        result = runner.run(["python3", "-c", "import os; print(os.getsid(0))"], mode="quiet")
+        assert int(result.output[0]) != os.getsid(0)
+    finally:
+        runner.close()
+
+
+def test_timeout_kills_the_command():
+    runner = CommandRunner()
+
+    try:
+        result = runner.run(["sleep", "10"], mode="quiet", timeout=0.2)
+        assert result.timed_out
+        assert not result.ok()
+    finally:
+        runner.close()
@@ -0,0 +1,39 @@
+import time
+from scheduler import Scheduler
+
+
+def test_dependents_of_a_failed_task_are_skipped():
+    scheduler = Scheduler(2)
+    scheduler.add("a", lambda: False)
+    scheduler.add("b", lambda: None, ["a"])
+    scheduler.add("c", lambda: None)
+
+    assert not scheduler.run()
+    assert [scheduler.tasks[n].status for n in "abc"] == ["failed", "skipped", "done"]
+
+
+def test_tasks_sharing_a_resource_dont_hold_workers():
+    scheduler = Scheduler(2)
+    started = {}
+
+    def use(name):
+        def fn():
+            started[name] = time.monotonic()
+            time.sleep(0.1)
+
+            return name != "apt1"
+
+        return fn
+
+    for i in range(3):
+        scheduler.add("apt" + str(i), use("apt" + str(i)), resource="dpkg")
+
+    scheduler.add("brew", use("brew"), resource="brew")
+    start = time.monotonic()
+
+    assert not scheduler.run()
+    # brew got the second worker at once, the apt installs ran one at a time
+    # and kept going after one of them failed.
+    assert started["brew"] - start < 0.05
+    assert [scheduler.tasks["apt" + str(i)].status for i in range(3)] == ["done", "failed", "done"]
+    assert all(started["apt" + str(i + 1)] - started["apt" + str(i)] >= 0.09 for i in range(2))
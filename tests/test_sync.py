@@ -0,0 +1,106 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from sync import ConfigSync, FileCopier
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def new_sync(tmp_path):
+    return ConfigSync(str(tmp_path / "state" / "configs.json"))
+
+
+def test_copies_only_what_changed(tmp_path):
+    source = str(tmp_path / "repo" / "fish")
+    dest = str(tmp_path / "home" / ".config" / "fish")
+    write(os.path.join(source, "config.fish"), "set a 1\n")
+    write(os.path.join(source, "functions", "f.fish"), "function f; end\n")
+
+    sync = new_sync(tmp_path)
+    assert sync.sync(source, dest) == (2, 0)
+    sync.save()
+
+    sync = new_sync(tmp_path)
+    assert sync.sync(source, dest) == (0, 0)
+
+    write(os.path.join(source, "config.fish"), "set a 2\n")
+    os.remove(os.path.join(source, "functions", "f.fish"))
+    assert sync.sync(source, dest) == (1, 1)
+
+    with open(os.path.join(dest, "config.fish")) as f:
+        assert f.read() == "set a 2\n"
+
+    assert not os.path.exists(os.path.join(dest, "functions", "f.fish"))
+
+
+def test_configs_sharing_a_directory_keep_each_others_files(tmp_path):
+    a = str(tmp_path / "repo" / "a.sh")
+    b = str(tmp_path / "repo" / "b.sh")
+    bin_dir = str(tmp_path / "home" / ".local" / "bin") + "/"
+    write(a, "echo a\n")
+    write(b, "echo b\n")
+
+    sync = new_sync(tmp_path)
+    assert sync.sync(a, bin_dir) == (1, 0)
+    assert sync.sync(b, bin_dir) == (1, 0)
+    sync.save()
+
+    assert os.path.exists(os.path.join(bin_dir, "a.sh"))
+    assert os.path.exists(os.path.join(bin_dir, "b.sh"))
+
+    # A rerun neither removes nor copies anything again.
+    sync = new_sync(tmp_path)
+    assert sync.sync(a, bin_dir) == (0, 0)
+    assert sync.sync(b, bin_dir) == (0, 0)
+    assert not sync.changed
+
+    assert os.path.exists(os.path.join(bin_dir, "a.sh"))
+    assert os.path.exists(os.path.join(bin_dir, "b.sh"))
+
+
+def test_removed_source_file_is_pruned_only_for_its_config(tmp_path):
+    tools = str(tmp_path / "repo" / "tools")
+    extra = str(tmp_path / "repo" / "extra.sh")
+    bin_dir = str(tmp_path / "home" / "bin")
+    write(os.path.join(tools, "one.sh"), "1\n")
+    write(os.path.join(tools, "two.sh"), "2\n")
+    write(extra, "3\n")
+
+    sync = new_sync(tmp_path)
+    sync.sync(tools, bin_dir)
+    sync.sync(extra, bin_dir + "/")
+
+    os.remove(os.path.join(tools, "two.sh"))
+    assert sync.sync(tools, bin_dir) == (0, 1)
+
+    assert os.path.exists(os.path.join(bin_dir, "one.sh"))
+    assert not os.path.exists(os.path.join(bin_dir, "two.sh"))
+    assert os.path.exists(os.path.join(bin_dir, "extra.sh"))
+
+
+def test_targets_deployed_at_once_link_to_one_copy(tmp_path):
+    source = str(tmp_path / "repo" / "nvim")
+    names = ["init.lua"] + ["lua/plugin" + str(i) + ".lua" for i in range(10)]
+
+    for name in names:
+        write(os.path.join(source, name), name + "\n")
+
+    copier = FileCopier(hardlink=True)
+    targets = [str(tmp_path / ("target" + str(i))) for i in range(3)]
+
+    def deploy(target):
+        sync = ConfigSync(os.path.join(target, "configs.json"), copier=copier)
+        return sync.sync(source, os.path.join(target, "nvim"))
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        assert list(pool.map(deploy, targets)) == [(len(names), 0)] * 3
+
+    assert copier.counts.get("hardlink") == 2 * len(names)
+
+    for target in targets:
+        for name in names:
+            assert os.stat(os.path.join(target, "nvim", name)).st_nlink == 3
@@ -0,0 +1,69 @@
+import io
+import terminal
+from terminal import ProgressRenderer, TerminalHandover
+
+
+class FakeTerminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def new_renderer(monkeypatch):
+    monkeypatch.setenv("TERM", "xterm")
+    out = FakeTerminal()
+
+    return (ProgressRenderer(out), out)
+
+
+def test_output_is_printed_above_the_bars(monkeypatch):
+    renderer, out = new_renderer(monkeypatch)
+    renderer.add("download", 100)
+    out.truncate(0)
+    out.seek(0)
+
+    renderer.write("hello\n")
+
+    # Cleared, the line, then the bar again.
+    assert out.getvalue().startswith("\033[1A\r\033[J" + "hello\n")
+    assert "download" in out.getvalue()
+
+
+def test_nothing_is_drawn_while_paused(monkeypatch):
+    renderer, out = new_renderer(monkeypatch)
+    bar = renderer.add("download", 100)
+    renderer.pause()
+    out.truncate(0)
+    out.seek(0)
+
+    bar.update(50)
+    renderer.refresh(force=True)
+    renderer.write("Do you want to continue? [Y/n] ")
+
+    assert out.getvalue() == "Do you want to continue? [Y/n] "
+
+    renderer.resume()
+    assert "download" in out.getvalue()
+
+
+def test_handover_pauses_the_renderer_in_use(monkeypatch):
+    renderer, _ = new_renderer(monkeypatch)
+    monkeypatch.setattr(terminal, "_progress", renderer)
+
+    with TerminalHandover():
+        assert renderer.paused == 1
+
+    assert renderer.paused == 0
+
+    with TerminalHandover(False):
+        assert renderer.paused == 0
+
+
+def test_plain_log_lines_when_not_a_terminal():
+    out = io.StringIO()
+    renderer = ProgressRenderer(out, log_interval=0)
+    bar = renderer.add("tasks", 10, unit_bytes=False)
+    bar.update(5)
+    renderer.refresh(force=True)
+
+    assert "\033[" not in out.getvalue()
+    assert "tasks" in out.getvalue()
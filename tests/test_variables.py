@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import pytest
+from variables import Variables, VariableError
+
+
+def test_pattern_is_compiled_on_first_use():
+    # A fresh interpreter, since other tests will have compiled it already.
+    code = ("import variables; print(variables._pattern is None); "
+            "variables.Variables({'A': '1'}).expand('%(A)'); print(variables._pattern is None)")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, check=True,
+                            capture_output=True, text=True).stdout.split()
+
+    assert output == ["True", "False"]
+
+
+def test_expand_resolves_nested_variables_once():
+    calls = []
+
+    def home(v):
+        calls.append(1)
+        return "/home/me"
+
+    v = Variables({"HOME": home, "CFG": "%(HOME)/.config"})
+
+    assert v.expand("%(CFG)/fish") == "/home/me/.config/fish"
+    assert v.expand("%(HOME)") == "/home/me"
+    assert len(calls) == 1
+
+
+def test_escaped_variable_is_left_as_text():
+    assert Variables({"A": "1"}).expand("%%(A) is %(A)") == "%(A) is 1"
+
+
+def test_undefined_and_recursive_variables_are_errors():
+    v = Variables({"A": "%(B)", "B": "%(A)"})
+
+    with pytest.raises(VariableError):
+        v.expand("%(C)")
+
+    with pytest.raises(VariableError):
+        v.expand("%(A)")
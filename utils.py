@@ -1,18 +1,172 @@
+import hashlib
 import os
+import threading
+from pathlib import Path
+from profiling import span
 
+# Read and write size for copying and hashing files.
+COPY_BUFFER_SIZE = 1024 * 1024
 
-def which(program):
-    def is_exe(fpath):
-        return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
 
+def state_dir():
+    """
+    Where state kept between runs lives, $XDG_STATE_HOME/dotfiles.
+    """
+    base = os.environ.get("XDG_STATE_HOME")
+
+    if not base:
+        base = os.path.join(str(Path.home()), ".local", "state")
+
+    return os.path.join(base, "dotfiles")
+
+
+def cache_dir():
+    """
+    Where anything which can be fetched or built again is kept,
+    $XDG_CACHE_HOME/dotfiles.
+    """
+    base = os.environ.get("XDG_CACHE_HOME")
+
+    if not base:
+        base = os.path.join(str(Path.home()), ".cache")
+
+    return os.path.join(base, "dotfiles")
+
+
+def hash_file(path: str, digest=None, sink=None):
+    """
+    The SHA-256 of the file at path. If digest is given the contents are
+    added to it instead, sink is fed them as well.
+    """
+    if digest is None:
+        digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+            digest.update(data)
+
+            if sink is not None:
+                sink(data)
+
+    return digest.hexdigest()
+
+
+def is_exe(fpath):
+    return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
+
+
+class PathIndex:
+    """
+    An index of the names in every $PATH directory, built with one scandir per
+    directory. It is rebuilt when $PATH or the mtime of one of its directories
+    changes.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.mtimes = []
+        self.names = {}
+        self.resolved = {}
+        self.lock = threading.Lock()
+
+    def __stat_dirs(self, dirs):
+        mtimes = []
+
+        for d in dirs:
+            try:
+                mtimes.append(os.stat(d).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+
+        return mtimes
+
+    def __refresh(self):
+        path = os.environ.get("PATH", "")
+        dirs = [d for d in path.split(os.pathsep) if d]
+        mtimes = self.__stat_dirs(dirs)
+
+        if path == self.path and mtimes == self.mtimes:
+            return
+
+        names = {}
+
+        for d, mtime in zip(dirs, mtimes):
+            if mtime is None:
+                continue
+
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        names.setdefault(entry.name, []).append(entry.path)
+            except OSError:
+                continue
+
+        self.path = path
+        self.mtimes = mtimes
+        self.names = names
+        self.resolved = {}
+
+    def __resolve(self, name):
+        if name not in self.resolved:
+            found = None
+
+            # Candidates are kept in $PATH order, the first executable wins.
+            for candidate in self.names.get(name, []):
+                if is_exe(candidate):
+                    found = candidate
+                    break
+
+            self.resolved[name] = found
+
+        return self.resolved[name]
+
+    def lookup(self, name):
+        with self.lock:
+            self.__refresh()
+            return self.__resolve(name)
+
+    def lookup_all(self, names):
+        """
+        Return a dictionary of the names which were found and their paths.
+        """
+        with self.lock:
+            self.__refresh()
+            found = {}
+
+            for name in names:
+                p = self.__resolve(name)
+
+                if p is not None:
+                    found[name] = p
+
+            return found
+
+
+_path_index = PathIndex()
+
+
+def _which(program):
     fpath, fname = os.path.split(program)
     if fpath:
         if is_exe(program):
             return program
     else:
-        for path in os.environ["PATH"].split(os.pathsep):
-            exe_file = os.path.join(path, program)
-            if is_exe(exe_file):
-                return exe_file
+        return _path_index.lookup(program)
 
     return None
+
+
+def which(program):
+    with span("which", program) as s:
+        path = _which(program)
+        s.set("status", "found" if path is not None else "missing")
+
+        return path
+
+
+def which_all(programs):
+    with span("which", "which_all", count=len(programs)) as s:
+        found = _path_index.lookup_all(programs)
+        s.set("found", len(found))
+
+        return found
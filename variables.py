@@ -0,0 +1,254 @@
+import os
+import re
+import sys
+import threading
+from pathlib import Path
+
+# %(NAME) is a variable, %%(NAME) is the literal text %(NAME). Compiled the
+# first time something is expanded, see pattern().
+PATTERN = r"%(%?)\((\w+)\)"
+
+# Built in variables the manifest can't redefine, each target has its own.
+RESERVED = ["HOME"]
+
+_pattern = None
+_compiled = {}
+_variables = None
+
+
+class VariableError(Exception):
+    pass
+
+
+def pattern():
+    global _pattern
+
+    if _pattern is None:
+        _pattern = re.compile(PATTERN)
+
+    return _pattern
+
+
+def compile_template(s: str):
+    """
+    Split s into (literal, name) parts, name is None for the last part.
+    Expanding the parts is one join instead of a search of the string.
+    """
+    parts = []
+    start = 0
+
+    for m in pattern().finditer(s):
+        if m.group(1):
+            parts.append((s[start:m.start()] + "%(" + m.group(2) + ")", None))
+        else:
+            parts.append((s[start:m.start()], m.group(2)))
+
+        start = m.end()
+
+    parts.append((s[start:], None))
+
+    return tuple(parts)
+
+
+def compiled(s: str):
+    """
+    compile_template, remembered for the short strings of the manifest.
+    """
+    parts = _compiled.get(s)
+
+    if parts is None:
+        parts = compile_template(s)
+        _compiled[s] = parts
+
+    return parts
+
+
+def names_in(parts):
+    return [name for _, name in parts if name is not None]
+
+
+class Variables:
+    """
+    The %(NAME) variables. A definition is a string, which may use other
+    variables, or a function which works the value out. Values are only
+    resolved the first time they're used and then remembered.
+    """
+
+    def __init__(self, definitions=None):
+        self.definitions = dict(definitions) if definitions is not None else {}
+        self.values = {}
+        self.resolving = set()
+        # The values resolved while tracking, see track().
+        self.used = None
+        self.lock = threading.RLock()
+
+    def define(self, name: str, definition):
+        with self.lock:
+            self.definitions[name] = definition
+            self.values = {}
+
+    def child(self, **values):
+        """
+        A copy with some values fixed, variables defined using them are
+        resolved again for the copy.
+        """
+        variables = Variables(self.definitions)
+
+        for name, value in values.items():
+            variables.definitions[name] = value
+            variables.values[name] = value
+
+        return variables
+
+    def __contains__(self, name: str):
+        return name in self.definitions
+
+    def __iter__(self):
+        return iter(sorted(self.definitions))
+
+    def __getitem__(self, name: str):
+        with self.lock:
+            if name not in self.values:
+                if name not in self.definitions:
+                    raise VariableError("%(" + name + ") isn't defined.")
+
+                if name in self.resolving:
+                    raise VariableError("%(" + name + ") is defined using itself.")
+
+                self.resolving.add(name)
+
+                try:
+                    definition = self.definitions[name]
+                    self.values[name] = definition(self) if callable(definition) else self.expand(definition)
+                finally:
+                    self.resolving.discard(name)
+
+            if self.used is not None:
+                self.used[name] = self.values[name]
+
+            return self.values[name]
+
+    def render(self, parts):
+        if len(parts) == 1:
+            return parts[0][0]
+
+        return "".join(literal + self[name] if name is not None else literal for literal, name in parts)
+
+    def expand(self, s: str):
+        if "%(" not in s:
+            return s
+
+        return self.render(compiled(s))
+
+    def check(self, s: str):
+        """
+        Raise VariableError if s uses a variable which isn't defined, without
+        resolving anything.
+        """
+        for name in names_in(compiled(s)):
+            if name not in self.definitions:
+                raise VariableError("%(" + name + ") isn't defined.")
+
+    def track(self):
+        """
+        Start remembering every value which is resolved, returns the dict
+        they're remembered in. stop() ends it.
+        """
+        with self.lock:
+            self.used = {}
+            return self.used
+
+    def stop(self):
+        with self.lock:
+            self.used = None
+
+
+def environment_variable(name: str, default=None):
+    def resolve(variables):
+        value = os.environ.get(name)
+
+        if value is not None:
+            return value
+
+        if default is None:
+            raise VariableError("$" + name + " isn't set and has no default.")
+
+        return variables.expand(default)
+
+    return resolve
+
+
+def builtin_variables():
+    return {
+        "HOME": lambda v: str(Path.home()),
+        "FONT_DIR": lambda v: v["HOME"] + ("/Library/Fonts" if sys.platform == "darwin" else "/.local/share/fonts"),
+        "LOCAL_BIN_DIR": lambda v: v["HOME"] + "/.local/bin"
+    }
+
+
+def parse_definitions(definitions):
+    """
+    Turn the "variables" section of the manifest into definitions. A value
+    is either a string or {"env": NAME, "default": string} for the value of
+    an environment variable.
+    """
+    if not isinstance(definitions, dict):
+        raise VariableError("'variables' must be a JSON object.")
+
+    parsed = {}
+
+    for name, value in definitions.items():
+        if re.fullmatch(r"\w+", name) is None:
+            raise VariableError("Invalid variable name: " + name)
+
+        if name in RESERVED:
+            raise VariableError("%(" + name + ") is built in and can't be redefined.")
+
+        if isinstance(value, str):
+            parsed[name] = value
+        elif isinstance(value, dict) and isinstance(value.get("env"), str):
+            default = value.get("default")
+            parsed[name] = environment_variable(value["env"], None if default is None else str(default))
+        else:
+            raise VariableError("%(" + name + ") must be a string or {\"env\": ..., \"default\": ...}.")
+
+    return parsed
+
+
+def configure(definitions=None):
+    """
+    Set up the variables with the manifest's definitions on top of the built
+    in ones.
+    """
+    global _variables
+
+    merged = builtin_variables()
+
+    if definitions is not None:
+        merged.update(parse_definitions(definitions))
+
+    variables = Variables(merged)
+
+    # Catch a misspelt name now instead of when it's first used.
+    for name, value in (definitions or {}).items():
+        variables.check(value if isinstance(value, str) else str(value.get("default") or ""))
+
+    _variables = variables
+
+
+def get_variables():
+    if _variables is None:
+        configure()
+
+    return _variables
+
+
+def variables_for(home: str):
+    """
+    The variables for deploying into home instead of this user's HOME.
+    """
+    return get_variables().child(HOME=home)
+
+
+def expand(s: str, variables=None):
+    return (variables if variables is not None else get_variables()).expand(s)
@@ -0,0 +1,239 @@
+import ctypes
+import fnmatch
+import os
+import select
+import struct
+import sys
+import time
+from sync import walk_files
+
+# How long the sources have to stay quiet before changes are pushed, an
+# editor's save is often a burst of writes, renames and deletes.
+DEBOUNCE_SECONDS = 0.2
+# Changes are pushed at least this often while the sources keep changing.
+MAX_DELAY_SECONDS = 2.0
+DEFAULT_POLL_INTERVAL = 1.0
+
+# Editor swap, backup and lock files.
+IGNORED_NAMES = [".*.swp", ".*.swx", ".*.swo", "*~", "4913", ".#*", "#*#"]
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+EVENT = struct.Struct("iIII")
+
+
+def is_ignored(path: str):
+    name = os.path.basename(path)
+
+    return any(fnmatch.fnmatch(name, pattern) for pattern in IGNORED_NAMES)
+
+
+def roots_of(path: str, roots):
+    return [r for r in roots if path == r or path.startswith(r + os.sep)]
+
+
+class InotifyWatcher:
+    """
+    Waits for changes below a set of config sources with inotify. Directory
+    sources are watched with every directory below them, file sources
+    through their parent directory so replacing the file is seen too.
+    Waiting costs no CPU at all.
+    """
+
+    def __init__(self, roots):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+
+        # libc is already loaded into the interpreter.
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1: " + os.strerror(ctypes.get_errno()))
+
+        self.roots = roots
+        self.dirs = {}
+
+        try:
+            for root in roots:
+                # The parent sees a file being replaced or a directory
+                # being made again.
+                self.__watch(os.path.dirname(root))
+
+                if os.path.isdir(root):
+                    self.__watch_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def __watch(self, directory: str):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+
+        if wd < 0:
+            # Usually ENOSPC, out of fs.inotify.max_user_watches.
+            raise OSError(ctypes.get_errno(), "inotify_add_watch " + directory + ": " +
+                          os.strerror(ctypes.get_errno()))
+
+        self.dirs[wd] = directory
+
+    def __watch_tree(self, directory: str):
+        self.__watch(directory)
+
+        for parent, names, _ in os.walk(directory, followlinks=True):
+            for name in names:
+                self.__watch(os.path.join(parent, name))
+
+    def __read(self, timeout):
+        """
+        The paths of the events which arrive within timeout seconds.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+
+        if len(ready) == 0:
+            return None
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        paths = set()
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+            offset += EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, everything has to be looked at.
+                paths |= set(self.roots)
+                continue
+
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+
+            if wd not in self.dirs:
+                continue
+
+            path = os.path.join(self.dirs[wd], os.fsdecode(name)) if name else self.dirs[wd]
+
+            if is_ignored(path) or len(roots_of(path, self.roots)) == 0:
+                continue
+
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                self.__watch_tree(path)
+
+            paths.add(path)
+
+        return paths
+
+    def wait(self):
+        """
+        Block until something below the sources changes, then return every
+        path which changed once they've been quiet for a moment.
+        """
+        changed = set()
+
+        while len(changed) == 0:
+            paths = self.__read(None)
+            changed |= paths if paths is not None else set()
+
+        deadline = time.monotonic() + MAX_DELAY_SECONDS
+
+        while time.monotonic() < deadline:
+            paths = self.__read(DEBOUNCE_SECONDS)
+
+            if paths is None:
+                break
+
+            changed |= paths
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Finds changes below a set of config sources by comparing their sizes and
+    mtimes every interval, for systems without inotify.
+    """
+
+    def __init__(self, roots, interval=DEFAULT_POLL_INTERVAL):
+        self.roots = roots
+        self.interval = interval
+        self.files = self.__snapshot()
+
+    def __snapshot(self):
+        files = {}
+
+        for root in self.roots:
+            try:
+                for path, _, st in walk_files(root):
+                    if not is_ignored(path):
+                        files[path] = (st.st_size, st.st_mtime_ns)
+            except FileNotFoundError:
+                continue
+
+        return files
+
+    def __changes(self):
+        files = self.__snapshot()
+        changed = {p for p in files if self.files.get(p) != files[p]}
+        changed |= {p for p in self.files if p not in files}
+        self.files = files
+
+        return changed
+
+    def wait(self):
+        changed = set()
+
+        while len(changed) == 0:
+            time.sleep(self.interval)
+            changed = self.__changes()
+
+        deadline = time.monotonic() + MAX_DELAY_SECONDS
+
+        while time.monotonic() < deadline:
+            time.sleep(DEBOUNCE_SECONDS)
+            more = self.__changes()
+
+            if len(more) == 0:
+                break
+
+            changed |= more
+
+        return changed
+
+    def close(self):
+        pass
+
+
+def watcher_for(roots, poll=False):
+    """
+    An InotifyWatcher where inotify works, otherwise a PollingWatcher.
+    Returns the watcher and whether it polls.
+    """
+    if not poll:
+        try:
+            return (InotifyWatcher(roots), False)
+        except (OSError, AttributeError):
+            pass
+
+    return (PollingWatcher(roots), True)